@@ -1,5 +1,5 @@
 import streamlit as st
-import datetime
+from refresh import render_data_status
 
 st.set_page_config(
     page_title="Hello",
@@ -29,8 +29,11 @@ This dashboard provides real-time analysis of bottle placement and market share
    - Compare brand performance
    - View detailed geographical breakdowns
 
+3. **Trends Tab**
+   - Follow Danone share over rolling 7, 30 and 90-day windows
+   - Compare post codes, stores or brands over time
+
 """)
 
 # Add version info and last update time
-st.sidebar.markdown("**Version:** 1.0.0")
-st.sidebar.markdown(f"**Last Updated:** {datetime.datetime.now().strftime('%Y-%m-%d')}")
\ No newline at end of file
+render_data_status()
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""Read-only HTTP/JSON API over the dashboard's in-memory snapshot.
+
+Serves the ``queries`` layer to consumers that are not the Streamlit pages
+(BI exports, the field-sales app) from the same published snapshots, so
+nobody has to re-run pandas over the pickle:
+
+    python api.py --port 8502
+
+Every endpoint takes ``?region=`` (default: the default region):
+
+    GET /v1/snapshot                          version and build times
+    GET /v1/shares                            shelf shares
+    GET /v1/podium                            brand shares
+    GET /v1/correlations?variable=&method=    brand x income correlations
+    GET /v1/post-codes                        post codes with detections
+    GET /v1/post-codes/<post_code>?store_type=
+    GET /v1/store-types
+    GET /v1/divergence?post_code=&store_type=
+    GET /v1/rollups/<level>                   one level of rollups.LEVELS
+    GET /v1/shelves?columns=a,b               the whole shelf frame
+
+Tables are JSON records by default, or an Arrow IPC stream with ``Accept:
+application/vnd.apache.arrow.stream`` or ``?format=arrow``. The ETag of a
+response is derived from the snapshot it was computed from and the request,
+so it changes exactly when a refresh publishes new data; ``If-None-Match``
+gets a 304. Encoded bodies are kept per snapshot in an LRU, so a repeated
+request costs a dict lookup.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pyarrow as pa
+
+import queries
+from cube import ALL_STORE_TYPES
+from regions import DEFAULT_REGION, REGIONS
+
+logger = logging.getLogger(__name__)
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+JSON = "application/json"
+
+
+class Table:
+    # Marks a DataFrame result: JSON records or Arrow, as the client asks
+    def __init__(self, frame):
+        self.frame = frame
+
+
+def _first(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def _correlations(data, params, *_):
+    return Table(queries.correlations(data, _first(params, "variable"), _first(params, "method")))
+
+
+def _post_code(data, params, post_code):
+    summary = queries.post_code_summary(data, post_code, _first(params, "store_type", ALL_STORE_TYPES))
+    if summary is None:
+        raise KeyError(post_code)
+    return summary
+
+
+def _divergence(data, params, *_):
+    post_code = _first(params, "post_code")
+    if post_code is None:
+        raise ValueError("post_code is required")
+    return Table(queries.divergence(data, post_code, _first(params, "store_type", ALL_STORE_TYPES)))
+
+
+def _shelves(data, params, *_):
+    columns = _first(params, "columns")
+    return Table(queries.shelves(data, columns.split(",") if columns else None))
+
+
+def _snapshot(data, *_):
+    return {"version": data.version, "built_at": data.built_at, "updated_at": data.updated_at}
+
+
+# path -> handler(data, params); a route ending in "/" takes one more path segment
+ROUTES = {
+    "/v1/snapshot": _snapshot,
+    "/v1/shares": lambda data, *_: queries.shelf_shares(data),
+    "/v1/podium": lambda data, *_: Table(queries.podium(data)),
+    "/v1/correlations": _correlations,
+    "/v1/post-codes": lambda data, *_: queries.post_codes(data),
+    "/v1/post-codes/": _post_code,
+    "/v1/store-types": lambda data, *_: queries.store_types(data),
+    "/v1/divergence": _divergence,
+    "/v1/rollups/": lambda data, params, level: Table(queries.rollup(data, level)),
+    "/v1/shelves": _shelves,
+}
+
+
+def _resolve(path):
+    if path in ROUTES:
+        return ROUTES[path], ()
+    prefix, _, segment = path.rpartition("/")
+    handler = ROUTES.get(prefix + "/")
+    if handler is None or not segment:
+        raise KeyError(path)
+    return handler, (segment,)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json_float(value):
+    # JSON has no NaN: missing correlations and the like become null
+    return None if isinstance(value, float) and value != value else value
+
+
+def encode(result, fmt):
+    # (content type, body) of a query result
+    if isinstance(result, Table):
+        if fmt == "arrow":
+            table = pa.Table.from_pandas(result.frame, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return ARROW_STREAM, sink.getvalue().to_pybytes()
+        return JSON, result.frame.to_json(orient="records", date_format="iso").encode()
+    if isinstance(result, dict):
+        result = {key: _json_float(value) for key, value in result.items()}
+    return JSON, json.dumps(result, default=_json_default, allow_nan=False).encode()
+
+
+class ResponseCache:
+    """Encoded responses by (snapshot, request), evicted least recently used."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def snapshot_id(region, data):
+    # Changes whenever a refresh publishes, and across restarts
+    return f"{region}:{data.version}:{data.built_at.isoformat() if data.built_at else ''}"
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Small responses go out at once instead of waiting on delayed ACKs
+    disable_nagle_algorithm = True
+    server_version = "BottleVisionAPI/1.0"
+
+    def do_GET(self):
+        try:
+            status, headers, body = self.server.api.respond(self.path, self.headers)
+        except Exception:
+            logger.exception("Request failed: %s", self.path)
+            status, headers, body = HTTPStatus.INTERNAL_SERVER_ERROR, {"Content-Type": JSON}, \
+                json.dumps({"error": "internal error"}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class Api:
+    def __init__(self, get_snapshot=None, cache=None):
+        if get_snapshot is None:
+            from refresh import get_snapshot
+        self.get_snapshot = get_snapshot
+        self.cache = cache or ResponseCache()
+
+    def respond(self, raw_path, headers):
+        # (status, headers, body) for one GET
+        url = urlsplit(raw_path)
+        params = parse_qs(url.query)
+        region = _first(params, "region", DEFAULT_REGION)
+        wants_arrow = _first(params, "format") == "arrow" or ARROW_STREAM in (headers.get("Accept") or "")
+        fmt = "arrow" if wants_arrow else "json"
+        try:
+            handler, segments = _resolve(url.path.rstrip("/") if url.path != "/" else url.path)
+            if region not in REGIONS:
+                raise KeyError(region)
+        except KeyError as error:
+            return self._error(HTTPStatus.NOT_FOUND, f"not found: {error.args[0]}")
+
+        data = self.get_snapshot(region)
+        query = tuple(sorted((name, tuple(values)) for name, values in params.items() if name != "format"))
+        key = (snapshot_id(region, data), url.path, query, fmt)
+        entry = self.cache.get(key)
+        if entry is None:
+            try:
+                content_type, body = encode(handler(data, params, *segments), fmt)
+            except KeyError as error:
+                return self._error(HTTPStatus.NOT_FOUND, f"not found: {error.args[0]}")
+            except ValueError as error:
+                return self._error(HTTPStatus.BAD_REQUEST, str(error))
+            etag = '"' + hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest() + '"'
+            entry = (etag, content_type, body)
+            self.cache.put(key, entry)
+
+        etag, content_type, body = entry
+        response_headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept",
+                            "X-Snapshot-Version": str(data.version)}
+        if etag in (headers.get("If-None-Match") or ""):
+            return HTTPStatus.NOT_MODIFIED, response_headers, b""
+        response_headers["Content-Type"] = content_type
+        return HTTPStatus.OK, response_headers, body
+
+    @staticmethod
+    def _error(status, message):
+        return status, {"Content-Type": JSON, "Cache-Control": "no-store"}, json.dumps({"error": message}).encode()
+
+
+def make_server(host="127.0.0.1", port=8502, api=None):
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.api = api or Api()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard KPIs over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.host, args.port)
+    # Build the default region's snapshot before taking requests
+    server.api.get_snapshot(DEFAULT_REGION)
+    logger.info("Serving on http://%s:%d", *server.server_address[:2])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Atomic replacement of files and directories that readers may have open.
+
+Both helpers yield a temporary path next to the target; whatever the block
+writes there replaces the target only when the block exits without an
+error, so a reader sees either the old version or the new one, never a
+half-written one. Temporary names are ``<dir>/.<name>.tmp`` for files and
+``<path>.tmp`` / ``<path>.old`` for directories; readers skip both.
+"""
+import os
+import shutil
+from contextlib import contextmanager
+
+
+@contextmanager
+def replacing_file(path):
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def replacing_directory(path):
+    # The old directory is moved aside, not overwritten: os.replace cannot
+    # replace a non-empty directory
+    tmp_path = f"{path}.tmp"
+    old_path = f"{path}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
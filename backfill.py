@@ -0,0 +1,348 @@
+"""Full backfill of the shelf frame on a process pool.
+
+``preprocess_docs`` normalizes every document into one frame and groups it on
+one core. A backfill of months of photos runs in two passes over a pool of
+worker processes instead:
+
+1. map: each shard of the source (a document-id range of the collection) is
+   read by one worker, prepared chunk by chunk with ``prepare_frame`` and
+   summed per shelf. Shelves are assigned to one of ``partitions`` buckets by
+   a hash of their store key, so every shelf lands in exactly one bucket.
+2. reduce: each bucket is summed over all shards by one worker.
+
+Workers hand their arrays over in shared memory; only the array layout and the
+distinct key values are pickled. The result equals ``preprocess_docs`` over the
+same documents in shard order, down to column order and dtypes. Brand counts
+and totals are whole numbers, so their partial sums add up exactly in any
+order. ``danone_share`` is not, so it is carried per document and summed per
+shelf in document order, as the single groupby does. Counts that are not whole
+raise ``ValueError``; the validator quarantines them. Non-numeric fields
+other than the keys are dropped, as in ``ShelfAggregator``.
+
+    python backfill.py --workers 8 --shards 64
+
+rewrites the snapshot from a full read of the collection. The history and
+quarantine tables are left to ``ingestion.py``.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from streaming import iter_chunks
+from utils import SHELF_KEYS, prepare_frame
+from validation import Validator
+
+STORE_KEYS = SHELF_KEYS[:3]
+# Columns prepare_frame appends after the document fields, in its order
+DERIVED_COLUMNS = ["total_danone", "total_non_danone", "total_bottles", "danone_share"]
+# Not whole numbers: summed per shelf in document order
+ORDERED_COLUMNS = ["danone_share"]
+DROPPED_COLUMNS = ["photo_type", "Num_bottles"]
+
+
+class FirestoreSource:
+    """The detection collection, split into document-id shards.
+
+    Picklable: each worker opens its own client and reads its shard with
+    ``FirestoreIngestor.iter_pages``.
+    """
+
+    def __init__(self, collection=None, n_shards=64, page_size=500):
+        self.collection = collection
+        self.n_shards = n_shards
+        self.page_size = page_size
+
+    def shards(self):
+        from ingestion import document_id_shards
+        return document_id_shards(self.n_shards)
+
+    def read(self, shard):
+        from ingestion import FirestoreIngestor, get_client
+        ingestor = FirestoreIngestor(get_client(), self.collection, page_size=self.page_size)
+        for page in ingestor.iter_pages(shard):
+            yield from page
+
+
+@dataclass
+class BackfillStats:
+    documents: int = 0
+    shelves: int = 0
+    workers: int = 0
+    partitions: int = 0
+    map_seconds: float = 0.0
+    reduce_seconds: float = 0.0
+    seconds: float = 0.0
+    # Documents per validation rule, plus "quarantined"
+    validation: dict = None
+
+    @property
+    def docs_per_second(self):
+        return self.documents / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        text = (f"{self.documents} documents into {self.shelves} shelves on {self.workers} workers, "
+                f"{self.seconds:.2f}s (map {self.map_seconds:.2f}s, reduce {self.reduce_seconds:.2f}s, "
+                f"{self.docs_per_second:.0f} docs/s)")
+        if self.validation:
+            text += f"; {self.validation.get('quarantined', 0)} quarantined"
+        return text
+
+
+def _share(arrays):
+    # Copy arrays into one new shared memory block; returns its name and layout
+    block = SharedMemory(create=True, size=max(sum(array.nbytes for array in arrays), 1))
+    layout, offset = [], 0
+    for array in arrays:
+        np.ndarray(array.shape, array.dtype, buffer=block.buf, offset=offset)[...] = array
+        layout.append((offset, array.shape, array.dtype.str))
+        offset += array.nbytes
+    block.close()
+    return block.name, layout
+
+
+def _read_shared(name, layout, rows=None):
+    # Copy the arrays (or the `rows` slice of each) out of a block
+    block = SharedMemory(name=name)
+    arrays = []
+    for i, (offset, shape, dtype) in enumerate(layout):
+        view = np.ndarray(shape, np.dtype(dtype), buffer=block.buf, offset=offset)
+        arrays.append((view[rows[i]] if rows is not None else view).copy())
+        del view
+    block.close()
+    return arrays
+
+
+def _unlink(name):
+    block = SharedMemory(name=name)
+    block.close()
+    block.unlink()
+
+
+def _partition(keys, n_partitions):
+    # Bucket of each row by its store key; the same in every process
+    return (pd.util.hash_pandas_object(keys[STORE_KEYS], index=False).to_numpy() % n_partitions).astype(np.intp)
+
+
+def _encode_keys(keys):
+    # Key columns as int32 codes plus the distinct values of each
+    codes, uniques = [], []
+    for key in SHELF_KEYS:
+        column_codes, column_uniques = pd.factorize(keys[key].to_numpy(dtype=object))
+        codes.append(column_codes.astype(np.int32))
+        uniques.append(np.asarray(column_uniques, dtype=object))
+    return np.column_stack(codes) if codes[0].size else np.zeros((0, len(SHELF_KEYS)), np.int32), uniques
+
+
+def _decode_keys(codes, uniques):
+    return pd.DataFrame({key: uniques[i][codes[:, i]] for i, key in enumerate(SHELF_KEYS)})
+
+
+def _check_whole(df, columns):
+    values = df[columns].to_numpy(dtype=np.float64)
+    whole = values == np.floor(values)
+    if not whole.all():
+        column = columns[int(np.flatnonzero(~whole.all(axis=0))[0])]
+        raise ValueError(f"column {column!r} holds counts that are not whole numbers; "
+                         f"validate the documents or use preprocess_docs")
+
+
+def _map_shard(task):
+    # Per-shelf sums of one shard, bucketed by partition, in shared memory
+    source, shard, labels, n_partitions, validate, chunk_size = task
+    validator = Validator(labels) if validate else None
+    columns, int_columns, validation = [], None, {}
+    sums, ordered = [], []
+    documents = 0
+    records = (doc.to_dict() if hasattr(doc, "to_dict") else doc for doc in source.read(shard))
+    for chunk in iter_chunks(records, chunk_size):
+        documents += len(chunk)
+        df_raw = pd.json_normalize(chunk, sep='_')
+        names = df_raw.columns.str.replace('predictions_', '', regex=False)
+        # First-seen column order, and which columns stay integers: both as
+        # json_normalize would decide over the whole backfill
+        columns += [name for name in names if name not in columns]
+        integers = {name for name, dtype in zip(names, df_raw.dtypes) if dtype.kind in "iub"}
+        int_columns = integers if int_columns is None else int_columns & integers
+        if validator is not None:
+            report = validator.validate(df_raw)
+            counts = report.counts()
+            counts["quarantined"] = int(report.quarantined.sum())
+            for rule, n in counts.items():
+                validation[rule] = validation.get(rule, 0) + n
+            if report.quarantined.any():
+                df_raw = df_raw[~report.quarantined].copy()
+
+        df = prepare_frame(df_raw, labels)
+        summed = [col for col in df.columns if col not in SHELF_KEYS + DROPPED_COLUMNS + ORDERED_COLUMNS
+                  and pd.api.types.is_numeric_dtype(df[col])]
+        _check_whole(df, summed)
+        sums.append(df.groupby(SHELF_KEYS, sort=False)[summed].sum())
+        ordered.append(df[SHELF_KEYS + ORDERED_COLUMNS])
+
+    meta = {"documents": documents, "columns": columns, "int_columns": int_columns or set(),
+            "validation": validation, "block": None}
+    if not sums or not sum(len(frame) for frame in ordered):
+        return meta
+
+    # Whole numbers: the chunk sums add up to the shard sums exactly
+    sums = pd.concat(sums).fillna(0).groupby(level=SHELF_KEYS, sort=False).sum()
+    ordered = pd.concat(ordered, ignore_index=True)
+
+    shelf_keys = sums.index.to_frame(index=False)
+    shelf_partition = _partition(shelf_keys, n_partitions)
+    shelf_order = np.argsort(shelf_partition, kind="stable")
+    shelf_keys = shelf_keys.iloc[shelf_order].reset_index(drop=True)
+    shelf_offsets = np.searchsorted(shelf_partition[shelf_order], np.arange(n_partitions + 1))
+
+    # Documents keep their order within each bucket; each points at its shelf row
+    doc_rows = pd.MultiIndex.from_frame(shelf_keys).get_indexer(pd.MultiIndex.from_frame(ordered[SHELF_KEYS]))
+    doc_partition = shelf_partition[shelf_order][doc_rows]
+    doc_order = np.argsort(doc_partition, kind="stable")
+    doc_rows = doc_rows[doc_order]
+    doc_offsets = np.searchsorted(doc_partition[doc_order], np.arange(n_partitions + 1))
+
+    segments = []
+    codes = np.zeros((len(shelf_keys), len(SHELF_KEYS)), dtype=np.int32)
+    for p in range(n_partitions):
+        start, end = shelf_offsets[p], shelf_offsets[p + 1]
+        codes[start:end], uniques = _encode_keys(shelf_keys.iloc[start:end])
+        segments.append((start, end, doc_offsets[p], doc_offsets[p + 1], uniques))
+    doc_rows = (doc_rows - shelf_offsets[:-1][doc_partition[doc_order]]).astype(np.int32)
+
+    meta["block"], meta["layout"] = _share([
+        sums.to_numpy(dtype=np.float64)[shelf_order],
+        ordered[ORDERED_COLUMNS].to_numpy(dtype=np.float64)[doc_order],
+        codes,
+        doc_rows,
+    ])
+    meta["sum_columns"] = list(sums.columns)
+    meta["segments"] = segments
+    return meta
+
+
+def _reduce_partition(parts):
+    # Sums of one bucket over every shard, as (block, layout, columns, uniques)
+    sums, ordered = [], []
+    for name, layout, sum_columns, (shelf_start, shelf_end, doc_start, doc_end, uniques) in parts:
+        shelves, docs = slice(shelf_start, shelf_end), slice(doc_start, doc_end)
+        values, doc_values, codes, doc_rows = _read_shared(name, layout, [shelves, docs, shelves, docs])
+        keys = _decode_keys(codes, uniques)
+        sums.append(pd.concat([keys, pd.DataFrame(values, columns=sum_columns)], axis=1))
+        ordered.append(pd.concat([keys.iloc[doc_rows].reset_index(drop=True),
+                                  pd.DataFrame(doc_values, columns=ORDERED_COLUMNS)], axis=1))
+    if not sums:
+        return None
+    # Every document of a shelf is in this bucket, in shard order, so the
+    # ordered columns are summed over the same sequence as preprocess_docs
+    result = pd.concat(sums, ignore_index=True).fillna(0).groupby(SHELF_KEYS).sum()
+    result = result.join(pd.concat(ordered, ignore_index=True).groupby(SHELF_KEYS).sum())
+    codes, uniques = _encode_keys(result.index.to_frame(index=False))
+    name, layout = _share([result.to_numpy(dtype=np.float64), codes])
+    return name, layout, list(result.columns), uniques
+
+
+def _merge_columns(metas):
+    # Column order of the single-process frame: the documents' fields in
+    # first-seen order, then the columns prepare_frame derives
+    columns = []
+    for meta in metas:
+        columns += [col for col in meta["columns"] if col not in columns]
+    columns = [col for col in columns if col not in SHELF_KEYS + DROPPED_COLUMNS + DERIVED_COLUMNS]
+    return columns + DERIVED_COLUMNS
+
+
+def backfill(source, competitor_danone_labels_dict, workers=None, partitions=None, validate=True,
+             chunk_size=50000):
+    """Shelf frame of every document of ``source``, as ``preprocess_docs`` builds it.
+
+    ``source`` has ``shards()`` and ``read(shard)``, which yields documents
+    (dicts or snapshots) and is called inside the workers. Returns the frame
+    and a ``BackfillStats``.
+    """
+    workers = workers or os.cpu_count()
+    partitions = partitions or workers * 4
+    stats = BackfillStats(workers=workers, partitions=partitions)
+    start = time.perf_counter()
+    blocks = []
+    # Workers inherit the tracker, so blocks they create are released here
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            tasks = [(source, shard, competitor_danone_labels_dict, partitions, validate, chunk_size)
+                     for shard in source.shards()]
+            metas = []
+            for meta in pool.map(_map_shard, tasks):
+                metas.append(meta)
+                if meta["block"] is not None:
+                    blocks.append(meta["block"])
+            stats.map_seconds = time.perf_counter() - start
+
+            stored = [meta for meta in metas if meta["block"] is not None]
+            tasks = [[(meta["block"], meta["layout"], meta["sum_columns"], meta["segments"][p]) for meta in stored]
+                     for p in range(partitions)]
+            frames = []
+            for reduced in pool.map(_reduce_partition, tasks):
+                if reduced is None:
+                    continue
+                name, layout, columns, uniques = reduced
+                blocks.append(name)
+                values, codes = _read_shared(name, layout)
+                frames.append(pd.concat([_decode_keys(codes, uniques), pd.DataFrame(values, columns=columns)], axis=1))
+            stats.reduce_seconds = time.perf_counter() - start - stats.map_seconds
+        finally:
+            for name in blocks:
+                _unlink(name)
+
+    stats.documents = sum(meta["documents"] for meta in metas)
+    if validate:
+        stats.validation = {}
+        for meta in metas:
+            for rule, n in meta["validation"].items():
+                stats.validation[rule] = stats.validation.get(rule, 0) + n
+    if not frames:
+        stats.seconds = time.perf_counter() - start
+        return pd.DataFrame(columns=SHELF_KEYS), stats
+
+    # A column stays int64 only if every document had it as an integer
+    int_columns = set.intersection(*(meta["int_columns"] for meta in metas if meta["documents"]))
+    df_docs = pd.concat(frames, ignore_index=True)
+    columns = [col for col in _merge_columns(metas) if col in df_docs.columns]
+    df_docs = df_docs[SHELF_KEYS + columns].fillna(0)
+    for col in columns:
+        if col in int_columns:
+            df_docs[col] = df_docs[col].astype(np.int64)
+    # Same row order as the groupby in preprocess_docs
+    df_docs = df_docs.set_index(SHELF_KEYS).sort_index().reset_index()
+    stats.shelves = len(df_docs)
+    stats.seconds = time.perf_counter() - start
+    return df_docs, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the snapshot from a full read of the collection")
+    parser.add_argument("--snapshot", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--partitions", type=int, default=None)
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--no-validate", action="store_true", help="aggregate every document unchecked")
+    args = parser.parse_args()
+
+    from data_loader import SNAPSHOT_PATH, load_labels
+    from snapshot import write_snapshot
+
+    source = FirestoreSource(n_shards=args.shards, page_size=args.page_size)
+    df_docs, stats = backfill(source, load_labels(), args.workers, args.partitions, validate=not args.no_validate)
+    write_snapshot(df_docs, args.snapshot or SNAPSHOT_PATH)
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
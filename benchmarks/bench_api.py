@@ -0,0 +1,113 @@
+# Load test of api.py on this machine: requests per second and latency
+# percentiles over keep-alive connections, for the KPI endpoints with the
+# response cache, without it, and as conditional requests answered with 304;
+# then JSON against Arrow for a bulk pull of the shelf frame.
+#
+#   python -m benchmarks.bench_api --clients 8 --seconds 5 --shelves 100000
+import argparse
+import dataclasses
+import http.client
+import threading
+import time
+
+import numpy as np
+
+import api
+from benchmarks.bench_snapshot import make_docs
+
+PATHS = [
+    "/v1/shares",
+    "/v1/podium",
+    "/v1/correlations?variable=Average+Gross+Income&method=pearson",
+    "/v1/post-codes",
+    "/v1/rollups/post_code",
+]
+
+
+def client(port, paths, deadline, conditional, latencies, statuses):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    etags = {}
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+        start = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status)
+        etags[path] = response.getheader("ETag")
+    connection.close()
+
+
+def load(port, clients, seconds, conditional=False):
+    latencies, statuses = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(port, PATHS[i % len(PATHS):] + PATHS[:i % len(PATHS)],
+                                                      deadline, conditional, latencies, statuses))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ms = np.percentile(np.asarray(latencies) * 1e3, [50, 95, 99])
+    return len(latencies) / elapsed, ms, sorted(set(statuses))
+
+
+def bulk(port, fmt, repeats=3):
+    headers = {"Accept": api.ARROW_STREAM} if fmt == "arrow" else {}
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        connection.request("GET", "/v1/shelves", headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        seconds.append(time.perf_counter() - start)
+    connection.close()
+    # First request encodes, the rest come from the response cache
+    return seconds[0], min(seconds[1:]), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--shelves", type=int, default=100000, help="rows of the synthetic frame for the bulk pull")
+    args = parser.parse_args()
+
+    from refresh import get_snapshot
+    data = get_snapshot()
+    servers = {}
+    for name, max_entries in (("cached", 512), ("uncached", 0)):
+        server = api.make_server(port=0, api=api.Api(lambda region: data, api.ResponseCache(max_entries)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[name] = server
+
+    print(f"{args.clients} clients, {args.seconds:.0f}s each, {len(PATHS)} endpoints")
+    print(f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  status")
+    for mode, server, conditional in (("uncached", servers["uncached"], False),
+                                      ("cached", servers["cached"], False),
+                                      ("conditional", servers["cached"], True)):
+        rate, ms, statuses = load(server.server_address[1], args.clients, args.seconds, conditional)
+        print(f"{mode:<12} {rate:>8,.0f} " + " ".join(f"{value:>8.2f}" for value in ms) + f"  {statuses}")
+
+    shelves = dataclasses.replace(data, df_docs=make_docs(args.shelves))
+    server = api.make_server(port=0, api=api.Api(lambda region: shelves))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"\n/v1/shelves, {args.shelves:,} rows")
+    print(f"{'format':<8} {'first':>10} {'cached':>10} {'MB':>8}")
+    for fmt in ("json", "arrow"):
+        first, cached, size = bulk(server.server_address[1], fmt)
+        print(f"{fmt:<8} {first * 1e3:>8.0f}ms {cached * 1e3:>8.0f}ms {size / 1e6:>8.1f}")
+
+    for server in list(servers.values()) + [server]:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Scaling of backfill.backfill with the number of worker processes, next to
+# single-process preprocess_docs. Synthetic documents are written to pickled
+# shard files first (not timed); each worker reads its own shards, like
+# document-id ranges of the collection. The parallel frame is checked against
+# preprocess_docs on the first --check-docs documents.
+#
+#   python -m benchmarks.bench_backfill --docs 10000000 --shards 64 --workers 1 2 4 8
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from backfill import backfill
+from benchmarks.synthetic import SyntheticDoc, make_docs
+from data_loader import BRAND_LIST, LABELS_PATH
+from utils import preprocess_docs
+
+
+class PickleSource:
+    # Shards as pickled lists of document dicts
+    def __init__(self, paths):
+        self.paths = paths
+
+    def shards(self):
+        return self.paths
+
+    def read(self, shard):
+        with open(shard, "rb") as file:
+            return pickle.load(file)
+
+
+def write_shards(directory, n_docs, n_shards, photos_per_shelf):
+    paths = []
+    for shard in range(n_shards):
+        size = n_docs // n_shards + (shard < n_docs % n_shards)
+        docs = [{**doc.to_dict(), "photo_type": str(doc.to_dict()["photo_type"])}
+                for doc in make_docs(size, BRAND_LIST, photos_per_shelf=photos_per_shelf, seed=shard)]
+        paths.append(os.path.join(directory, f"shard-{shard:04d}.pkl"))
+        with open(paths[-1], "wb") as file:
+            pickle.dump(docs, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10_000_000)
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count()}))
+    parser.add_argument("--photos-per-shelf", type=int, default=20)
+    parser.add_argument("--check-docs", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with open(LABELS_PATH) as file:
+        labels = json.load(file)
+
+    directory = tempfile.mkdtemp(prefix="bench_backfill_")
+    try:
+        check_dir = os.path.join(directory, "check")
+        os.makedirs(check_dir)
+        check_source = PickleSource(write_shards(check_dir, args.check_docs, 8, args.photos_per_shelf))
+        docs = [SyntheticDoc(i, doc) for i, doc in
+                enumerate(doc for path in check_source.shards() for doc in check_source.read(path))]
+        start = time.perf_counter()
+        expected = preprocess_docs(docs, labels)
+        single = args.check_docs / (time.perf_counter() - start)
+        result, _ = backfill(check_source, labels, workers=max(args.workers), validate=False)
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+        print(f"{args.check_docs:,} documents: identical to preprocess_docs ({single:,.0f} docs/s on one process)")
+        del docs, expected, result
+
+        paths = write_shards(directory, args.docs, args.shards, args.photos_per_shelf)
+        print(f"\n{args.docs:,} documents, {args.shards} shards, {os.cpu_count()} cores")
+        print(f"{'workers':>8} {'map':>8} {'reduce':>8} {'total':>8} {'docs/s':>10} {'speedup':>8}")
+        baseline = None
+        for workers in args.workers:
+            _, stats = backfill(PickleSource(paths), labels, workers=workers, validate=False)
+            # Speedup over the first row
+            baseline = baseline or stats.seconds
+            print(f"{workers:>8} {stats.map_seconds:>7.1f}s {stats.reduce_seconds:>7.1f}s {stats.seconds:>7.1f}s "
+                  f"{stats.docs_per_second:>10,.0f} {baseline / stats.seconds:>7.2f}x")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Compare the column-scan label mapping with the compiled BrandSchema path.
+#
+#   python -m benchmarks.bench_brand_schema --rows 10000 100000 1000000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from brand_schema import BrandSchema
+from data_loader import LABELS_PATH
+
+
+def make_shelves(n_rows, brands, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.integers(0, 6, size=(n_rows, len(brands))).astype(np.float64),
+                      columns=[f"predictions_{brand}" for brand in brands])
+    df.insert(0, "COD_POSTAL", rng.integers(8001, 8043, size=n_rows).astype(str))
+    return df
+
+
+def column_scan_totals(df, competitor_danone_labels_dict):
+    # The previous preprocess_docs path
+    df = df.copy()
+    df.columns = [col.replace('predictions_', '') if 'predictions_' in col else col for col in df.columns]
+    df['total_danone'] = df[[col for col in df.columns if competitor_danone_labels_dict.get(col, '') == 'Danone']].sum(axis=1)
+    df['total_non_danone'] = df[[col for col in df.columns if competitor_danone_labels_dict.get(col, '') == 'competitor']].sum(axis=1)
+    return df
+
+
+def schema_totals(df, brand_schema):
+    df = df.copy()
+    df.columns = df.columns.str.replace('predictions_', '', regex=False)
+    totals = brand_schema.totals(brand_schema.count_matrix(df))
+    df['total_danone'] = totals[:, 0]
+    df['total_non_danone'] = totals[:, 1]
+    return df
+
+
+def melt_divergence(df, competitor_danone_labels_dict):
+    # The previous 2_Granular_KPIs.py path
+    df_in = pd.melt(df[df.columns.intersection(list(competitor_danone_labels_dict.keys()) + ["COD_POSTAL"])],
+                    id_vars=['COD_POSTAL'], var_name='brand', value_name='value')
+    df_in['Category'] = df_in['brand'].map(competitor_danone_labels_dict)
+    df_in.loc[df_in.Category == "competitor", "value"] = df_in.loc[df_in.Category == "competitor", "value"] * -1
+    return df_in
+
+
+def divergence_frame(brand_schema, counts, post_codes):
+    # Long frame as drawn by divergence_plot_plotly, competitors negated: what
+    # BrandSchema built before the pages read the brand cube
+    n_rows, n_brands = counts.shape
+    brand_codes = np.repeat(np.arange(n_brands), n_rows)
+    category_codes = np.where(brand_schema.is_danone, 0, 1)[brand_codes]
+    signs = np.where(brand_schema.is_competitor, -1.0, 1.0)
+    return pd.DataFrame({
+        "COD_POSTAL": np.tile(np.asarray(post_codes), n_brands),
+        "brand": pd.Categorical.from_codes(brand_codes, categories=list(brand_schema.brands)),
+        "value": (counts * signs).ravel(order="F"),
+        "Category": pd.Categorical.from_codes(category_codes, categories=["Danone", "competitor"])})
+
+
+def schema_divergence(df, brand_schema):
+    return divergence_frame(brand_schema, brand_schema.count_matrix(df), df["COD_POSTAL"])
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    brand_schema = BrandSchema.from_json(LABELS_PATH)
+    competitor_danone_labels_dict = brand_schema.labels()
+
+    print(f"{'rows':>10} {'stage':<12} {'current':>10} {'schema':>10} {'speedup':>8}")
+    for n_rows in args.rows:
+        raw = make_shelves(n_rows, brand_schema.brands)
+        renamed = raw.rename(columns=lambda col: col.replace('predictions_', ''))
+        stages = {
+            "totals": (lambda: column_scan_totals(raw, competitor_danone_labels_dict),
+                       lambda: schema_totals(raw, brand_schema)),
+            "divergence": (lambda: melt_divergence(renamed, competitor_danone_labels_dict),
+                           lambda: schema_divergence(renamed, brand_schema)),
+        }
+        for stage, (current, compiled) in stages.items():
+            t_current = best_of(current, args.repeat)
+            t_schema = best_of(compiled, args.repeat)
+            print(f"{n_rows:>10} {stage:<12} {t_current * 1e3:>8.1f}ms {t_schema * 1e3:>8.1f}ms {t_current / t_schema:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
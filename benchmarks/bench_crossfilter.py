@@ -0,0 +1,89 @@
+# Cross-filter latency on the Granular page: one filter changes per step, and
+# the page reads the divergence bars and the map values. crossfilter.CrossFilter
+# (row bitmaps, only the aggregates that read the changed filter recomputed)
+# against a pandas pass over the shelf frame for both aggregates.
+#
+#   python -m benchmarks.bench_crossfilter --rows 100000 1000000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_snapshot import make_docs
+from brand_schema import BrandSchema
+from crossfilter import CrossFilter, ShelfIndex
+from data_loader import LABELS_PATH, _tidy_docs
+
+# (dimension or "column", new value) per step
+STEPS = [
+    ("post_code", ["08010"]),
+    ("post_code", ["08010", "08021"]),
+    ("store_type", ["TT"]),
+    ("brand", ["vichy"]),
+    ("brand", ["vichy", "evian"]),
+    ("income_tier", ["High"]),
+    ("column", "evian"),
+    ("post_code", []),
+    ("store_type", []),
+]
+
+
+def pandas_step(df, income, brands, selections, column):
+    mask = np.ones(len(df), dtype=bool)
+    if selections["store_type"]:
+        mask &= df["store_type"].isin(selections["store_type"]).to_numpy()
+    if selections["income_tier"]:
+        mask &= df["COD_POSTAL"].map(income).isin(selections["income_tier"]).to_numpy()
+    if selections["brand"]:
+        mask &= (df[selections["brand"]] > 0).any(axis=1).to_numpy()
+    map_values = df[mask].groupby("COD_POSTAL", observed=True)[[column, "total_danone", "total_bottles"]].sum()
+    if selections["post_code"]:
+        mask &= df["COD_POSTAL"].isin(selections["post_code"]).to_numpy()
+    return df.loc[mask, brands].sum(), map_values
+
+
+def timed_ms(function):
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for n_rows in args.rows:
+        df = _tidy_docs(make_docs(n_rows))
+        brand_schema = BrandSchema.from_json(LABELS_PATH).subset(df.columns)
+        post_codes = df["COD_POSTAL"].cat.categories
+        income = pd.Series(np.array(["Low", "Medium", "High"])[np.arange(len(post_codes)) % 3], index=post_codes)
+        counts = brand_schema.count_matrix(df, dtype=None)
+
+        start = time.perf_counter()
+        index = ShelfIndex(df, brand_schema, counts, income)
+        build = time.perf_counter() - start
+        size = (index.counts.nbytes + sum(bitmaps.nbytes for bitmaps in index.bitmaps.values())) / 1e6
+        print(f"\n{n_rows:,} shelves: index built in {build:.2f}s, {size:.0f} MB")
+
+        cross_filter = CrossFilter(index)
+        selections = dict(cross_filter.selections)
+        column = "vichy"
+        print(f"{'step':<32} {'bitmaps ms':>11} {'pandas ms':>10}")
+        rows = []
+        for dimension, value in STEPS:
+            if dimension == "column":
+                column = value
+            else:
+                cross_filter.select(dimension, value)
+                selections[dimension] = value
+            fast = timed_ms(lambda: (cross_filter.divergence(), cross_filter.map_values(column)))
+            slow = timed_ms(lambda: pandas_step(df, income, list(brand_schema.brands), selections, column))
+            rows.append(fast)
+            print(f"{dimension + ' = ' + str(value):<32} {fast:>11.2f} {slow:>10.1f}")
+        print(f"{'worst step':<32} {max(rows):>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
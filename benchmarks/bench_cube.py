@@ -0,0 +1,64 @@
+# Post-code selection latency: full-scan filter of the long frame against the
+# pre-aggregated BrandCube, as the shelf count grows.
+#
+#   python -m benchmarks.bench_cube --rows 10000 100000 1000000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_brand_schema import divergence_frame
+from brand_schema import BrandSchema
+from cube import BrandCube
+from data_loader import LABELS_PATH
+
+
+def make_docs(n_rows, brand_schema, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.integers(0, 6, size=(n_rows, len(brand_schema))).astype(np.float64),
+                      columns=list(brand_schema.brands))
+    df.insert(0, "COD_POSTAL", pd.Series(rng.integers(8001, 8043, size=n_rows)).astype(str).str.zfill(5))
+    df.insert(1, "store_type", rng.choice(["OT", "TT"], size=n_rows))
+    return df
+
+
+def scan_select(df_in, post_code):
+    # The previous 2_Granular_KPIs.py + divergence_plot_plotly path
+    df_filtered = df_in[df_in['COD_POSTAL'] == post_code]
+    danone = df_filtered[df_filtered['Category'] == 'Danone']
+    competitor = df_filtered[df_filtered['Category'] == 'competitor']
+    return danone['value'].to_numpy(), competitor['value'].to_numpy()
+
+
+def mean_latency(fn, post_codes):
+    start = time.perf_counter()
+    for post_code in post_codes:
+        fn(post_code)
+    return (time.perf_counter() - start) / len(post_codes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    brand_schema = BrandSchema.from_json(LABELS_PATH)
+    print(f"{'rows':>9} {'build cube':>11} {'scan select':>12} {'cube select':>12}")
+    for n_rows in args.rows:
+        df = make_docs(n_rows, brand_schema)
+        counts = brand_schema.count_matrix(df)
+        df_in = divergence_frame(brand_schema, counts, df["COD_POSTAL"])
+
+        start = time.perf_counter()
+        cube = BrandCube(df, brand_schema, counts)
+        build = time.perf_counter() - start
+
+        post_codes = cube.post_codes[:10]
+        scan = mean_latency(lambda post_code: scan_select(df_in, post_code), post_codes)
+        lookup = mean_latency(cube.select, post_codes)
+        print(f"{n_rows:>9} {build * 1e3:>9.1f}ms {scan * 1e3:>10.2f}ms {lookup * 1e6:>10.2f}us")
+
+
+if __name__ == "__main__":
+    main()
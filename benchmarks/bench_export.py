@@ -0,0 +1,40 @@
+# Throughput of export_reports.export in reports per minute, per output format
+# and number of worker processes, over every post code and store type of the
+# current snapshot. Files go to a temporary directory.
+#
+#   python -m benchmarks.bench_export --workers 1 2 4 --formats pdf png
+import argparse
+import os
+import shutil
+import tempfile
+
+from export_reports import FORMATS, export
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count()}))
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["pdf", "png"])
+    parser.add_argument("--region", default=None)
+    args = parser.parse_args()
+
+    from refresh import get_snapshot
+    from regions import DEFAULT_REGION
+    region = args.region or DEFAULT_REGION
+    data = get_snapshot(region)
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'format':<8} {'workers':>8} {'reports':>8} {'seconds':>8} {'ms/report':>10} {'reports/min':>12}")
+    for fmt in args.formats:
+        for workers in args.workers:
+            directory = tempfile.mkdtemp(prefix="bench_export_")
+            try:
+                _, stats = export(data, region, directory, fmt, workers)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            print(f"{fmt:<8} {workers:>8} {stats.reports:>8} {stats.seconds:>8.1f} "
+                  f"{stats.render_seconds / stats.reports * 1e3:>10.0f} {stats.reports_per_minute:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Trend queries over a year of daily history: append cost per day, then the
+# rolling index build a trend page pays cold, from the rollup cache and after
+# one more day, and the per-query cost.
+#
+#   python -m benchmarks.bench_history --days 365 --shelves 2000
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import BRAND_LIST
+from history import DATE_COLUMN, LEVELS, WINDOWS, HistoryStore, build_rolling_index
+
+
+def make_day(day, n_shelves, n_stores, rng):
+    # Day-level sums of the shelves photographed that day
+    shelf = rng.choice(n_shelves * 4, size=n_shelves, replace=False)
+    store = shelf % n_stores
+    counts = rng.poisson(2, size=(n_shelves, len(BRAND_LIST))).astype(np.float64)
+    df = pd.DataFrame(counts, columns=BRAND_LIST)
+    df.insert(0, DATE_COLUMN, day)
+    df.insert(1, "post_code", pd.Series(8001 + store % 42).astype(str).str.zfill(5))
+    df.insert(2, "store_type", np.where(store % 3, "OT", "TT"))
+    df.insert(3, "store_name", pd.Series(store).map("Store {}".format))
+    df.insert(4, "shelf id", pd.Series(shelf // n_stores).map("{}_shelf".format))
+    df["total_danone"] = counts[:, [0, 4, 9, 14]].sum(axis=1)
+    df["total_non_danone"] = counts.sum(axis=1) - df["total_danone"]
+    df["total_bottles"] = counts.sum(axis=1)
+    return df
+
+
+def timed(fn, result=False):
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    return (value, seconds) if result else seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--shelves", type=int, default=2000, help="shelves photographed per day")
+    parser.add_argument("--stores", type=int, default=1500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    days = pd.date_range(end=pd.Timestamp.today().normalize(), periods=args.days, freq="D")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(tmp)
+        start = time.perf_counter()
+        for day in days:
+            store.append(make_day(day, args.shelves, args.stores, rng))
+        append = (time.perf_counter() - start) / args.days
+        print(f"{args.days} days x {args.shelves} shelves: {append * 1e3:.1f} ms per daily append")
+
+        print(f"{'level':<10} {'groups':>7} {'cold build':>11} {'cached':>9} {'+1 day':>9} {'query':>9}")
+        for level in LEVELS:
+            cache_dir = os.path.join(tmp, "cache", level)
+            cold = timed(lambda: build_rolling_index(store, level, BRAND_LIST, cache_dir=cache_dir))
+            index, cached = timed(lambda: build_rolling_index(store, level, BRAND_LIST, cache_dir=cache_dir), result=True)
+            # A new day only reads that day's partition
+            store.append(make_day(days[-1] + pd.Timedelta(days=1), args.shelves, args.stores, rng))
+            days = days.append(pd.DatetimeIndex([days[-1] + pd.Timedelta(days=1)]))
+            incremental = timed(lambda: build_rolling_index(store, level, BRAND_LIST, cache_dir=cache_dir))
+
+            groups = index.groups[:5]
+            query = sum(timed(lambda: index.query(window, groups)) for window in WINDOWS) / len(WINDOWS)
+            print(f"{level:<10} {len(index.groups):>7} {cold * 1e3:>9.0f}ms {cached * 1e3:>7.0f}ms "
+                  f"{incremental * 1e3:>7.0f}ms {query * 1e3:>7.2f}ms")
+
+if __name__ == "__main__":
+    main()
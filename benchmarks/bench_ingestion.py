@@ -0,0 +1,98 @@
+# FirestoreIngestor against the in-process fake client of fake_firestore.py.
+# The first run is a full sharded, projected and paged read; its sums are
+# checked against preprocess_docs over the same documents. New documents are
+# then added and a second run, from the first run's cursor, must read only
+# those and match preprocess_docs over everything. A few of the first
+# documents have no cursor field, as if uploaded before it existed, and a few
+# have it set to null. The cursor reaches prepare_frame as a timestamp
+# column, so the runs turn pandas' FutureWarnings into errors: a fillna(0)
+# over that column would only warn today.
+#
+#   python -m benchmarks.bench_ingestion --docs 20000 --new-docs 2000 --shards 8 --page-size 500
+import argparse
+import datetime
+import json
+import time
+import warnings
+
+import pandas as pd
+
+from benchmarks.fake_firestore import FakeClient
+from benchmarks.synthetic import make_docs
+from data_loader import BRAND_LIST, LABELS_PATH
+from ingestion import FirestoreIngestor
+from streaming import ShelfAggregator
+from utils import preprocess_docs
+
+COLLECTION = "waters"
+CURSOR_FIELD = "uploaded_at"
+# Stored next to the fields preprocess_docs reads; the projection leaves it out
+UNREAD_FIELD = "image_url"
+
+
+def upload(collection, docs, start, without_cursor=0):
+    # Every `without_cursor`-th document is stored without the cursor field,
+    # and the one after it with a null one
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i, doc in enumerate(docs, start):
+        data = {**doc.to_dict(), UNREAD_FIELD: f"gs://photos/{doc.id}.jpg"}
+        if not without_cursor or i % without_cursor > 1:
+            data[CURSOR_FIELD] = base + datetime.timedelta(seconds=i)
+        elif i % without_cursor == 1:
+            data[CURSOR_FIELD] = None
+        collection.add(data)
+
+
+def n_prod(docs):
+    return sum(doc.to_dict()["photo_type"] == "Prod" for doc in docs)
+
+
+def check_run(name, ingestor, aggregator, collection, docs, expected_docs):
+    reads = collection.reads
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        stats = ingestor.ingest(aggregator)
+    seconds = time.perf_counter() - start
+    expected = preprocess_docs(docs, aggregator.competitor_danone_labels_dict)
+    # Brand columns come in the order shards happen to deliver them, and the
+    # summed float percentages in danone_share depend on the summation order
+    pd.testing.assert_frame_equal(aggregator.result(), expected, check_dtype=False, check_like=True, rtol=1e-9)
+    # Only Prod documents leave the server; each empty shard tail costs one read
+    assert stats.documents == expected_docs, (stats.documents, expected_docs)
+    assert collection.reads - reads <= expected_docs + ingestor.n_shards, (collection.reads - reads, expected_docs)
+    print(f"{name:<8} {stats.documents:>9,} {collection.reads - reads:>9,} {stats.pages:>6} {seconds:>8.2f}s   "
+          f"cursor {stats.cursor:%Y-%m-%d %H:%M:%S}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20_000)
+    parser.add_argument("--new-docs", type=int, default=2_000)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(LABELS_PATH) as file:
+        labels = json.load(file)
+    docs = make_docs(args.docs + args.new_docs, BRAND_LIST)
+    first, new = docs[:args.docs], docs[args.docs:]
+
+    client = FakeClient()
+    collection = client.collection(COLLECTION)
+    upload(collection, first, 0, without_cursor=50)
+    ingestor = FirestoreIngestor(client, COLLECTION, page_size=args.page_size, n_shards=args.shards,
+                                 max_workers=args.workers, cursor_field=CURSOR_FIELD)
+    aggregator = ShelfAggregator(labels)
+
+    print(f"{'run':<8} {'documents':>9} {'reads':>9} {'pages':>6} {'time':>9}")
+    check_run("full", ingestor, aggregator, collection, first, n_prod(first))
+    upload(collection, new, args.docs)
+    check_run("new", ingestor, aggregator, collection, docs, n_prod(new))
+    print("both runs match preprocess_docs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# Stage-by-stage timings of the load -> preprocess -> aggregate -> render
+# pipeline on synthetic detection documents. Every stage records its wall
+# time and its tracemalloc peak; results are written as JSON, tagged with the
+# git commit, so runs can be compared across commits.
+#
+#   python -m benchmarks.bench_pipeline --docs 1000 10000 100000
+#   python -m benchmarks.bench_pipeline --compare benchmarks/results/pipeline-<commit>.json
+#
+# Documents are held in memory like a Firestore result, so the largest sizes
+# (10M docs) need tens of GB of RAM.
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_docs, make_post_code_frame
+from brand_schema import BrandSchema
+from cube import BrandCube
+from data_loader import BRAND_LIST, LABELS_PATH, _tidy_docs, merge_post_codes
+from figure_cache import figure_size
+from geometry import GeometryCache
+from rollups import Rollups
+from stats import correlation_frame, correlation_summary
+from utils import (build_competitor_share_figure, build_correlation_figure, build_danone_share_map_figure,
+                   build_divergence_figure, build_gauge_figure, build_interactive_figure, preprocess_docs)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_commit():
+    root = os.path.dirname(RESULTS_DIR)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def measure(fn, repeat=1, memory=True):
+    # Best wall time over `repeat` plain runs, then one run under tracemalloc
+    # for the peak (tracing slows Python code down, so it is never timed)
+    seconds = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def pipeline_stages(docs, labels, gdf_income, geometry):
+    # (name, fn) in pipeline order; each fn takes the previous results dict
+    def divergence_slice(r):
+        selection = r["cube"].select(r["cube"].post_codes[0])
+        return (selection.danone_brands, selection.danone_values,
+                selection.competitor_brands, selection.competitor_values)
+
+    def rendered(build):
+        # Figure construction plus the JSON Streamlit ships to the browser
+        def stage(r):
+            fig = build(r)
+            return fig, figure_size(fig)
+        return stage
+
+    return [
+        ("preprocess_docs", lambda r: preprocess_docs(docs, labels)),
+        ("tidy_docs", lambda r: _tidy_docs(r["preprocess_docs"])),
+        ("variables", lambda r: list(r["tidy"].columns.intersection(BRAND_LIST))),
+        ("brand_schema", lambda r: BrandSchema.from_labels(labels).subset(r["variables"])),
+        ("count_matrix", lambda r: r["schema"].count_matrix(r["tidy"], dtype=None)),
+        ("rollups", lambda r: Rollups.from_docs(r["tidy"], r["schema"], r["counts"], gdf_income)),
+        ("merge_post_codes", lambda r: merge_post_codes(r["rollups"], gdf_income)),
+        # Shares and brand sums are read from the city row, as DashboardStats does
+        ("shares", lambda r: r["rollups"].lookup("city")),
+        ("podium", lambda r: r["schema"].podium_from_sums(np.array([r["shares"][brand] for brand in r["schema"].brands]),
+                                                          r["shares"]["total_bottles"])),
+        ("correlations", lambda r: correlation_frame(r["merge"][1], r["variables"])),
+        ("brand_cube", lambda r: BrandCube(r["tidy"], r["schema"], r["counts"])),
+        ("cube_select", divergence_slice),
+        ("figure_gauge", rendered(lambda r: build_gauge_figure(round(float(r["shares"]["danone_shelf_share"]), 2), "Danone Shelf Share"))),
+        ("figure_correlation", rendered(lambda r: build_correlation_figure(correlation_summary(r["correlations"])))),
+        ("figure_competitor_share", rendered(lambda r: build_competitor_share_figure(r["podium"]))),
+        ("figure_divergence", rendered(lambda r: build_divergence_figure(*r["cube_select"]))),
+        ("figure_interactive", rendered(lambda r: build_interactive_figure(r["merge"][1], r["variables"][0], geometry))),
+        ("figure_danone_share_map", rendered(lambda r: build_danone_share_map_figure(r["merge"][1], geometry))),
+    ]
+
+
+# Short names later stages read their inputs under
+RESULT_KEYS = {"tidy_docs": "tidy", "merge_post_codes": "merge", "brand_schema": "schema",
+               "count_matrix": "counts", "brand_cube": "cube"}
+
+
+def run(n_docs, labels, repeat=1, memory=True, seed=0, quiet=False):
+    docs = make_docs(n_docs, list(labels), seed=seed)
+    gdf_income = make_post_code_frame(seed=seed)
+    geometry = GeometryCache.from_geodataframe(gdf_income[["COD_POSTAL", "geometry"]])
+
+    results = {}
+    rows = []
+    for name, stage in pipeline_stages(docs, labels, gdf_income, geometry):
+        value, seconds, peak = measure(lambda: stage(results), repeat=repeat, memory=memory)
+        results[RESULT_KEYS.get(name, name)] = value
+        row = {"docs": n_docs, "stage": name, "seconds": seconds,
+               "peak_bytes": peak}
+        if name.startswith("figure_"):
+            row["payload_bytes"] = value[1]
+        rows.append(row)
+        if not quiet:
+            print(f"{n_docs:>9} {name:<24} {seconds * 1e3:>10.2f}ms "
+                  f"{peak / 2 ** 20 if peak is not None else float('nan'):>9.1f}MB", flush=True)
+    return rows
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    before = {(row["docs"], row["stage"]): row for row in baseline["results"]}
+    print(f"\nagainst {baseline.get('commit') or baseline_path}")
+    print(f"{'docs':>9} {'stage':<24} {'before':>10} {'after':>10} {'ratio':>7}")
+    for row in rows:
+        old = before.get((row["docs"], row["stage"]))
+        if old is None:
+            continue
+        ratio = row["seconds"] / old["seconds"] if old["seconds"] else float("nan")
+        print(f"{row['docs']:>9} {row['stage']:<24} {old['seconds'] * 1e3:>8.2f}ms "
+              f"{row['seconds'] * 1e3:>8.2f}ms {ratio:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the dashboard pipeline on synthetic documents")
+    parser.add_argument("--docs", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage; the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file (default: benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    with open(LABELS_PATH) as file:
+        labels = json.load(file)
+
+    # Pay the Plotly/pandas first-call costs before anything is timed
+    run(100, labels, memory=False, seed=args.seed, quiet=True)
+
+    print(f"{'docs':>9} {'stage':<24} {'wall':>12} {'peak':>11}")
+    rows = []
+    for n_docs in args.docs:
+        rows.extend(run(n_docs, labels, repeat=args.repeat, memory=not args.no_memory, seed=args.seed))
+
+    commit, dirty = git_commit()
+    report = {
+        "benchmark": "pipeline",
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "versions": {"pandas": pd.__version__},
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"\nwrote {output}")
+
+    if args.compare:
+        compare(rows, args.compare)
+
+
+if __name__ == "__main__":
+    main()
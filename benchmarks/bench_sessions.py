@@ -0,0 +1,119 @@
+# Resident memory of one dashboard process against the number of open sessions.
+#
+# A copy of the tree is made with a synthetic Data/df_docs.pkl of the requested
+# size, and a worker process opens the KPI pages in that many AppTest sessions
+# (the caches are process-wide, as in a server), keeping every session alive.
+# RSS is read after each step. Pass --tree to measure another checkout, e.g.
+# the commit before a change:
+#
+#   git worktree add /tmp/before HEAD~1
+#   python -m benchmarks.bench_sessions --tree /tmp/before --docs 400000
+#   python -m benchmarks.bench_sessions --docs 400000
+import argparse
+import ctypes
+import gc
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ["pages/1_Main_KPIs.py", "pages/2_Granular_KPIs.py"]
+IGNORE = shutil.ignore_patterns(".git", "__pycache__", "snapshot", "history", "cache", "results", "df_docs.pkl")
+
+
+def rss_mb():
+    # Current and peak resident set size from /proc, in MB
+    values = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def write_docs(tree, n_docs, seed=0):
+    # Preprocessed shelf frame in the legacy pickle, over the tree's own post codes
+    import pandas as pd
+
+    from benchmarks.synthetic import make_docs
+    from data_loader import BRAND_LIST
+    from utils import preprocess_docs
+
+    with open(os.path.join(REPO, "Data", "competitor_danone_labels_dict.json")) as file:
+        labels = json.load(file)
+    codes = pd.read_csv(os.path.join(tree, "Data", "renta_barcelona.csv"), sep=";", dtype={"COD_POSTAL": str})["COD_POSTAL"]
+    df_docs = preprocess_docs(make_docs(n_docs, BRAND_LIST, n_post_codes=len(codes), seed=seed), labels)
+    # Synthetic post codes are 08001, 08002, ...: map them onto the CSV's
+    synthetic = sorted(df_docs["post_code"].unique())
+    df_docs["post_code"] = df_docs["post_code"].map(dict(zip(synthetic, codes)))
+    with open(os.path.join(tree, "Data", "df_docs.pkl"), "wb") as file:
+        pickle.dump(df_docs, file)
+    return len(df_docs)
+
+
+def worker(tree, sessions):
+    os.chdir(tree)
+    sys.path.insert(0, tree)
+    from streamlit.testing.v1 import AppTest
+
+    libc = ctypes.CDLL("libc.so.6")
+    open_sessions = []
+    rows = []
+    for target in sessions:
+        start = time.perf_counter()
+        while len(open_sessions) < target:
+            at = AppTest.from_file(os.path.join(tree, PAGES[len(open_sessions) % len(PAGES)]), default_timeout=600)
+            at.run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+            open_sessions.append(at)
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        # Hand freed arenas back so RSS reflects what is still referenced
+        libc.malloc_trim(0)
+        rss, peak = rss_mb()
+        rows.append({"sessions": target, "rss_mb": rss, "peak_mb": peak, "seconds": elapsed})
+    print(json.dumps(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=REPO, help="checkout whose pages are measured")
+    parser.add_argument("--docs", type=int, default=200000, help="synthetic documents behind the shelf frame")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.tree, sorted(args.sessions))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, "tree")
+        shutil.copytree(os.path.abspath(args.tree), tree, ignore=IGNORE)
+        # The post-code GeoJSON is not tracked; reuse this checkout's copy
+        geojson = os.path.join(tree, "Data", "BARCELONA.geojson")
+        if not os.path.exists(geojson):
+            shutil.copy(os.path.join(REPO, "Data", "BARCELONA.geojson"), geojson)
+        n_shelves = write_docs(tree, args.docs)
+        command = [sys.executable, "-m", "benchmarks.bench_sessions", "--worker", "--tree", tree,
+                   "--sessions", *map(str, args.sessions)]
+        output = subprocess.run(command, cwd=REPO, check=True, capture_output=True, text=True).stdout
+        rows = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{os.path.abspath(args.tree)}: {n_shelves} shelves")
+    print(f"{'sessions':>8} {'RSS (MB)':>9} {'peak (MB)':>10} {'MB/session':>11} {'open (s)':>9}")
+    base = rows[0]
+    for row in rows:
+        per_session = (row["rss_mb"] - base["rss_mb"]) / (row["sessions"] - base["sessions"]) if row is not base else float("nan")
+        print(f"{row['sessions']:>8} {row['rss_mb']:>9.1f} {row['peak_mb']:>10.1f} {per_session:>11.2f} {row['seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Cold load time and resident memory of the legacy pickle against the columnar snapshot.
+# Every measurement runs in a fresh interpreter so nothing is warm.
+#
+#   python -m benchmarks.bench_snapshot --rows 100000 1000000
+import argparse
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import BRAND_LIST
+from snapshot import read_docs, write_snapshot
+
+VIEW_COLUMNS = ["post_code"] + BRAND_LIST + ["total_danone", "total_non_danone", "total_bottles"]
+
+
+def make_docs(n_rows, seed=0):
+    # Shaped like the preprocess_docs output
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 6, size=(n_rows, len(BRAND_LIST))).astype(np.float64)
+    df = pd.DataFrame({
+        "post_code": pd.Series(rng.integers(8001, 8043, size=n_rows)).astype(str).str.zfill(5),
+        "store_type": rng.choice(["OT", "TT"], size=n_rows).astype(object),
+        "store_name": rng.choice(["Dia", "Super", "Bonpreu", "Caprabo"], size=n_rows).astype(object),
+        "shelf id": pd.Series(np.arange(n_rows)).astype(str) + "_shelf",
+    })
+    df = pd.concat([df, pd.DataFrame(counts, columns=BRAND_LIST)], axis=1)
+    df["total_danone"] = counts[:, :3].sum(axis=1)
+    df["total_non_danone"] = counts[:, 3:].sum(axis=1)
+    df["total_bottles"] = counts.sum(axis=1)
+    df["danone_share"] = (df["total_danone"] / df["total_bottles"]).round(2) * 100
+    return df.sort_values("post_code", kind="stable").reset_index(drop=True)
+
+
+def current_rss_mb():
+    # ru_maxrss survives fork/exec on Linux, so read the live RSS instead
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(path, columns, post_codes):
+    # Runs inside the fresh interpreter; prints seconds and RSS growth in MB
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    df = read_docs(path, columns=columns, post_codes=post_codes)
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed} {current_rss_mb() - baseline} {len(df)}")
+
+
+def measure(path, columns=None, post_codes=None):
+    code = (
+        "import sys; sys.path.insert(0, %r)\n"
+        "from benchmarks.bench_snapshot import child\n"
+        "child(%r, %r, %r)\n"
+    ) % (os.getcwd(), path, columns, post_codes)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    elapsed, rss, rows = out.stdout.split()
+    return float(elapsed), float(rss), int(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'source':<28} {'load':>9} {'RSS':>10} {'rows read':>10}")
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            df = make_docs(n_rows)
+            pickle_path = os.path.join(tmp, "df_docs.pkl")
+            snapshot_path = os.path.join(tmp, "snapshot")
+            with open(pickle_path, "wb") as file:
+                pickle.dump(df, file)
+            write_snapshot(df, snapshot_path)
+            del df
+
+            cases = [
+                ("pickle", pickle_path, None, None),
+                ("snapshot, all", snapshot_path, None, None),
+                ("snapshot, view columns", snapshot_path, VIEW_COLUMNS, None),
+                ("snapshot, one post code", snapshot_path, VIEW_COLUMNS, ["08001"]),
+            ]
+            for label, path, columns, post_codes in cases:
+                elapsed, rss, rows = measure(path, columns, post_codes)
+                print(f"{n_rows:>9} {label:<28} {elapsed * 1e3:>7.0f}ms {rss:>8.1f}MB {rows:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Cold-start cost: import time of the app's entry points (python -X importtime,
+# best of --repeats fresh interpreters) and time to the first render of each
+# page in a fresh process, with and without the figures stored by warmup.py.
+# Pass --tree to measure another checkout, e.g. the commit before a change:
+#
+#   git worktree add /tmp/before HEAD~1
+#   python -m benchmarks.bench_startup --tree /tmp/before
+#   python warmup.py && python -m benchmarks.bench_startup
+import argparse
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["utils", "streaming", "backfill", "api", "data_loader"]
+PAGES = ["pages/1_Main_KPIs.py", "pages/2_Granular_KPIs.py", "pages/3_Trends.py"]
+
+RENDER = """
+import sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=300).run()
+assert not app.exception, app.exception
+print(time.perf_counter() - start)
+"""
+
+
+def page_imports(tree, page):
+    # The import statements at the top of a page, as one snippet
+    with open(os.path.join(tree, page)) as file:
+        return "\n".join(line.rstrip() for line in file if line.startswith(("import ", "from ")))
+
+
+def import_seconds(tree, statement, repeats):
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=tree,
+                                capture_output=True, text=True, check=True)
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # Top-level imports only; their cumulative time includes the rest
+            if len(name) - len(name.lstrip()) == 1:
+                total += int(cumulative)
+        best = total / 1e6 if best is None else min(best, total / 1e6)
+    return best
+
+
+def render_seconds(tree, page, store):
+    env = dict(os.environ, BOTTLE_VISION_FIGURE_STORE=store)
+    result = subprocess.run([sys.executable, "-c", RENDER, os.path.join(tree, page)], cwd=tree, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=REPO)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    tree = os.path.abspath(args.tree)
+
+    print(f"{'import':<34} {'seconds':>8}")
+    for module in MODULES:
+        print(f"{module:<34} {import_seconds(tree, f'import {module}', args.repeats):>8.3f}")
+    for page in PAGES:
+        print(f"{page + ' imports':<34} {import_seconds(tree, page_imports(tree, page), args.repeats):>8.3f}")
+
+    store = os.path.join(tree, "Data", "cache", "figures")
+    print(f"\n{'first render':<34} {'built':>8} {'stored':>8}")
+    for page in PAGES:
+        built = render_seconds(tree, page, "")
+        stored = render_seconds(tree, page, store) if os.path.isdir(store) else float("nan")
+        print(f"{page:<34} {built:>8.2f} {stored:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Brand x income correlations: one Series.corr call per brand (the previous
+# 1_Main_KPIs.py code) against the vectorized matrix in stats.py, plus the
+# cost of the batched bootstrap.
+#
+#   python -m benchmarks.bench_stats --post-codes 42 1000 10000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import BRAND_LIST
+from stats import INCOME_VARIABLES, correlation_matrix
+
+
+def make_post_codes(n_post_codes, seed=0, missing=0.1):
+    # Post-code frame after the left merge: brand sums are NaN where no store was visited
+    rng = np.random.default_rng(seed)
+    income = rng.normal(30000, 8000, size=n_post_codes)
+    counts = rng.poisson(20, size=(n_post_codes, len(BRAND_LIST))) * (1 + income[:, None] / 1e5)
+    counts[rng.random(n_post_codes) < missing] = np.nan
+    df = pd.DataFrame(counts, columns=BRAND_LIST)
+    df[INCOME_VARIABLES[0]] = income
+    df[INCOME_VARIABLES[1]] = income * 0.8 + rng.normal(0, 500, size=n_post_codes)
+    return df
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--post-codes", type=int, nargs="+", default=[42, 1000, 10000])
+    parser.add_argument("--n-boot", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'post codes':>10} {'Series.corr loop':>17} {'matrix (4 stats)':>17} {'+ bootstrap':>12}")
+    for n_post_codes in args.post_codes:
+        df = make_post_codes(n_post_codes)
+        values, targets = df[BRAND_LIST].to_numpy(), df[INCOME_VARIABLES].to_numpy()
+
+        # The loop only covered Pearson against gross income; the matrix does
+        # Pearson and Spearman against both income variables
+        loop = timed(lambda: {var: df[INCOME_VARIABLES[0]].corr(df[var]) for var in BRAND_LIST})
+        matrix = timed(lambda: correlation_matrix(values, targets, n_boot=0))
+        boot = timed(lambda: correlation_matrix(values, targets, n_boot=args.n_boot), repeat=1)
+        print(f"{n_post_codes:>10} {loop * 1e3:>15.2f}ms {matrix * 1e3:>15.2f}ms {boot * 1e3:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
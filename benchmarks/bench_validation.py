@@ -0,0 +1,77 @@
+# Validation cost next to the rest of a streaming chunk: json_normalize,
+# Validator.validate and prepare_frame, in documents per second, on synthetic
+# documents with a known share of faults of every kind.
+#
+#   python -m benchmarks.bench_validation --docs 10000 100000 --chunk 500
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_docs
+from data_loader import BRAND_LIST, LABELS_PATH
+from utils import prepare_frame
+from validation import RULES, Validator
+
+
+def inject_faults(docs, fraction=0.01, seed=0):
+    # Break `fraction` of the documents for each rule; returns the ids per rule
+    rng = np.random.default_rng(seed)
+    broken = {}
+    for rule in RULES:
+        picks = rng.choice(len(docs), size=max(int(len(docs) * fraction), 1), replace=False)
+        broken[rule] = {docs[i].id for i in picks}
+        for i in picks:
+            data = docs[i].to_dict()
+            data["photo_type"] = "Prod"
+            brand = next(iter(data["predictions"]), BRAND_LIST[0])
+            if rule == "negative_count":
+                data["predictions"][brand] = -3
+            elif rule == "implausible_count":
+                data["predictions"][brand] = 10000
+            elif rule == "missing_store_key":
+                data["store_name"] = None
+            elif rule == "unknown_brand":
+                data["predictions"]["unlabelled_brand"] = 2
+            else:
+                data["Num_bottles"] = 0
+                data["predictions"][brand] = max(data["predictions"][brand], 1)
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--chunk", type=int, default=500)
+    args = parser.parse_args()
+
+    with open(LABELS_PATH) as file:
+        labels = json.load(file)
+    validator = Validator(labels)
+
+    print(f"{'docs':>8} {'normalize':>12} {'validate':>12} {'prepare':>12} {'flagged':>8}   docs/s")
+    for n_docs in args.docs:
+        docs = make_docs(n_docs, BRAND_LIST)
+        inject_faults(docs)
+        chunks = [[doc.to_dict() for doc in docs[start:start + args.chunk]] for start in range(0, n_docs, args.chunk)]
+        seconds = {"normalize": 0.0, "validate": 0.0, "prepare": 0.0}
+        flagged = 0
+        for records in chunks:
+            start = time.perf_counter()
+            df_raw = pd.json_normalize(records, sep="_")
+            seconds["normalize"] += time.perf_counter() - start
+            start = time.perf_counter()
+            report = validator.validate(df_raw)
+            seconds["validate"] += time.perf_counter() - start
+            flagged += int(report.flagged.sum())
+            start = time.perf_counter()
+            prepare_frame(df_raw[~report.quarantined].copy(), labels)
+            seconds["prepare"] += time.perf_counter() - start
+        print(f"{n_docs:>8} " + " ".join(f"{seconds[name] * 1e3:>10.0f}ms" for name in seconds)
+              + f" {flagged:>8}   {n_docs / seconds['validate']:,.0f} validated, {n_docs / sum(seconds.values()):,.0f} end to end")
+
+
+if __name__ == "__main__":
+    main()
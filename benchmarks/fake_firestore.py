@@ -0,0 +1,151 @@
+# In-process stand-in for the Firestore client, so ingestion.py can be
+# checked without the emulator. It covers what FirestoreIngestor's queries
+# use: where(filter=FieldFilter(...)) with ==, <, <=, > and >=, including
+# document-id filters against document references, select, order_by,
+# start_after, limit and stream. Like Firestore:
+#
+# - a filter or an order on a field leaves out documents without it;
+# - range filters only match values of the same type, and null only == null;
+# - results are ordered by the order_by fields, then by document id;
+# - snapshot.get raises KeyError for a field the document does not have;
+# - one read is billed per returned document, and one for an empty result.
+import operator
+import random
+import threading
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from ingestion import DOCUMENT_ID_ALPHABET, cursor_key
+
+DOCUMENT_ID = FieldPath.document_id()
+OPERATORS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+MISSING = object()
+
+
+class FakeSnapshot:
+    __slots__ = ("id", "_data")
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+
+class FakeDocumentReference:
+    __slots__ = ("id",)
+
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+def _value(doc_id, data, field):
+    if field == DOCUMENT_ID:
+        return doc_id
+    return data.get(field, MISSING)
+
+
+def _matches(doc_id, data, field_filter):
+    value = _value(doc_id, data, field_filter.field_path)
+    if value is MISSING:
+        return False
+    operand = field_filter.value
+    if isinstance(operand, FakeDocumentReference):
+        operand = operand.id
+    if value is None or operand is None:
+        # null only matches == null
+        return field_filter.op_string == "==" and value is operand
+    if cursor_key(value)[0] != cursor_key(operand)[0]:
+        return False
+    return OPERATORS[field_filter.op_string](value, operand)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), fields=None, limit=None, after=None):
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._fields = fields
+        self._limit = limit
+        self._after = after
+
+    def _replace(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, fields=self._fields, limit=self._limit,
+                     after=self._after)
+        return FakeQuery(self._collection, **{**state, **changes})
+
+    def where(self, filter):
+        return self._replace(filters=self._filters + (filter,))
+
+    def order_by(self, field):
+        return self._replace(orders=self._orders + (field,))
+
+    def select(self, field_paths):
+        # Top-level fields only: a map field brings everything under it
+        return self._replace(fields={FieldPath.from_api_repr(path).parts[0] for path in field_paths})
+
+    def limit(self, count):
+        return self._replace(limit=count)
+
+    def start_after(self, snapshot):
+        return self._replace(after=snapshot.id)
+
+    def _key(self, doc_id, data):
+        orders = [field for field in self._orders if field != DOCUMENT_ID]
+        return tuple(cursor_key(_value(doc_id, data, field)) for field in orders) + (doc_id,)
+
+    def stream(self):
+        docs = self._collection.docs
+        ids = [doc_id for doc_id, data in docs.items()
+               if all(_matches(doc_id, data, field_filter) for field_filter in self._filters)
+               and all(_value(doc_id, data, field) is not MISSING for field in self._orders)]
+        ids.sort(key=lambda doc_id: self._key(doc_id, docs[doc_id]))
+        if self._after is not None:
+            after = self._key(self._after, docs[self._after])
+            ids = [doc_id for doc_id in ids if self._key(doc_id, docs[doc_id]) > after]
+        if self._limit is not None:
+            ids = ids[:self._limit]
+        self._collection.bill(len(ids))
+        for doc_id in ids:
+            data = docs[doc_id]
+            if self._fields is not None:
+                data = {field: value for field, value in data.items() if field in self._fields}
+            yield FakeSnapshot(doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, seed=0):
+        super().__init__(self)
+        self.docs = {}
+        self.reads = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def document(self, doc_id):
+        return FakeDocumentReference(doc_id)
+
+    def add(self, data):
+        # Random 20-character ids, like auto-generated ones
+        doc_id = "".join(self._rng.choices(DOCUMENT_ID_ALPHABET, k=20))
+        self.docs[doc_id] = data
+        return FakeDocumentReference(doc_id)
+
+    def bill(self, documents):
+        # Shards are streamed from several threads
+        with self._lock:
+            self.reads += max(documents, 1)
+
+
+class FakeClient:
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.collections = {}
+
+    def collection(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self.seed)
+        return self.collections[name]
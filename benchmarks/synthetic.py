@@ -0,0 +1,85 @@
+# Synthetic detection documents and post-code data for the benchmarks.
+#
+# Documents are shaped like the Firestore snapshots preprocess_docs reads:
+# a nested `predictions` map with a few brands each, `photo_type`,
+# `Num_bottles` and the store keys. Several photos land on the same shelf,
+# so the groupby in preprocess_docs has real work to do.
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+STORE_TYPES = ["OT", "TT"]
+STORE_NAMES = ["Dia", "Super", "Bonpreu", "Caprabo", "Mercadona", "Lidl", "Condis", "Spar"]
+
+
+class SyntheticDoc:
+    # Stand-in for a Firestore DocumentSnapshot
+    __slots__ = ("id", "_data")
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+def post_codes(n_post_codes=42):
+    return [str(8001 + i).zfill(5) for i in range(n_post_codes)]
+
+
+def make_docs(n_docs, brands, n_post_codes=42, photos_per_shelf=4, brands_per_photo=5,
+              test_fraction=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = np.asarray(post_codes(n_post_codes), dtype=object)
+    brands = np.asarray(brands, dtype=object)
+
+    # Photos -> shelves -> stores; every store sits in one post code
+    n_shelves = max(n_docs // photos_per_shelf, 1)
+    n_stores = max(n_shelves // 5, 1)
+    shelf = rng.integers(0, n_shelves, size=n_docs)
+    store = shelf % n_stores
+    store_post_code = codes[rng.integers(0, len(codes), size=n_stores)]
+    store_type = np.asarray(STORE_TYPES, dtype=object)[rng.integers(0, len(STORE_TYPES), size=n_stores)]
+    store_name = np.asarray(STORE_NAMES, dtype=object)[rng.integers(0, len(STORE_NAMES), size=n_stores)]
+
+    k = min(brands_per_photo, len(brands))
+    brand_picks = np.argsort(rng.random((n_docs, len(brands))), axis=1)[:, :k]
+    counts = rng.integers(0, 12, size=(n_docs, k))
+    num_bottles = counts.sum(axis=1) + rng.integers(0, 4, size=n_docs)
+    photo_type = np.where(rng.random(n_docs) < test_fraction, "Test", "Prod")
+
+    docs = []
+    for i in range(n_docs):
+        s = store[i]
+        docs.append(SyntheticDoc(f"doc{i:09d}", {
+            "predictions": dict(zip(brands[brand_picks[i]], counts[i].tolist())),
+            "photo_type": photo_type[i],
+            "Num_bottles": int(num_bottles[i]),
+            "post_code": store_post_code[s],
+            "store_type": store_type[s],
+            "store_name": f"{store_name[s]} {s}",
+            "shelf id": f"{shelf[i] // n_stores}_shelf",
+        }))
+    return docs
+
+
+def make_post_code_frame(n_post_codes=42, seed=0):
+    # Square polygons joined with income columns, like the geojson + CSV merge
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_post_codes)))
+    size = 0.01
+    iy, ix = np.divmod(np.arange(n_post_codes), side)
+    x0, y0 = 2.1 + ix * size, 41.35 + iy * size
+    gross = rng.normal(30000, 8000, size=n_post_codes).round()
+    gdf = gpd.GeoDataFrame({"COD_POSTAL": post_codes(n_post_codes)},
+                           geometry=shapely.box(x0, y0, x0 + size, y0 + size), crs="EPSG:4326")
+    gdf["Average Gross Income"] = gross
+    gdf["Average Disposable Income"] = (gross * 0.8).round()
+    gdf["Cat_avg_Gross_Income"] = pd.qcut(gdf["Average Gross Income"], q=3, labels=["Low", "Medium", "High"])
+    gdf["Cat_avg_Disposable_Income"] = pd.qcut(gdf["Average Disposable Income"], q=3, labels=["Low", "Medium", "High"])
+    return gdf
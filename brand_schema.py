@@ -0,0 +1,83 @@
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+class BrandSchema:
+    """Brand order and Danone/competitor masks compiled from the label dict.
+
+    Counts are handled as a contiguous ``(rows, brands)`` matrix in
+    ``self.brands`` order, so the category totals are one matrix product
+    instead of a column scan per call.
+    """
+
+    def __init__(self, brands, categories):
+        self.brands = tuple(brands)
+        self.categories = np.asarray(categories, dtype=object)
+        self.index = {brand: i for i, brand in enumerate(self.brands)}
+        self.is_danone = self.categories == "Danone"
+        self.is_competitor = self.categories == "competitor"
+        # (brands, 2) weights: column 0 sums Danone brands, column 1 competitors
+        self.weights = np.column_stack([self.is_danone, self.is_competitor]).astype(np.float64)
+
+    @classmethod
+    def from_labels(cls, competitor_danone_labels_dict):
+        if isinstance(competitor_danone_labels_dict, cls):
+            return competitor_danone_labels_dict
+        return _compile(tuple(competitor_danone_labels_dict.items()))
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, 'r') as json_file:
+            return cls.from_labels(json.load(json_file))
+
+    def __len__(self):
+        return len(self.brands)
+
+    def labels(self):
+        return dict(zip(self.brands, self.categories))
+
+    def subset(self, columns):
+        # Schema restricted to the brands present in `columns`, in that column order
+        brands = [col for col in columns if col in self.index]
+        return BrandSchema(brands, [self.categories[self.index[brand]] for brand in brands])
+
+    def column_index(self, columns):
+        # Position in `columns` of every brand, -1 where the brand is missing
+        positions = pd.Index(columns).get_indexer(list(self.brands))
+        return positions.astype(np.intp)
+
+    def count_matrix(self, df, dtype=np.float64):
+        # One contiguous block in schema order; missing brands count 0.
+        # dtype=None keeps the columns' common dtype (int32 for compact frames)
+        present = self.column_index(df.columns) >= 0
+        brands = [brand for brand, found in zip(self.brands, present) if found]
+        if dtype is None:
+            dtype = np.result_type(*df[brands].dtypes) if brands else np.float64
+        if present.all():
+            return np.ascontiguousarray(df[brands].to_numpy(dtype=dtype))
+        counts = np.zeros((len(df), len(self.brands)), dtype=dtype)
+        if present.any():
+            counts[:, present] = df[brands].to_numpy(dtype=dtype)
+        return counts
+
+    def totals(self, counts):
+        # (rows, 2) array of Danone and competitor totals
+        return counts @ self.weights
+
+    def podium_from_sums(self, brand_sums, total_bottles):
+        # Share of all bottles per brand; 0 when there are no bottles at all
+        shares = brand_sums / total_bottles * 100 if total_bottles else np.zeros(len(self.brands))
+        return pd.DataFrame({
+            "Product": list(self.brands),
+            "Share": shares.round(1),
+            "Category": list(self.categories)})
+
+
+@lru_cache(maxsize=8)
+def _compile(items):
+    brands = [brand for brand, _ in items]
+    categories = [category for _, category in items]
+    return BrandSchema(brands, categories)
@@ -0,0 +1,383 @@
+"""Plotly chart builders and the Streamlit helpers that draw them.
+
+Loaded through ``utils`` on first use, so modules that only prepare data
+never import Plotly or Streamlit.
+"""
+import re
+
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from figure_cache import FIGURE_CACHE
+from geometry import GeometryCache
+from instrumentation import timed
+
+# Columns the choropleths show on hover, in the order Plotly Express packs them into customdata
+MAP_HOVER_COLUMNS = ['COD_POSTAL', 'Average Gross Income', 'danone_share']
+
+@timed()
+def build_gauge_figure(score, score_column):
+    colname = score_column
+
+    # Determinar el color del medidor
+    if score < 0.5:
+        gauge_color = "red"
+    elif 0.5 <= score < 0.75:
+        gauge_color = "yellow"
+    else:
+        gauge_color = "green"
+
+    # Crear la figura del medidor
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=score,
+        title={'text': colname}, 
+        gauge={
+            'axis': {'range': [0, 1], 'tickwidth': 1, 'tickcolor': "darkblue"},
+            'bar': {'color': gauge_color},
+            'steps': [
+                {'range': [0, 0.5], 'color': "lightgray"},
+                {'range': [0.5, 1], 'color': "lightgray"}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': score
+            }
+        }
+    ))
+    
+    fig.update_layout(
+        margin={'t': 0, 'b': 0, 'l': 0, 'r': 0},  # Remove margins
+        height=300,  # Adjust the height to a smaller size
+        width=400  # Adjust the width to a smaller size
+    )
+
+    return fig
+
+@timed()
+def plot_gauge_from_scalar(score, score_column):
+    # Keyed on the score itself: the returned figure is shared, so it is never updated in place
+    with FIGURE_CACHE.figure("plot_gauge_from_scalar",
+                             lambda: build_gauge_figure(score, score_column),
+                             params=(score_column, score)) as fig:
+        return fig
+
+@timed()
+def build_interactive_figure(gdf_data_input, score_column, geometry_cache, zoom=11):
+    # Create the map with Plotly Express, reusing the cached post code GeoJSON
+    fig = px.choropleth(gdf_data_input, 
+                        geojson=geometry_cache.geojson(zoom), # Pre-serialized FeatureCollection keyed by COD_POSTAL
+                        locations="COD_POSTAL",
+                        featureidkey="id",
+                        color=score_column, 
+                        hover_name="COD_POSTAL",  # Adjust this to a column you want to show in hover info
+                        hover_data={
+                        'COD_POSTAL': True,  # Display the 'COD_POSTAL' column
+                        'Average Gross Income': True,  # Add more columns as needed
+                        'danone_share': ':.1f'},
+                        color_continuous_scale=["white","darkblue"])
+
+    # Update the map layout
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(
+        geo=dict(showcoastlines=True, coastlinecolor="Black", showland=True, landcolor="white"),
+        coloraxis_colorbar=dict(
+        title=dict(
+            text="Share",
+            side='top',  # puts title above the colorbar
+            font=dict(size=12)  # optional: adjust font size
+        ),
+        orientation='h',  # horizontal orientation
+        yanchor='top',
+        y=1.2,  # position at bottom
+        xanchor='center',
+        x=0.5,  # center horizontally
+        thickness=15,  # adjust thickness of the colorbar
+        len=0.5,  # adjust length of the colorbar
+    ),
+        width=1200,  # Adjust this value to make it wider
+        height=600,  # Adjust this to maintain proportion
+)
+
+    return fig
+
+@timed()
+def plot_interactive(gdf_data_input, score_column, geometry_cache=None, zoom=11, container=st, key=None, on_select="ignore"):
+    if geometry_cache is None:
+        geometry_cache = GeometryCache.from_geodataframe(gdf_data_input)
+
+    data = gdf_data_input[MAP_HOVER_COLUMNS + [score_column]]
+
+    def update(fig):
+        # Same geometry, new values: swap the color vector and hover data only
+        trace = fig.data[0]
+        trace.locations = data["COD_POSTAL"].to_numpy()
+        trace.hovertext = data["COD_POSTAL"].to_numpy()
+        trace.z = data[score_column].to_numpy()
+        trace.customdata = data[MAP_HOVER_COLUMNS].to_numpy()
+        trace.hovertemplate = re.sub(r"<br>[^<]*=%\{z\}", f"<br>{score_column}=%{{z}}", trace.hovertemplate)
+
+    with FIGURE_CACHE.figure("plot_interactive",
+                             lambda: build_interactive_figure(gdf_data_input, score_column, geometry_cache, zoom),
+                             params=(geometry_cache, zoom),
+                             data=(data, score_column),
+                             update=update) as fig:
+        # Show the plot; with on_select, clicking a polygon selects its post code
+        if on_select == "ignore":
+            return container.plotly_chart(fig, key=key)
+        return container.plotly_chart(fig, key=key, on_select=on_select, selection_mode="points")
+
+@timed()
+def build_correlation_figure(correlations_df):
+    fig = go.Figure(go.Bar(
+        x=correlations_df["Correlation"], 
+        y=correlations_df["Variable"], 
+        orientation='h',  
+        marker=dict(color='skyblue')
+    ))
+
+    # Agregar título y etiquetas
+    fig.update_layout(
+        title="Correlation Summary",
+        xaxis_title="Correlation Gross Income by Brand",
+        yaxis_title="Brands",
+        template="plotly_white", 
+        xaxis=dict(showgrid=True, gridcolor='lightgray'),
+        yaxis=dict(showgrid=False)
+    )
+
+    return fig
+
+@timed()
+def plot_correlation(correlations_df, container=st):
+    def update(fig):
+        fig.data[0].x = correlations_df["Correlation"].to_numpy()
+        fig.data[0].y = correlations_df["Variable"].to_numpy()
+
+    with FIGURE_CACHE.figure("plot_correlation",
+                             lambda: build_correlation_figure(correlations_df),
+                             data=correlations_df,
+                             update=update) as fig:
+        container.plotly_chart(fig, use_container_width=True)
+    
+@timed()
+def build_danone_share_map_figure(gdf_post_code, geometry_cache, zoom=11):
+    # Create the choropleth mapbox
+    fig_map_danone = px.choropleth_mapbox(
+        gdf_post_code,
+        geojson=geometry_cache.geojson(zoom),
+        locations="COD_POSTAL",
+        featureidkey="id",
+        color='total_danone',
+        color_continuous_scale='Blues',
+        mapbox_style='carto-positron',  # Add OpenStreetMap base layer
+        center=geometry_cache.center,
+        zoom=zoom,  # Adjust this value based on your data coverage
+        opacity=0.8,  # Adjust transparency of the choropleth layer
+        labels={'total_danone': 'Share'},
+        hover_data={
+            'total_danone': True,
+            'COD_POSTAL': True,
+            'Average Gross Income': True,
+            'danone_share': ':.1f'
+        }
+    )
+
+    # Update layout
+    fig_map_danone.update_layout(
+        title="",
+        width=2000,
+        height=600,
+        margin={"r":0,"t":0,"l":0,"b":0},  # Reduce margins to maximize map space
+        coloraxis_colorbar=dict(
+            title=dict(
+                text="Share",
+                side='top',
+                font=dict(size=14)
+            ),
+            orientation='h',
+            yanchor='bottom',
+            y=1,
+            xanchor='center',
+            x=0.5,
+            thickness=20,
+            len=.5
+        )
+    )
+
+    return fig_map_danone
+
+@timed()
+def plot_danone_share_map(gdf_post_code, geometry_cache=None, zoom=11, container=st):
+    if geometry_cache is None:
+        geometry_cache = GeometryCache.from_geodataframe(gdf_post_code)
+
+    with FIGURE_CACHE.figure("plot_danone_share_map",
+                             lambda: build_danone_share_map_figure(gdf_post_code, geometry_cache, zoom),
+                             params=(geometry_cache, zoom),
+                             data=gdf_post_code[MAP_HOVER_COLUMNS + ['total_danone']]) as fig_map_danone:
+        # Display the map in Streamlit
+        container.plotly_chart(fig_map_danone, use_container_width=True)
+
+@timed()
+def build_competitor_share_figure(podium_df):
+        # Crear el gráfico de barras
+        fig = px.bar(
+            podium_df,
+            x="Product",
+            y="Share",
+            color="Category",
+            color_discrete_map={
+                "Danone": "blue",
+                "competitor": "red"
+            },
+            title="Top and Bottom Danone Brands vs Competitors",
+            text="Share"
+        )
+        
+        # Ajustar la posición del texto y el diseño
+        fig.update_traces(textposition="outside")
+        fig.update_layout(
+            xaxis_title="Brands", 
+            yaxis_title="Share", 
+            template="plotly_white",
+            title_font=dict(size=14),  
+            legend=dict(
+                orientation="h",
+                yanchor="top",
+                y=1.15,
+                xanchor="center",
+                x=0.5,
+                title=""  
+            ),
+            yaxis=dict(
+                automargin = True
+            )  # Increase the top margin to fit the highest value label
+        )
+        
+        return fig
+
+@timed()
+def plot_competitor_share(podium_df, container=st):
+    with FIGURE_CACHE.figure("plot_competitor_share",
+                             lambda: build_competitor_share_figure(podium_df),
+                             data=podium_df) as fig:
+        # Mostrar el gráfico en Streamlit
+        container.plotly_chart(fig)
+
+
+@timed()
+def build_divergence_figure(danone_brands, danone_values, competitor_brands, competitor_values):
+    # Create figure
+    fig = go.Figure()
+    
+    # Add Danone bars
+    fig.add_trace(go.Bar(
+        name='Danone',
+        y=danone_brands,
+        x=danone_values,
+        orientation='h',
+        marker_color='rgb(49, 130, 189)',  # Blue color
+    ))
+    
+    # Add Competitor bars
+    fig.add_trace(go.Bar(
+        name='Competitor',
+        y=competitor_brands,
+        x=competitor_values,
+        orientation='h',
+        marker_color='rgb(204, 36, 41)',  # Red color
+    ))
+    
+    # Update layout
+    fig.update_layout(
+        xaxis=dict(
+            title="Value",
+            zeroline=True,
+            zerolinecolor='black',
+            zerolinewidth=1,
+            showgrid=True,
+            tickformat='.0f',  # Remove decimal places
+            tickprefix='',  # Can add prefix if needed
+            ticksuffix=''   # Can add suffix if needed
+        ),
+        yaxis=dict(
+            title="Brand",
+            autorange="reversed"  # Keep same order as original
+        ),
+        barmode='relative',
+        bargap=0.2,
+        height=600,
+        width=800,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    
+    # Show absolute values on hover
+    fig.update_traces(
+        hovertemplate="<b>%{y}</b><br>" +
+                      "Value: %{x:,.0f}<br>" +
+                      "<extra></extra>"  # Remove secondary box
+    )
+    
+    return fig
+
+def _plot_divergence(danone_brands, danone_values, competitor_brands, competitor_values):
+    def update(fig):
+        fig.data[0].update(y=danone_brands, x=danone_values)
+        fig.data[1].update(y=competitor_brands, x=competitor_values)
+
+    with FIGURE_CACHE.figure("divergence_plot_plotly",
+                             lambda: build_divergence_figure(danone_brands, danone_values, competitor_brands, competitor_values),
+                             data=(danone_brands, danone_values, competitor_brands, competitor_values),
+                             update=update) as fig:
+        # Return figure to be displayed in Streamlit
+        return st.plotly_chart(fig, use_container_width=True)
+
+@timed()
+def divergence_plot_plotly(df, post_code):
+    # Filter data
+    df_filtered = df[df['COD_POSTAL'] == post_code]
+    danone_data = df_filtered[df_filtered['Category'] == 'Danone']
+    competitor_data = df_filtered[df_filtered['Category'] == 'competitor']
+
+    return _plot_divergence(danone_data['brand'].to_numpy(), danone_data['value'].to_numpy(),
+                            competitor_data['brand'].to_numpy(), competitor_data['value'].to_numpy())
+
+@timed()
+def divergence_plot_from_selection(selection):
+    # Same chart from any DivergenceSlice: a cube selection or a cross-filtered one
+    return _plot_divergence(selection.danone_brands, selection.danone_values,
+                            selection.competitor_brands, selection.competitor_values)
+
+@timed()
+def build_trend_figure(trend_df, window):
+    fig = px.line(trend_df, x="date", y="share", color="group",
+                  labels={"date": "Date", "share": "Share (%)", "group": ""},
+                  hover_data={"bottles": ":,.0f"},
+                  title=f"Rolling {window}-day share")
+
+    fig.update_layout(
+        template="plotly_white",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        yaxis=dict(rangemode="tozero"),
+        height=500,
+    )
+
+    return fig
+
+@timed()
+def plot_trend(trend_df, window):
+    with FIGURE_CACHE.figure("plot_trend",
+                             lambda: build_trend_figure(trend_df, window),
+                             params=(window,),
+                             data=trend_df) as fig:
+        st.plotly_chart(fig, use_container_width=True)
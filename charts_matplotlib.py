@@ -0,0 +1,37 @@
+"""Matplotlib version of the divergence chart; superseded by the Plotly one.
+
+``draw_divergence`` is also what export_reports.py draws its static reports
+with, so it takes an axes and does not touch pyplot or Streamlit.
+"""
+
+
+def draw_divergence(ax, danone_brands, danone_values, competitor_brands, competitor_values, title):
+    ax.barh(danone_brands, danone_values, color='blue', label='Danone')
+    ax.barh(competitor_brands, competitor_values, color='red', label='Competitor')
+
+    ax.set_title(title, fontsize=14)
+    ax.set_xlabel("Value", fontsize=12)
+    ax.set_ylabel("Brand", fontsize=12)
+    ax.axvline(0, color='black', linewidth=0.8, linestyle='--')
+
+    ax.set_xticks(ax.get_xticks())
+    ax.set_xticklabels([abs(x) for x in ax.get_xticks()])  # Mostrar solo valores positivos
+
+    ax.legend(loc='upper right', fontsize=12)
+
+
+def divergence_plot_matplotlib(df, post_code):
+    import matplotlib.pyplot as plt
+    import streamlit as st
+
+    df_filtered = df[df['COD_POSTAL'] == post_code]
+
+    danone = df_filtered[df_filtered['Category'] == 'Danone']
+    competidor = df_filtered[df_filtered['Category'] == 'competitor']
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    draw_divergence(ax, danone['brand'], danone['value'], competidor['brand'], competidor['value'],
+                    f"Brand by Post Code: {post_code} (Competitor vs Danone)")
+
+    plt.tight_layout()
+    st.pyplot(fig)
@@ -0,0 +1,246 @@
+"""Cross-filters over the shelf rows of one snapshot, for the Granular page.
+
+``ShelfIndex`` is built once per snapshot. It keeps the brand and bottle
+counts of every shelf as int32 columns, with rows ordered by post code so
+that each post code is one contiguous range. For every value of every filter
+dimension it also keeps a packed bitmap of the rows that match it:
+
+    post_code     the shelf's post code
+    store_type    the shelf's store type
+    income_tier   the income category of the shelf's post code
+    brand         shelves where the brand has at least one bottle
+
+Within a dimension, the selected values are ORed. Across dimensions, the
+results are ANDed, and an empty selection does not filter. Both are bitwise
+operations over n / 8 bytes.
+
+``CrossFilter`` holds one session's selections. Each aggregate reads only the
+dimensions it depends on: the map leaves out its own dimension, post code,
+so every post code stays on the map to be clicked. Each aggregate is
+recomputed only when one of those selections changes, and the combined mask
+of each dimension is reused until its own selection changes.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from cube import DivergenceSlice
+from rollups import UNKNOWN_CATEGORY
+
+DIMENSIONS = ("post_code", "store_type", "income_tier", "brand")
+
+# Dimensions each aggregate is filtered by
+DEPENDS_ON = {
+    "divergence": DIMENSIONS,
+    "map": ("store_type", "income_tier", "brand"),
+}
+
+
+@dataclass(frozen=True)
+class FilteredSummary:
+    # Sums over the filtered shelves, like post_code_summary
+    shelves: int
+    total_danone: int
+    total_bottles: int
+
+    @property
+    def danone_share(self):
+        return 100 * self.total_danone / self.total_bottles if self.total_bottles else float("nan")
+
+
+class ShelfIndex:
+    def __init__(self, df_docs, brand_schema, brand_counts, income_categories=None):
+        post_code_codes, post_codes = pd.factorize(df_docs["COD_POSTAL"], sort=True)
+        order = np.argsort(post_code_codes, kind="stable")
+        post_code_codes = post_code_codes[order]
+        self.n_rows = len(order)
+        self.brand_schema = brand_schema
+        self.post_codes = [str(post_code) for post_code in post_codes]
+        # Rows of the i-th post code: offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(post_code_codes, np.arange(len(self.post_codes) + 1))
+
+        # Brand columns first, then the bottle totals of the rollups
+        self.columns = list(brand_schema.brands) + ["total_danone", "total_bottles"]
+        self.column_index = {col: i for i, col in enumerate(self.columns)}
+        counts = np.empty((self.n_rows, len(self.columns)), dtype=np.int32, order="F")
+        counts[:, :len(brand_schema)] = np.asarray(brand_counts)[order]
+        for col in ("total_danone", "total_bottles"):
+            counts[:, self.column_index[col]] = df_docs[col].to_numpy()[order]
+        counts.setflags(write=False)
+        self.counts = counts
+        # Unfiltered sums per post code, for selections without a row mask
+        present = self.offsets[:-1] < self.offsets[1:]
+        self.post_code_totals = np.zeros((len(self.post_codes), len(self.columns)), dtype=np.int64)
+        if present.any():
+            self.post_code_totals[present] = np.add.reduceat(counts, self.offsets[:-1][present], axis=0, dtype=np.int64)
+
+        store_type_codes, store_types = pd.factorize(df_docs["store_type"].to_numpy()[order], sort=True)
+        # Each post code has one income tier: code the post codes, then the rows
+        tiers = _income_tiers(self.post_codes, income_categories)
+        tier_values = _tier_order(tiers)
+        tier_codes = np.array([tier_values.index(tier) for tier in tiers], dtype=np.intp)[post_code_codes]
+
+        self.values = {
+            "post_code": self.post_codes,
+            "store_type": [str(store_type) for store_type in store_types],
+            "income_tier": tier_values,
+            "brand": list(brand_schema.brands),
+        }
+        self.value_index = {dimension: {value: i for i, value in enumerate(values)}
+                            for dimension, values in self.values.items()}
+        self.bitmaps = {
+            "post_code": _bitmaps(post_code_codes, len(self.post_codes)),
+            "store_type": _bitmaps(store_type_codes, len(store_types)),
+            "income_tier": _bitmaps(tier_codes, len(tier_values)),
+            "brand": np.stack([np.packbits(counts[:, j] > 0) for j in range(len(brand_schema))])
+            if len(brand_schema) else np.zeros((0, (self.n_rows + 7) // 8), dtype=np.uint8),
+        }
+        for bitmaps in self.bitmaps.values():
+            bitmaps.setflags(write=False)
+
+    def mask(self, dimension, values):
+        # Packed rows matching any of `values`; None when nothing is selected
+        if not values:
+            return None
+        positions = [self.value_index[dimension][value] for value in values]
+        return np.bitwise_or.reduce(self.bitmaps[dimension][positions], axis=0)
+
+    def unpack(self, packed):
+        return np.unpackbits(packed, count=self.n_rows).view(bool)
+
+    def brand_sums(self, mask=None, post_codes=None):
+        # Column sums over the masked rows of the given post codes (all by
+        # default), and the number of those rows: one int32 pass per post
+        # code range, added up in int64
+        if post_codes:
+            ranges = [self.value_index["post_code"][post_code] for post_code in post_codes]
+        else:
+            ranges = range(len(self.post_codes))
+        if mask is None:
+            return self.post_code_totals[ranges].sum(axis=0), int(sum(self.offsets[i + 1] - self.offsets[i] for i in ranges))
+        weights = mask.astype(np.int32)
+        sums = np.zeros(len(self.columns), dtype=np.int64)
+        shelves = 0
+        for i in ranges:
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            sums += np.einsum("i,ij->j", weights[start:stop], self.counts[start:stop])
+            shelves += np.count_nonzero(mask[start:stop])
+        return sums, int(shelves)
+
+    def post_code_sums(self, columns, mask=None):
+        # Sums of some columns per post code over the masked rows, and the
+        # number of matching shelves of each post code
+        if mask is None:
+            return self.post_code_totals[:, [self.column_index[col] for col in columns]], np.diff(self.offsets)
+        starts = self.offsets[:-1]
+        present = starts < self.offsets[1:]
+        sums = np.zeros((len(self.post_codes), len(columns)), dtype=np.int64)
+        shelves = np.zeros(len(self.post_codes), dtype=np.int64)
+        shelves[present] = np.add.reduceat(mask, starts[present], dtype=np.int64)
+        for j, col in enumerate(columns):
+            values = self.counts[:, self.column_index[col]] * mask
+            sums[present, j] = np.add.reduceat(values, starts[present], dtype=np.int64)
+        return sums, shelves
+
+
+class CrossFilter:
+    """One session's selections over a ``ShelfIndex``, with its aggregates."""
+
+    def __init__(self, index):
+        self.index = index
+        self.selections = {dimension: () for dimension in DIMENSIONS}
+        self._masks = {}
+        self._results = {}
+
+    def select(self, dimension, values):
+        if dimension not in self.selections:
+            raise KeyError(dimension)
+        values = tuple(values)
+        for value in values:
+            if value not in self.index.value_index[dimension]:
+                raise KeyError(value)
+        self.selections[dimension] = values
+
+    def _dimension_mask(self, dimension):
+        selection = self.selections[dimension]
+        cached = self._masks.get(dimension)
+        if cached is None or cached[0] != selection:
+            cached = self._masks[dimension] = (selection, self.index.mask(dimension, selection))
+        return cached[1]
+
+    def _mask(self, dimensions):
+        # Rows matching every selection in `dimensions`, or None for all rows
+        packed = None
+        for dimension in dimensions:
+            mask = self._dimension_mask(dimension)
+            if mask is not None:
+                packed = mask if packed is None else packed & mask
+        return None if packed is None else self.index.unpack(packed)
+
+    def _aggregate(self, name, build, *params):
+        key = tuple(self.selections[dimension] for dimension in DEPENDS_ON[name]) + params
+        cached = self._results.get(name)
+        if cached is None or cached[0] != key:
+            cached = self._results[name] = (key, build(*params))
+        return cached[1]
+
+    def divergence(self):
+        # Ready-to-plot brand totals and the bottle sums of the filtered shelves
+        return self._aggregate("divergence", self._build_divergence)
+
+    def _build_divergence(self):
+        # Only the selected post codes' row ranges are read; their own
+        # bitmap is implied by the ranges
+        mask = self._mask(DEPENDS_ON["divergence"][1:])
+        sums, shelves = self.index.brand_sums(mask, self.selections["post_code"])
+        schema = self.index.brand_schema
+        brands = np.asarray(schema.brands, dtype=object)
+        brand_sums = sums[:len(schema)].astype(np.float64)
+        selection = DivergenceSlice(brands[schema.is_danone], brand_sums[schema.is_danone],
+                                    brands[schema.is_competitor], -brand_sums[schema.is_competitor])
+        summary = FilteredSummary(shelves, int(sums[self.index.column_index["total_danone"]]),
+                                  int(sums[self.index.column_index["total_bottles"]]))
+        return selection, summary
+
+    def map_values(self, column):
+        # COD_POSTAL / column / danone_share per post code; NaN where no
+        # shelf matches the filters
+        return self._aggregate("map", self._build_map_values, column)
+
+    def _build_map_values(self, column):
+        sums, shelves = self.index.post_code_sums([column, "total_danone", "total_bottles"],
+                                                  self._mask(DEPENDS_ON["map"]))
+        sums = sums.astype(np.float64)
+        sums[shelves == 0] = np.nan
+        with np.errstate(invalid="ignore", divide="ignore"):
+            danone_share = 100 * sums[:, 1] / sums[:, 2]
+        return pd.DataFrame({"COD_POSTAL": self.index.post_codes, column: sums[:, 0], "danone_share": danone_share})
+
+    @property
+    def filters_map(self):
+        # Whether any selection the map depends on is set
+        return any(self.selections[dimension] for dimension in DEPENDS_ON["map"])
+
+
+def _bitmaps(codes, n_values):
+    # One packed row bitmap per code
+    return np.stack([np.packbits(codes == i) for i in range(n_values)]) if n_values \
+        else np.zeros((0, (len(codes) + 7) // 8), dtype=np.uint8)
+
+
+def _income_tiers(post_codes, income_categories):
+    # Income category of each post code, as an object array
+    if isinstance(income_categories, pd.DataFrame):
+        income_categories = income_categories.drop_duplicates("COD_POSTAL").set_index("COD_POSTAL")["Cat_avg_Gross_Income"]
+    if income_categories is None:
+        income_categories = pd.Series(dtype=object)
+    tiers = pd.Series(post_codes, dtype=object).map(income_categories.astype(object))
+    return tiers.fillna(UNKNOWN_CATEGORY).to_numpy(dtype=object)
+
+
+def _tier_order(tiers):
+    # Low / Medium / High first, as pd.qcut labels them, then anything else
+    present = set(tiers)
+    known = [tier for tier in ("Low", "Medium", "High") if tier in present]
+    return known + sorted(present.difference(known), key=str)
@@ -0,0 +1,62 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+ALL_STORE_TYPES = "All"
+
+
+@dataclass(frozen=True)
+class DivergenceSlice:
+    # Ready-to-plot bars for one post code: competitor values are negated
+    danone_brands: np.ndarray
+    danone_values: np.ndarray
+    competitor_brands: np.ndarray
+    competitor_values: np.ndarray
+
+
+class BrandCube:
+    """Brand counts summed per (post code, store type), built once per refresh.
+
+    ``select`` is a dict lookup plus array views, so its cost does not depend
+    on how many shelves or stores the snapshot holds.
+    """
+
+    def __init__(self, df_docs, brand_schema, brand_counts):
+        post_code_codes, post_codes = pd.factorize(df_docs['COD_POSTAL'])
+        store_type_codes, store_types = pd.factorize(df_docs['store_type'])
+        self.post_codes = list(post_codes)
+        self.store_types = list(store_types)
+        self.brand_schema = brand_schema
+        self.post_code_index = {post_code: i for i, post_code in enumerate(self.post_codes)}
+        # Slot 0 holds every store type, slot i + 1 the i-th store type
+        self.store_type_index = {ALL_STORE_TYPES: 0}
+        self.store_type_index.update({store_type: i + 1 for i, store_type in enumerate(self.store_types)})
+
+        n_store_types = len(self.store_types)
+        cells = post_code_codes * n_store_types + store_type_codes
+        sums = pd.DataFrame(brand_counts).groupby(cells).sum()
+        counts = np.zeros((len(self.post_codes) * n_store_types, len(brand_schema)))
+        counts[sums.index.to_numpy()] = sums.to_numpy()
+        counts = counts.reshape(len(self.post_codes), n_store_types, len(brand_schema))
+        self.counts = np.concatenate([counts.sum(axis=1, keepdims=True), counts], axis=1)
+        # Shared by every session, like the slices below
+        self.counts.setflags(write=False)
+
+        danone_brands = np.asarray(brand_schema.brands, dtype=object)[brand_schema.is_danone]
+        competitor_brands = np.asarray(brand_schema.brands, dtype=object)[brand_schema.is_competitor]
+        danone_values = self.counts[..., brand_schema.is_danone]
+        competitor_values = -self.counts[..., brand_schema.is_competitor]
+        danone_values.setflags(write=False)
+        competitor_values.setflags(write=False)
+        self._slices = {}
+        for post_code, i in self.post_code_index.items():
+            for store_type, j in self.store_type_index.items():
+                self._slices[post_code, store_type] = DivergenceSlice(
+                    danone_brands, danone_values[i, j], competitor_brands, competitor_values[i, j])
+
+    def select(self, post_code, store_type=ALL_STORE_TYPES):
+        return self._slices[post_code, store_type]
+
+    def brand_totals(self, post_code, store_type=ALL_STORE_TYPES):
+        return self.counts[self.post_code_index[post_code], self.store_type_index[store_type]]
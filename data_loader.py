@@ -0,0 +1,272 @@
+import datetime
+import json
+import os
+from dataclasses import dataclass
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from brand_schema import BrandSchema
+from crossfilter import ShelfIndex
+from cube import BrandCube
+from geometry import GeometryCache
+from history import HistoryStore, build_rolling_index
+from instrumentation import timed
+from regions import DEFAULT_REGION, REGIONS, get_region
+from rollups import COUNT_COLUMNS, Rollups
+from snapshot import read_docs
+from stats import DashboardStats
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+DOCS_PATH = os.path.join(DATA_DIR, "df_docs.pkl")
+SNAPSHOT_PATH = os.path.join(DATA_DIR, "snapshot")
+LABELS_PATH = os.path.join(DATA_DIR, "competitor_danone_labels_dict.json")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+HISTORY_PATH = os.path.join(DATA_DIR, "history")
+QUARANTINE_PATH = os.path.join(DATA_DIR, "quarantine")
+
+# Shelf keys held as categoricals in the shared frame
+CATEGORY_COLUMNS = ["COD_POSTAL", "store_type", "store_name", "shelf id"]
+
+BRAND_LIST = ['fontvella', 'viladrau', 'cabreiroa', 'vichy', 'lanjaron', 'bezoya', 'veri', 'aquabona', 'solan', 'evian', 'ribes', 'boix', 'aquarel', 'perrier', 'fonter', 'aquafina', 'fontagudes', 'aquadeus', 'casera', 'santaniol', 'cocacola']
+
+
+@dataclass(frozen=True)
+class DashboardData:
+    # Everything both pages need, built once per set of source files.
+    # The frames are shared between sessions: treat them as read-only (the
+    # count arrays are flagged read-only). Sessions keep only their widget
+    # selections.
+    df_docs: pd.DataFrame
+    competitor_danone_labels_dict: dict
+    brand_schema: BrandSchema
+    brand_counts: object
+    cube: BrandCube
+    # Row bitmaps per post code, store type, income tier and brand, for the
+    # cross-filters of the Granular page
+    shelf_index: ShelfIndex
+    gdf_post_code: gpd.GeoDataFrame
+    geometry: GeometryCache
+    post_code_data: pd.DataFrame
+    # Additive sums from shelf to city; shares are derived per lookup
+    rollups: Rollups
+    variables_list: list
+    codigos_postales: list
+    # Shares, podium and income correlations, computed once per snapshot
+    stats: DashboardStats
+    # When the detections were last written; version and built_at are set by
+    # the background refresher when it publishes the snapshot
+    updated_at: datetime.datetime
+    version: int = 0
+    built_at: datetime.datetime = None
+
+
+def source_signature(path):
+    # Cheap cache key for a source file: changes whenever the file is rewritten
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+@timed()
+def _load_docs(signature, post_codes=None, exclude_post_codes=None):
+    # Load local data for testing mode as firebase has 50K queried documents/day limit.
+    # Only the partitions of the requested post codes are read from the snapshot.
+    return _tidy_docs(read_docs(signature[0], post_codes=post_codes, exclude_post_codes=exclude_post_codes))
+
+
+def _tidy_docs(df_docs):
+    df_docs = df_docs.rename({"post_code": "COD_POSTAL"}, axis=1)
+    # The stored danone_share is a sum of per-photo percentages; shares are
+    # derived from the bottle counts by the rollups instead
+    df_docs = df_docs.drop(columns="danone_share", errors="ignore")
+    return compact_docs(df_docs)
+
+
+def compact_docs(df_docs):
+    # The shared frame stays resident for the life of the process: store keys
+    # repeat a few hundred values over every shelf, and bottle counts come out
+    # of fillna(0) as float64 although they are whole numbers
+    df_docs = df_docs.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        if col in df_docs.columns and df_docs[col].dtype == object:
+            df_docs[col] = df_docs[col].astype("category")
+    for col in df_docs.columns.difference(CATEGORY_COLUMNS, sort=False):
+        values = df_docs[col].to_numpy()
+        if values.dtype.kind != "f" or values.dtype.itemsize <= 4:
+            continue
+        with np.errstate(invalid="ignore"):
+            compact = values.astype(np.int32)
+        if np.array_equal(compact, values):
+            df_docs[col] = compact
+    return df_docs
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+@timed()
+def _load_labels(signature):
+    # Competitor info load
+    with open(signature[0], 'r') as json_file:
+        return json.load(json_file)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+@timed()
+def _load_income(signature):
+    # External Info: gross salary
+    gross_salary_postcode_df = pd.read_csv(signature[0], sep=";", decimal=",")
+    gross_salary_postcode_df['Cat_avg_Gross_Income'] = pd.qcut(gross_salary_postcode_df['Average Gross Income'], q=3, labels=['Low', 'Medium', 'High'])
+    gross_salary_postcode_df['Cat_avg_Disposable_Income'] = pd.qcut(gross_salary_postcode_df['Average Disposable Income'], q=3, labels=['Low', 'Medium', 'High'])
+    return gross_salary_postcode_df
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+@timed()
+def _load_geometry(signature):
+    # Post codes geojson load
+    return gpd.read_file(signature[0], columns=["COD_POSTAL", "geometry"])
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+@timed()
+def _load_geometry_cache(signature):
+    # Centroids, bounds and simplified GeoJSON persist next to the data, so a
+    # new process does not have to derive them from the polygons again
+    path, mtime_ns, size = signature
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(CACHE_DIR, f"geometry-{name}-{mtime_ns}-{size}.json")
+    if os.path.exists(cache_path):
+        return GeometryCache.load(cache_path)
+
+    geometry_cache = GeometryCache.from_geodataframe(_load_geometry(signature))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    geometry_cache.save(cache_path)
+    return geometry_cache
+
+
+@timed()
+def merge_post_codes(rollups, gdf_post_code):
+    # merge post codes and detections: brand and bottle sums per post code,
+    # with the Danone share of its bottles
+    sums = [measure for measure in rollups.measures if measure not in COUNT_COLUMNS]
+    post_code_data = rollups.frame("post_code")[["COD_POSTAL"] + sums + ["danone_share"]]
+
+    gdf_post_code = gdf_post_code.merge(post_code_data,
+                                        on="COD_POSTAL",
+                                        how="left")
+    return post_code_data, gdf_post_code
+
+
+def _region_post_codes(geojson_sig, other_geojson_sigs):
+    # (post_codes, exclude_post_codes) of a region's shelves: those whose post
+    # code is one of its polygons. The default region is passed the other
+    # regions' geometry instead and also keeps the shelves no registered region
+    # claims, so none are lost. Both are sorted tuples, so they key the caches.
+    own = set(_load_geometry(geojson_sig)["COD_POSTAL"])
+    if other_geojson_sigs is None:
+        return tuple(sorted(own)), None
+    others = {post_code for sig in other_geojson_sigs for post_code in _load_geometry(sig)["COD_POSTAL"]}
+    return None, tuple(sorted(others - own))
+
+
+def _region_docs(docs_sig, geojson_sig, other_geojson_sigs):
+    post_codes, exclude_post_codes = _region_post_codes(geojson_sig, other_geojson_sigs)
+    return _load_docs(docs_sig, post_codes=post_codes, exclude_post_codes=exclude_post_codes)
+
+
+@st.cache_resource(show_spinner="Loading data...", max_entries=8)
+@timed()
+def _build_dashboard_data(docs_sig, labels_sig, income_sig, geojson_sig, other_geojson_sigs=None):
+    df_docs = _region_docs(docs_sig, geojson_sig, other_geojson_sigs)
+    competitor_danone_labels_dict = _load_labels(labels_sig)
+
+    income = _load_income(income_sig)
+    gdf_post_code = _load_geometry(geojson_sig).merge(
+        income,
+        on=["COD_POSTAL"],
+        how="inner"
+    )
+
+    variables_list = list(df_docs.columns.intersection(BRAND_LIST))
+    brand_schema = BrandSchema.from_labels(competitor_danone_labels_dict).subset(variables_list)
+    brand_counts = brand_schema.count_matrix(df_docs, dtype=None)
+    brand_counts.setflags(write=False)
+
+    rollups = Rollups.from_docs(df_docs, brand_schema, brand_counts, income[["COD_POSTAL", "Cat_avg_Gross_Income"]])
+    post_code_data, gdf_post_code = merge_post_codes(rollups, gdf_post_code)
+    stats = DashboardStats.from_data(rollups, brand_schema, gdf_post_code, variables_list)
+
+    return DashboardData(
+        df_docs=df_docs,
+        competitor_danone_labels_dict=competitor_danone_labels_dict,
+        brand_schema=brand_schema,
+        brand_counts=brand_counts,
+        cube=BrandCube(df_docs, brand_schema, brand_counts),
+        shelf_index=ShelfIndex(df_docs, brand_schema, brand_counts, income[["COD_POSTAL", "Cat_avg_Gross_Income"]]),
+        gdf_post_code=gdf_post_code,
+        geometry=_load_geometry_cache(geojson_sig),
+        post_code_data=post_code_data,
+        rollups=rollups,
+        variables_list=variables_list,
+        codigos_postales=[str(post_code) for post_code in df_docs['COD_POSTAL'].unique()],
+        stats=stats,
+        updated_at=datetime.datetime.fromtimestamp(docs_sig[1] / 1e9),
+    )
+
+
+def docs_source():
+    # Prefer the columnar snapshot, fall back to the legacy pickle
+    return SNAPSHOT_PATH if os.path.isdir(SNAPSHOT_PATH) else DOCS_PATH
+
+
+@timed()
+def load_dashboard_data(region=DEFAULT_REGION):
+    # Only the file metadata is checked on a rerun; the files themselves are
+    # parsed again only after one of them changes on disk. Each region's
+    # geometry is loaded the first time that region is asked for, and its
+    # frames hold only its own shelves.
+    region = get_region(region)
+    return _build_dashboard_data(
+        source_signature(docs_source()),
+        source_signature(LABELS_PATH),
+        source_signature(region.income_path),
+        source_signature(region.geojson_path),
+        _other_geojson_sigs(region),
+    )
+
+
+def _other_geojson_sigs(region):
+    # Only the default region is scoped by the other regions' geometry
+    if region.key != DEFAULT_REGION:
+        return None
+    return tuple(source_signature(other.geojson_path) for key, other in REGIONS.items() if key != region.key)
+
+
+@st.cache_resource(show_spinner="Loading history...", max_entries=8)
+@timed()
+def _build_rolling_index(history_sig, level, brands, region, geojson_sig, other_geojson_sigs):
+    post_codes, exclude_post_codes = _region_post_codes(geojson_sig, other_geojson_sigs)
+    return build_rolling_index(HistoryStore(HISTORY_PATH), level, brands, cache_dir=CACHE_DIR, region=region,
+                               post_codes=post_codes, exclude_post_codes=exclude_post_codes)
+
+
+def load_trends(level, region=DEFAULT_REGION):
+    # Rolling-window index over the stored daily history of one region's
+    # shelves for one trend level; rebuilt only after ingestion writes to the
+    # history
+    region = get_region(region)
+    return _build_rolling_index(HistoryStore(HISTORY_PATH).signature(), level, tuple(BRAND_LIST), region.key,
+                                source_signature(region.geojson_path), _other_geojson_sigs(region))
+
+
+def load_labels():
+    return _load_labels(source_signature(LABELS_PATH))
+
+
+def invalidate():
+    # Drop every cached stage, e.g. after replacing files with identical mtimes
+    for cached in (_load_docs, _load_labels, _load_income, _load_geometry, _load_geometry_cache, _build_dashboard_data,
+                   _build_rolling_index):
+        cached.clear()
@@ -0,0 +1,285 @@
+"""Batch export of one static report per post code, and per store type in it.
+
+    python export_reports.py --out reports --format pdf --workers 4
+
+Each report is one A4 landscape page with three parts:
+
+- the divergence chart of the post code, and store type if one is given;
+- the city map, colored by Danone share, with the post code outlined;
+- the post code's bottle and shelf shares, next to the city's.
+
+The snapshot is loaded once, in this process, by the loader the pages use.
+The numbers of each report are read from the brand cube and the rollups.
+The map polygons come from the cached simplified GeoJSON. Worker processes
+are forked afterwards, so they share the snapshot instead of loading it
+again. Each worker renders with Matplotlib's Agg backend, so no browser or
+display is needed. Plotly's static export would need kaleido and a headless
+Chrome, so the reports redraw the pages' charts in Matplotlib instead.
+Files are named ``<post code>-<store type>.<format>``. The run ends with its
+throughput, in reports per minute.
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from cube import ALL_STORE_TYPES
+
+FORMATS = ("pdf", "png", "svg")
+# A4 landscape, in inches
+PAGE_SIZE = (11.69, 8.27)
+SHARE_COLUMNS = [("danone_share", "Danone bottles"), ("competitor_share", "Competitor bottles"),
+                 ("danone_shelf_share", "Danone shelf share"), ("competitor_shelf_share", "Competitor shelf share")]
+
+
+@dataclass(frozen=True)
+class Report:
+    post_code: str
+    store_type: str
+    # Bar lengths in the brand order of the job; competitors negated
+    danone_values: np.ndarray
+    competitor_values: np.ndarray
+    # post_code_summary of the post code and store type
+    summary: dict
+
+
+@dataclass(frozen=True)
+class ReportJob:
+    # What every report shares; handed to each worker once
+    region: str
+    out_dir: str
+    fmt: str
+    dpi: int
+    danone_brands: np.ndarray
+    competitor_brands: np.ndarray
+    # Outer rings of every post code polygon, as (n, 2) lon / lat arrays
+    polygons: dict
+    # Danone share (percent) per post code, for the map colors
+    danone_share: dict
+    city: dict
+
+
+@dataclass
+class ExportStats:
+    reports: int = 0
+    workers: int = 0
+    seconds: float = 0.0
+    # Summed over reports, across workers
+    render_seconds: float = 0.0
+
+    @property
+    def reports_per_minute(self):
+        return 60 * self.reports / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.reports} reports on {self.workers} workers in {self.seconds:.1f}s "
+                f"({self.reports_per_minute:.0f} reports/minute, "
+                f"{self.render_seconds / max(self.reports, 1) * 1e3:.0f} ms per report)")
+
+
+def outer_rings(geojson):
+    # Post code -> exterior rings of its polygons; holes are left out of the thumbnail map
+    polygons = {}
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        parts = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+        polygons[str(feature["id"])] = [np.asarray(part[0], dtype=np.float64) for part in parts]
+    return polygons
+
+
+def plan_reports(data, post_codes=None, by_store_type=True):
+    # Every post code, and every store type it has shelves of, in cube order
+    cube = data.cube
+    store_types = [ALL_STORE_TYPES] + (list(cube.store_types) if by_store_type else [])
+    reports = []
+    for post_code in post_codes or cube.post_codes:
+        if post_code not in cube.post_code_index:
+            raise KeyError(post_code)
+        for store_type in store_types:
+            summary = (data.rollups.lookup("post_code", post_code) if store_type == ALL_STORE_TYPES
+                       else data.rollups.lookup("store_type", (post_code, store_type)))
+            if summary is None:
+                continue
+            selection = cube.select(post_code, store_type)
+            reports.append(Report(str(post_code), str(store_type), selection.danone_values,
+                                  selection.competitor_values, summary))
+    return reports
+
+
+def make_job(data, region, out_dir, fmt="pdf", dpi=100, zoom=11):
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(map(repr, FORMATS))}")
+    shares = data.post_code_data.set_index("COD_POSTAL")["danone_share"]
+    # Every slice of the cube shares the same brand arrays
+    brands = data.cube.select(data.cube.post_codes[0])
+    return ReportJob(
+        region=region,
+        out_dir=out_dir,
+        fmt=fmt,
+        dpi=dpi,
+        danone_brands=brands.danone_brands,
+        competitor_brands=brands.competitor_brands,
+        polygons=outer_rings(data.geometry.geojson(zoom)),
+        danone_share={str(post_code): share for post_code, share in shares.items()},
+        city=data.rollups.lookup("city"),
+    )
+
+
+def report_path(job, report):
+    name = re.sub(r"[^\w.-]+", "_", f"{report.post_code}-{report.store_type}")
+    return os.path.join(job.out_dir, f"{name}.{job.fmt}")
+
+
+class ReportPage:
+    """The report figure of one worker, drawn once and updated per report.
+
+    Axes, tick labels and the city polygons are built when the worker starts.
+    A report only sets the bar lengths, the post code outline and the titles,
+    then saves. A bare Figure is used, not pyplot, so nothing global has to
+    be closed between reports.
+    """
+
+    def __init__(self, job):
+        from matplotlib import colormaps
+        from matplotlib.collections import PolyCollection
+        from matplotlib.figure import Figure
+        from matplotlib.ticker import AutoLocator, FuncFormatter
+
+        from charts_matplotlib import draw_divergence
+
+        self.job = job
+        self.fig = Figure(figsize=PAGE_SIZE)
+        # Fixed margins: the layout is the same for every report, so
+        # tight_layout would only measure the same labels again
+        grid = self.fig.add_gridspec(2, 2, width_ratios=[3, 2], left=0.1, right=0.97, bottom=0.1, top=0.89,
+                                     wspace=0.45, hspace=0.3)
+
+        self.divergence = self.fig.add_subplot(grid[:, 0])
+        draw_divergence(self.divergence, job.danone_brands, np.zeros(len(job.danone_brands)),
+                        job.competitor_brands, np.zeros(len(job.competitor_brands)), "Competitor vs Danone")
+        # Ticks follow the data of each report, still shown as absolute values
+        self.divergence.xaxis.set_major_locator(AutoLocator())
+        self.divergence.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f"{abs(x):g}"))
+        self.danone_bars, self.competitor_bars = self.divergence.containers
+
+        ax = self.fig.add_subplot(grid[0, 1])
+        colormap = colormaps["Blues"]
+        verts, colors = [], []
+        for post_code, rings in job.polygons.items():
+            share = job.danone_share.get(post_code, np.nan)
+            color = colormap(share / 100) if np.isfinite(share) else (0.9, 0.9, 0.9, 1.0)
+            verts += rings
+            colors += [color] * len(rings)
+        ax.add_collection(PolyCollection(verts, facecolors=colors, edgecolors="grey", linewidths=0.3))
+        self.outline = ax.add_collection(PolyCollection([], facecolors="none", edgecolors="red", linewidths=1.5))
+        ax.autoscale_view()
+        ax.set_aspect("equal")
+        ax.set_axis_off()
+        ax.set_title("Danone share by post code", fontsize=12)
+
+        ax = self.fig.add_subplot(grid[1, 1])
+        y = np.arange(len(SHARE_COLUMNS))
+        self.share_bars = ax.barh(y - 0.2, np.zeros(len(y)), height=0.4, color="#3182bd", label="Post code")
+        ax.barh(y + 0.2, self.shares(job.city), height=0.4, color="#bdbdbd", label="City")
+        ax.set_yticks(y, [label for _, label in SHARE_COLUMNS])
+        ax.invert_yaxis()
+        ax.set_xlim(0, 100)
+        ax.set_xlabel("%")
+        ax.legend(loc="upper right", fontsize=9)
+        ax.set_title("Shares", fontsize=12)
+
+        self.title = self.fig.suptitle("", fontsize=16)
+        self.footer = self.fig.text(0.01, 0.01, "", fontsize=9)
+
+    @staticmethod
+    def shares(summary):
+        # Bottle shares are percentages, shelf shares fractions
+        return [summary[col] * (1 if col in ("danone_share", "competitor_share") else 100) for col, _ in SHARE_COLUMNS]
+
+    def render(self, report):
+        for bar, value in zip(self.danone_bars, report.danone_values):
+            bar.set_width(value)
+        for bar, value in zip(self.competitor_bars, report.competitor_values):
+            bar.set_width(value)
+        self.divergence.relim()
+        self.divergence.autoscale_view()
+        self.outline.set_verts(self.job.polygons.get(report.post_code, []))
+        for bar, value in zip(self.share_bars, self.shares(report.summary)):
+            bar.set_width(value)
+
+        summary = report.summary
+        store_type = "all store types" if report.store_type == ALL_STORE_TYPES else f"store type {report.store_type}"
+        self.title.set_text(f"Post code {report.post_code}, {store_type}")
+        self.footer.set_text(f"{self.job.region}: {summary['total_bottles']:.0f} bottles on "
+                             f"{summary['shelves']:.0f} shelves, Danone share {summary['danone_share']:.1f}%")
+        path = report_path(self.job, report)
+        self.fig.savefig(path, format=self.job.fmt, dpi=self.job.dpi)
+        return path
+
+
+# Set in each worker by _init_worker
+_PAGE = None
+
+
+def _init_worker(job):
+    global _PAGE
+    import matplotlib
+    matplotlib.use("Agg")
+    _PAGE = ReportPage(job)
+
+
+def _render(report):
+    start = time.perf_counter()
+    path = _PAGE.render(report)
+    return path, time.perf_counter() - start
+
+
+def export(data, region, out_dir, fmt="pdf", workers=None, post_codes=None, by_store_type=True, dpi=100):
+    """Render every report of ``data`` into ``out_dir``; returns the paths and an ``ExportStats``."""
+    workers = workers or os.cpu_count()
+    job = make_job(data, region, out_dir, fmt, dpi)
+    reports = plan_reports(data, post_codes, by_store_type)
+    os.makedirs(out_dir, exist_ok=True)
+    stats = ExportStats(reports=len(reports), workers=workers)
+    start = time.perf_counter()
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(job,)) as pool:
+        # A few reports per task keeps the pickling overhead per report small
+        chunksize = max(1, len(reports) // (workers * 4))
+        for path, seconds in pool.map(_render, reports, chunksize=chunksize):
+            paths.append(path)
+            stats.render_seconds += seconds
+    stats.seconds = time.perf_counter() - start
+    return paths, stats
+
+
+def main():
+    from regions import DEFAULT_REGION, REGIONS
+
+    parser = argparse.ArgumentParser(description="Export one static report per post code and store type")
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--format", choices=FORMATS, default="pdf")
+    parser.add_argument("--region", choices=list(REGIONS), default=DEFAULT_REGION)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--post-codes", nargs="+", default=None, help="default: every post code with detections")
+    parser.add_argument("--no-store-types", action="store_true", help="one report per post code only")
+    parser.add_argument("--dpi", type=int, default=100)
+    args = parser.parse_args()
+
+    from data_loader import load_dashboard_data
+
+    data = load_dashboard_data(args.region)
+    try:
+        _, stats = export(data, args.region, args.out, args.format, args.workers, args.post_codes,
+                          not args.no_store_types, args.dpi)
+    except KeyError as exc:
+        parser.error(f"unknown post code {exc}")
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import functools
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from atomic import replacing_file
+
+
+def fingerprint(*values):
+    # Stable content hash of the inputs a chart is built from
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        _feed(digest, value)
+    return digest.hexdigest()
+
+
+def _feed(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"(")
+        for item in value:
+            _feed(digest, item)
+        digest.update(b")")
+    elif isinstance(value, dict):
+        _feed(digest, sorted(value.items(), key=lambda item: repr(item[0])))
+    elif hasattr(value, "fingerprint"):
+        digest.update(str(value.fingerprint).encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def figure_size(fig):
+    # Bytes Streamlit ships to the browser for this figure
+    return len(fig.to_json(validate=False))
+
+
+# Figures prebuilt by warmup.py; BOTTLE_VISION_FIGURE_STORE overrides the
+# directory, and an empty value turns the store off
+FIGURE_STORE_PATH = os.environ.get("BOTTLE_VISION_FIGURE_STORE",
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data", "cache", "figures"))
+CHARTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charts.py")
+
+
+def code_version():
+    # A stored figure also depends on the code that built it: the chart
+    # helpers and the Plotly release
+    import plotly
+
+    digest = hashlib.blake2b(digest_size=8)
+    with open(CHARTS_PATH, "rb") as file:
+        digest.update(file.read())
+    digest.update(plotly.__version__.encode())
+    return digest.hexdigest()
+
+
+class FigureStore:
+    """Figures serialized to disk, keyed like the cache entries and their data.
+
+    A new process loads a stored figure instead of building it, which skips
+    Plotly Express and trace validation. Only ``warmup.py`` writes (with
+    ``writable``). Figures are kept in a subdirectory per ``code_version()``,
+    so after a change to charts.py or a Plotly upgrade the old ones are not
+    found and the figures are built again. Figures of older data are not
+    found either, as the data is part of the file name; ``clear()`` removes
+    both kinds.
+    """
+
+    def __init__(self, path, writable=False, version=None):
+        self.path = path
+        self.writable = writable
+        self._version = version
+
+    @functools.cached_property
+    def directory(self):
+        return os.path.join(self.path, self._version or code_version())
+
+    def _file(self, key, data_key):
+        return os.path.join(self.directory, f"{key[0]}-{fingerprint(key[1], data_key)}.json")
+
+    def load(self, key, data_key):
+        path = self._file(key, data_key)
+        if not os.path.exists(path):
+            return None
+        import plotly.io as pio
+        with open(path, "r") as file:
+            return pio.from_json(file.read())
+
+    def save(self, key, data_key, fig):
+        if not self.writable:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._file(key, data_key)
+        with replacing_file(path) as tmp_path, open(tmp_path, "w") as file:
+            file.write(fig.to_json(validate=False))
+
+    def clear(self):
+        # Every version's figures, and the unversioned files of older stores
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                elif entry.name.endswith(".json"):
+                    os.remove(entry.path)
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data_key = None
+        self.fig = None
+        self.size = 0
+
+
+class FigureCache:
+    """LRU cache of Plotly figures shared by every session of the process.
+
+    Entries are keyed on (helper, layout parameters). When the same entry is
+    asked for with different data, ``update`` mutates the cached figure's
+    trace arrays in place instead of building a new one; without an
+    ``update`` the figure is rebuilt. The entry stays locked while the caller
+    is inside ``figure()``, so render the figure within the ``with`` block.
+    A figure missing from memory is looked up in ``store`` before it is built.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=64 * 1024 * 1024, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"hits": 0, "misses": 0, "updates": 0, "loads": 0, "evictions": 0,
+                                           "build_seconds": 0.0, "update_seconds": 0.0, "load_seconds": 0.0,
+                                           "payload_bytes": 0})
+
+    @contextmanager
+    def figure(self, helper, build, params=(), data=(), update=None):
+        key = (helper, fingerprint(params))
+        data_key = fingerprint(data)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+
+        with entry.lock:
+            if entry.fig is not None and entry.data_key == data_key:
+                self._record(helper, hits=1)
+            elif entry.fig is not None and update is not None:
+                start = time.perf_counter()
+                try:
+                    update(entry.fig)
+                except Exception:
+                    # Never leave a half-updated figure behind
+                    entry.fig = None
+                    raise
+                self._record(helper, updates=1, update_seconds=time.perf_counter() - start)
+                entry.data_key = data_key
+            else:
+                start = time.perf_counter()
+                entry.fig = self.store.load(key, data_key) if self.store is not None else None
+                if entry.fig is not None:
+                    self._record(helper, loads=1, load_seconds=time.perf_counter() - start)
+                else:
+                    entry.fig = build()
+                    self._record(helper, misses=1, build_seconds=time.perf_counter() - start)
+                    if self.store is not None:
+                        self.store.save(key, data_key, entry.fig)
+                entry.data_key = data_key
+                entry.size = figure_size(entry.fig)
+                with self._lock:
+                    self._stats[helper]["payload_bytes"] = entry.size
+                self._evict(keep=key)
+            yield entry.fig
+
+    def _record(self, helper, **increments):
+        with self._lock:
+            stats = self._stats[helper]
+            for name, value in increments.items():
+                stats[name] += value
+
+    def _evict(self, keep):
+        with self._lock:
+            total = sum(entry.size for entry in self._entries.values())
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or total > self.max_bytes):
+                key = next(iter(self._entries))
+                if key == keep:
+                    self._entries.move_to_end(key)
+                    key = next(iter(self._entries))
+                entry = self._entries.pop(key)
+                total -= entry.size
+                self._stats[key[0]]["evictions"] += 1
+
+    def stats(self):
+        report = {}
+        with self._lock:
+            snapshot = {helper: dict(stats) for helper, stats in self._stats.items()}
+        for helper, stats in snapshot.items():
+            lookups = stats["hits"] + stats["misses"] + stats["updates"] + stats["loads"]
+            report[helper] = dict(stats,
+                                  hit_rate=stats["hits"] / lookups if lookups else 0.0,
+                                  mean_build_seconds=stats["build_seconds"] / stats["misses"] if stats["misses"] else 0.0)
+        return report
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# One cache per process: Streamlit imports this module once and re-runs only
+# the page scripts
+FIGURE_CACHE = FigureCache(store=FigureStore(FIGURE_STORE_PATH) if FIGURE_STORE_PATH else None)
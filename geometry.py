@@ -0,0 +1,85 @@
+import hashlib
+import json
+import warnings
+
+import pandas as pd
+
+from atomic import replacing_file
+
+# Simplification tolerance (degrees) by minimum map zoom: coarse outlines for
+# the city overview, full detail once the user zooms into a few blocks
+ZOOM_TOLERANCES = {0: 0.0005, 12: 0.0002, 14: 0.00005, 16: 0.0}
+
+# Coordinates are snapped to ~0.1 m, which keeps the GeoJSON text short
+COORDINATE_GRID = 1e-6
+
+
+class GeometryCache:
+    """Parsed-once post-code polygons, ready to hand to Plotly.
+
+    Holds the centroids, bounds and one GeoJSON FeatureCollection per
+    simplification level, with every feature ``id`` set to its COD_POSTAL so
+    choropleths only need the post codes and the color vector.
+    """
+
+    def __init__(self, centroids, bounds, geojson_by_tolerance):
+        self.centroids = centroids
+        self.bounds = bounds
+        self.geojson_by_tolerance = geojson_by_tolerance
+        self.center = {'lat': float(centroids['lat'].mean()),
+                       'lon': float(centroids['lon'].mean())}
+        # Identifies the polygon set for figure caching without hashing the GeoJSON
+        self.fingerprint = hashlib.blake2b(
+            bounds.to_numpy().tobytes() + repr(sorted(geojson_by_tolerance)).encode(),
+            digest_size=16).hexdigest()
+
+    @classmethod
+    def from_geodataframe(cls, gdf_post_code, tolerances=ZOOM_TOLERANCES):
+        geometry = gdf_post_code.set_index("COD_POSTAL").geometry
+
+        with warnings.catch_warnings():
+            # Same geographic-CRS centroids the map has always been centred on
+            warnings.simplefilter("ignore", UserWarning)
+            center = geometry.centroid
+        centroids = pd.DataFrame({'lat': center.y, 'lon': center.x})
+        bounds = geometry.bounds
+
+        geojson_by_tolerance = {}
+        for tolerance in sorted(set(tolerances.values())):
+            simplified = geometry.simplify(tolerance, preserve_topology=True) if tolerance else geometry
+            simplified = simplified.set_precision(COORDINATE_GRID)
+            geojson_by_tolerance[tolerance] = json.loads(simplified.to_json(drop_id=False))
+
+        return cls(centroids, bounds, geojson_by_tolerance)
+
+    def tolerance_for_zoom(self, zoom):
+        tolerance = ZOOM_TOLERANCES[0]
+        for min_zoom, level in sorted(ZOOM_TOLERANCES.items()):
+            if zoom >= min_zoom and level in self.geojson_by_tolerance:
+                tolerance = level
+        return tolerance
+
+    def geojson(self, zoom=11):
+        return self.geojson_by_tolerance[self.tolerance_for_zoom(zoom)]
+
+    def save(self, path):
+        state = {
+            "centroids": self.centroids.to_dict(orient="split"),
+            "bounds": self.bounds.to_dict(orient="split"),
+            "geojson": [[tolerance, geojson] for tolerance, geojson in self.geojson_by_tolerance.items()],
+        }
+        with replacing_file(path) as tmp_path, open(tmp_path, "w") as file:
+            json.dump(state, file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as file:
+            state = json.load(file)
+        centroids = pd.DataFrame(**state["centroids"]).rename_axis("COD_POSTAL")
+        bounds = pd.DataFrame(**state["bounds"]).rename_axis("COD_POSTAL")
+        return cls(centroids, bounds, {tolerance: geojson for tolerance, geojson in state["geojson"]})
+
+
+def geojson_size(geojson):
+    # Bytes a FeatureCollection adds to every figure that embeds it
+    return len(json.dumps(geojson, separators=(",", ":")))
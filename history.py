@@ -0,0 +1,287 @@
+"""Append-only daily history of the per-shelf aggregates.
+
+Every ingestion writes the day-level sums of the documents it read into
+``Data/history/date=YYYY-MM-DD/*.parquet`` (one hive partition per day).
+Trend queries read only the columns they need, collapse them to daily sums
+per post code, store or brand, and keep cumulative sums of the share's
+numerator and denominator, so a 7, 30 or 90-day window ending on any day
+is two subtractions.
+"""
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from atomic import replacing_directory, replacing_file
+from instrumentation import timed
+from snapshot import post_code_filter
+
+DATE_COLUMN = "date"
+HISTORY_FORMAT = "parquet"
+WINDOWS = (7, 30, 90)
+HISTORY_TIMEZONE = "Europe/Madrid"
+
+# Document field with the photo's upload time; without it the Firestore
+# create_time is used, and failing that the day of ingestion
+DATE_FIELD = os.environ.get("BOTTLE_VISION_DATE_FIELD") or None
+
+# Post code column as stored; the snapshot renames it to COD_POSTAL only
+# when it is loaded
+POST_CODE_COLUMN = "post_code"
+
+# Group keys of each trend level, as stored
+LEVELS = {
+    "post_code": ["post_code"],
+    "store": ["post_code", "store_type", "store_name"],
+    "brand": [],
+}
+
+
+def document_dates(docs, records, date_field=DATE_FIELD, tz=HISTORY_TIMEZONE):
+    # Local calendar day of every document
+    values = []
+    for elem, record in zip(docs, records):
+        value = record.get(date_field) if date_field else None
+        if value is None:
+            value = getattr(elem, "create_time", None)
+        values.append(value)
+    stamps = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors="coerce")
+    today = pd.Timestamp.now(tz=tz).normalize().tz_localize(None)
+    return stamps.dt.tz_convert(tz).dt.tz_localize(None).dt.normalize().fillna(today).to_numpy()
+
+
+def daily_shelf_sums(df_docs, dates, shelf_keys):
+    # Day-level sums per shelf from a prepare_docs frame; `dates` is aligned
+    # with the records prepare_docs was given
+    daily = df_docs.drop(["photo_type", "danone_share"], axis=1, errors="ignore")
+    daily.insert(0, DATE_COLUMN, dates[df_docs.index.to_numpy()])
+    return daily.groupby([DATE_COLUMN] + shelf_keys).sum(numeric_only=True).reset_index()
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+
+    def _partition_path(self, day):
+        return os.path.join(self.path, f"{DATE_COLUMN}={pd.Timestamp(day).date().isoformat()}")
+
+    @timed("history_append")
+    def append(self, daily, replace=False):
+        """Add one file per day of ``daily`` to the store.
+
+        With ``replace`` the new files supersede everything already stored
+        for those days, for rebuilds from a full read of the collection.
+        """
+        if daily.empty:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        for day, frame in daily.groupby(DATE_COLUMN, sort=True):
+            table = pa.Table.from_pandas(frame.drop(columns=DATE_COLUMN), preserve_index=False)
+            partition = self._partition_path(day)
+            if replace:
+                # Build the day's new partition aside, then swap it in
+                with replacing_directory(partition) as tmp_path:
+                    pq.write_table(table, os.path.join(tmp_path, name))
+            else:
+                # Readers skip dot files, so the day only changes once the rename lands
+                os.makedirs(partition, exist_ok=True)
+                with replacing_file(os.path.join(partition, name)) as tmp_file:
+                    pq.write_table(table, tmp_file)
+
+    def partitions(self):
+        # Sorted day directories, without any half-swapped .tmp/.old ones
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(entry.path for entry in os.scandir(self.path)
+                      if entry.is_dir() and entry.name.startswith(f"{DATE_COLUMN}=") and "." not in entry.name)
+
+    def signature(self):
+        # Changes whenever a day is added or written to
+        return tuple((path, os.stat(path).st_mtime_ns) for path in self.partitions())
+
+    def _dataset(self, partitions=None):
+        partitions = self.partitions() if partitions is None else partitions
+        files = [entry.path for partition in partitions for entry in os.scandir(partition)
+                 if entry.is_file() and entry.name.endswith(".parquet")]
+        if not files:
+            return None
+        partitioning = ds.partitioning(pa.schema([(DATE_COLUMN, pa.string())]), flavor="hive")
+        dataset = ds.dataset(files, format=HISTORY_FORMAT, partitioning=partitioning, partition_base_dir=self.path)
+        # Brands added to the labels later are missing from older days
+        schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()]
+                                  + [pa.schema([(DATE_COLUMN, pa.string())])])
+        return ds.dataset(files, schema=schema, format=HISTORY_FORMAT, partitioning=partitioning,
+                          partition_base_dir=self.path)
+
+    @timed("history_daily")
+    def daily(self, keys, columns, partitions=None, post_codes=None, exclude_post_codes=None):
+        """Daily sums of ``columns`` per ``keys``, read without the other columns.
+
+        ``post_codes`` keeps only the shelves of those post codes, and
+        ``exclude_post_codes`` leaves out the shelves of those, as for a region.
+        """
+        dataset = self._dataset(partitions)
+        if dataset is None:
+            return pd.DataFrame({DATE_COLUMN: pd.Series(dtype="datetime64[ns]"),
+                                 **{key: pd.Series(dtype=object) for key in keys},
+                                 **{col: pd.Series(dtype=np.float64) for col in columns}})
+        present = [col for col in columns if col in dataset.schema.names]
+        row_filter = post_code_filter(POST_CODE_COLUMN, post_codes, exclude_post_codes)
+        table = dataset.to_table(columns=[DATE_COLUMN] + list(keys) + present, filter=row_filter)
+        # Aggregate in Arrow; pandas only sees one row per day and group
+        daily = table.group_by([DATE_COLUMN] + list(keys)).aggregate([(col, "sum") for col in present])
+        daily = daily.to_pandas().rename(columns={f"{col}_sum": col for col in present})
+        daily[DATE_COLUMN] = pd.to_datetime(daily[DATE_COLUMN])
+        for col in columns:
+            daily[col] = daily[col].fillna(0) if col in present else 0.0
+        return daily[[DATE_COLUMN] + list(keys) + list(columns)]
+
+    @timed("history_rollup")
+    def rollup(self, keys, columns, cache_path, post_codes=None, exclude_post_codes=None):
+        """``daily(keys, columns, ...)``, kept up to date in a cache file.
+
+        Days are independent partitions, so only the days added or rewritten
+        since the cache was saved are read; the rest comes from the cache.
+        """
+        current = dict(self.signature())
+        scope = {"post_codes": None if post_codes is None else list(post_codes),
+                 "exclude_post_codes": list(exclude_post_codes or ())}
+        cached, seen = None, {}
+        if os.path.exists(cache_path):
+            table = pq.read_table(cache_path)
+            state = json.loads(table.schema.metadata[b"history_rollup"])
+            if (state["keys"] == list(keys) and state["columns"] == list(columns)
+                    and state.get("scope", scope) == scope):
+                cached, seen = table.to_pandas(), state["partitions"]
+
+        stale = [path for path, mtime in current.items() if seen.get(path) != mtime]
+        if cached is not None and not stale and len(seen) == len(current):
+            return cached
+
+        fresh = self.daily(keys, columns, partitions=stale, post_codes=post_codes,
+                           exclude_post_codes=exclude_post_codes)
+        if cached is not None:
+            # Drop the days that were rewritten or removed, then add them back
+            keep_days = {self._partition_day(path) for path in current if path not in stale}
+            cached = cached[cached[DATE_COLUMN].isin(pd.to_datetime(sorted(keep_days)))]
+            fresh = pd.concat([cached, fresh], ignore_index=True) if len(fresh) else cached
+        daily = fresh.sort_values([DATE_COLUMN] + list(keys), ignore_index=True)
+
+        table = pa.Table.from_pandas(daily, preserve_index=False)
+        state = {"keys": list(keys), "columns": list(columns), "scope": scope, "partitions": current}
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b"history_rollup": json.dumps(state).encode()})
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with replacing_file(cache_path) as tmp_path:
+            pq.write_table(table, tmp_path)
+        return daily
+
+    @staticmethod
+    def _partition_day(path):
+        return os.path.basename(path).split("=", 1)[1]
+
+
+class RollingIndex:
+    """Cumulative daily sums of a share's numerator and denominator per group.
+
+    ``numerators`` and ``denominators`` are ``(days + 1, groups)`` arrays
+    whose first row is zero, so the sum over days ``(t - w, t]`` is
+    ``cum[t] - cum[max(t - w, 0)]``.
+    """
+
+    def __init__(self, dates, groups, numerators, denominators):
+        self.dates = dates
+        self.groups = list(groups)
+        self.group_index = {group: i for i, group in enumerate(self.groups)}
+        self.numerators = np.vstack([np.zeros((1, len(self.groups))), np.cumsum(numerators, axis=0)])
+        self.denominators = np.vstack([np.zeros((1, len(self.groups))), np.cumsum(denominators, axis=0)])
+
+    @staticmethod
+    def _day_positions(daily):
+        start = daily[DATE_COLUMN].min()
+        dates = pd.date_range(start, daily[DATE_COLUMN].max(), freq="D")
+        return dates, ((daily[DATE_COLUMN] - start).dt.days).to_numpy()
+
+    @classmethod
+    def from_daily(cls, daily, keys, numerator="total_danone", denominator="total_bottles"):
+        # One group per distinct `keys` value, days without data count zero
+        if daily.empty:
+            return cls(pd.DatetimeIndex([]), [], np.zeros((0, 0)), np.zeros((0, 0)))
+        dates, positions = cls._day_positions(daily)
+        grouped = daily.groupby(keys, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        groups = [" / ".join(map(str, values if isinstance(values, tuple) else (values,)))
+                  for values in grouped.size().index]
+        # Flat (day, group) cell of every row; bincount sums rows sharing a cell
+        cells = positions * len(groups) + codes
+        size = len(dates) * len(groups)
+        shape = (len(dates), len(groups))
+        numerators = np.bincount(cells, weights=daily[numerator].to_numpy(dtype=np.float64), minlength=size).reshape(shape)
+        denominators = np.bincount(cells, weights=daily[denominator].to_numpy(dtype=np.float64), minlength=size).reshape(shape)
+        return cls(dates, groups, numerators, denominators)
+
+    @classmethod
+    def for_brands(cls, daily, brands, denominator="total_bottles"):
+        # Each brand's share of all bottles; `daily` has one row per day
+        if daily.empty:
+            return cls(pd.DatetimeIndex([]), [], np.zeros((0, 0)), np.zeros((0, 0)))
+        brands = [brand for brand in brands if brand in daily.columns]
+        dates, positions = cls._day_positions(daily)
+        numerators = np.zeros((len(dates), len(brands)))
+        denominators = np.zeros((len(dates), len(brands)))
+        numerators[positions] = daily[brands].to_numpy(dtype=np.float64)
+        denominators[positions] = daily[[denominator]].to_numpy(dtype=np.float64)
+        return cls(dates, brands, numerators, denominators)
+
+    def window_sums(self, window, groups=None):
+        # (days, groups) numerator and denominator sums over the trailing window
+        columns = slice(None) if groups is None else [self.group_index[group] for group in groups]
+        end = np.arange(1, len(self.dates) + 1)
+        start = np.maximum(end - window, 0)
+        numerators = self.numerators[:, columns]
+        denominators = self.denominators[:, columns]
+        return numerators[end] - numerators[start], denominators[end] - denominators[start]
+
+    def query(self, window, groups=None):
+        # Long frame of the trailing-window share (in %) for every day and group
+        groups = self.groups if groups is None else list(groups)
+        numerators, denominators = self.window_sums(window, groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shares = np.where(denominators > 0, numerators / denominators * 100, np.nan)
+        return pd.DataFrame({
+            DATE_COLUMN: np.repeat(self.dates, len(groups)),
+            "group": np.tile(np.asarray(groups, dtype=object), len(self.dates)),
+            "share": shares.ravel(),
+            "bottles": denominators.ravel(),
+        })
+
+    def latest(self, window):
+        # (group, share, bottles) over the window ending on the last day
+        if not len(self.dates):
+            return pd.DataFrame(columns=["group", "share", "bottles"])
+        frame = self.query(window)
+        return frame[frame[DATE_COLUMN] == self.dates[-1]].drop(columns=DATE_COLUMN).reset_index(drop=True)
+
+
+def build_rolling_index(store, level, brands=(), cache_dir=None, region=None, post_codes=None,
+                        exclude_post_codes=None):
+    # Trend index for one of LEVELS from the stored daily sums; with a
+    # cache_dir the daily sums are read incrementally through HistoryStore.rollup.
+    # The post code filters scope it to a region, which gets its own cache file.
+    keys = LEVELS[level]
+    columns = list(brands) + ["total_bottles"] if level == "brand" else ["total_danone", "total_bottles"]
+    if cache_dir is None:
+        daily = store.daily(keys, columns, post_codes=post_codes, exclude_post_codes=exclude_post_codes)
+    else:
+        name = f"history-{level}.parquet" if region is None else f"history-{region}-{level}.parquet"
+        daily = store.rollup(keys, columns, os.path.join(cache_dir, name), post_codes=post_codes,
+                             exclude_post_codes=exclude_post_codes)
+    if level == "brand":
+        return RollingIndex.for_brands(daily, brands)
+    return RollingIndex.from_daily(daily, keys)
@@ -0,0 +1,262 @@
+"""Firestore ingestion for the detection collection.
+
+Reads only the fields ``preprocess_docs`` uses, filters ``photo_type ==
+'Prod'`` on the server, and pages through the collection with cursors. The
+document-id key space is split into shards that are fetched concurrently;
+pages are folded into a ``ShelfAggregator`` on the calling thread.
+
+Set FIRESTORE_EMULATOR_HOST to run against the local emulator:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python ingestion.py
+"""
+import argparse
+import datetime
+import json
+import os
+import queue
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from google.cloud.firestore_v1 import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from history import DATE_FIELD
+
+QUERY_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data", "config", "query_config.json")
+
+# Everything preprocess_docs reads; `predictions` brings every predictions_* field
+PROJECTION = [
+    "predictions",
+    "post_code",
+    "store_type",
+    "store_name",
+    FieldPath("shelf id").to_api_repr(),
+    "photo_type",
+    "Num_bottles",
+]
+
+# Auto-generated document ids are uniform over this alphabet (in byte order)
+DOCUMENT_ID_ALPHABET = "".join(sorted(string.digits + string.ascii_letters))
+
+# Firestore orders values of different types by type first; the cursor keeps
+# the largest value in that order. The `>` filter of the next run only
+# matches values of the cursor's type, so the field should hold one type.
+CURSOR_TYPE_ORDER = (bool, (int, float), datetime.datetime, str, bytes)
+
+
+@dataclass
+class IngestionStats:
+    documents: int = 0
+    pages: int = 0
+    reads: int = 0
+    seconds: float = 0.0
+    cursor: object = None
+    # Documents per validation rule, plus "quarantined"
+    validation: dict = None
+
+    @property
+    def docs_per_second(self):
+        return self.documents / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        text = (f"{self.documents} documents in {self.pages} pages, {self.reads} reads, "
+                f"{self.seconds:.2f}s ({self.docs_per_second:.0f} docs/s)")
+        if self.validation:
+            rules = ", ".join(f"{rule}: {n}" for rule, n in self.validation.items() if n and rule != "quarantined")
+            text += f"; {self.validation.get('quarantined', 0)} quarantined ({rules or 'no rule broken'})"
+        return text
+
+
+def document_id_shards(n_shards):
+    # [low, high) document-id ranges covering the whole key space; None is open
+    step = len(DOCUMENT_ID_ALPHABET) / n_shards
+    bounds = [DOCUMENT_ID_ALPHABET[round(i * step)] for i in range(1, n_shards)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def cursor_key(value):
+    for rank, types in enumerate(CURSOR_TYPE_ORDER):
+        if isinstance(value, types):
+            return rank, value
+    raise TypeError(f"unsupported cursor value {value!r}")
+
+
+def load_collection_name(path=QUERY_CONFIG_PATH):
+    with open(path, "r") as json_file:
+        return json.load(json_file)["db_schema_name"]
+
+
+def get_client():
+    # The Firestore client picks up FIRESTORE_EMULATOR_HOST by itself
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore
+        return firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bottle-vision"))
+
+    import firebase_admin
+    from firebase_admin import firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app()
+    return firestore.client()
+
+
+class FirestoreIngestor:
+    def __init__(self, client, collection=None, page_size=500, n_shards=8, max_workers=8,
+                 cursor_field=None, max_pending_pages=32):
+        self.client = client
+        self.collection = client.collection(collection or load_collection_name())
+        self.page_size = page_size
+        self.n_shards = n_shards
+        self.max_workers = max_workers
+        # Optional monotonically increasing field (e.g. an upload timestamp)
+        # used to read only documents newer than the last refresh
+        self.cursor_field = cursor_field
+        self.max_pending_pages = max_pending_pages
+
+    def _query(self, shard, since):
+        query = self.collection.where(filter=FieldFilter("photo_type", "==", "Prod"))
+        low, high = shard
+        if low is not None:
+            query = query.where(filter=FieldFilter(FieldPath.document_id(), ">=", self.collection.document(low)))
+        if high is not None:
+            query = query.where(filter=FieldFilter(FieldPath.document_id(), "<", self.collection.document(high)))
+        if since is not None and self.cursor_field:
+            query = query.where(filter=FieldFilter(self.cursor_field, ">", since))
+            query = query.order_by(self.cursor_field)
+        extra = [field for field in (self.cursor_field, DATE_FIELD) if field and field not in PROJECTION]
+        projection = PROJECTION + list(dict.fromkeys(extra))
+        return query.select(projection).order_by(FieldPath.document_id()).limit(self.page_size)
+
+    def iter_pages(self, shard=(None, None), since=None):
+        query = self._query(shard, since)
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            yield page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    def stream_pages(self, since=None, stats=None):
+        # Fetch every shard concurrently; pages are handed back to the caller's
+        # thread through a bounded queue so memory stays at a few pages
+        pages = queue.Queue(maxsize=self.max_pending_pages)
+        done = object()
+        cancelled = threading.Event()
+
+        def fetch(shard):
+            try:
+                for page in self.iter_pages(shard, since):
+                    if cancelled.is_set():
+                        return
+                    pages.put(page)
+            finally:
+                pages.put(done)
+
+        shards = document_id_shards(self.n_shards)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(fetch, shard) for shard in shards]
+            remaining = len(shards)
+            try:
+                while remaining:
+                    page = pages.get()
+                    if page is done:
+                        remaining -= 1
+                        continue
+                    if stats is not None:
+                        stats.pages += 1
+                        stats.documents += len(page)
+                        # Firestore bills one read per document, and one for an empty result
+                        stats.reads += max(len(page), 1)
+                    yield page
+            finally:
+                cancelled.set()
+                while any(not future.done() for future in futures):
+                    try:
+                        pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+            for future in futures:
+                future.result()
+
+    def ingest(self, aggregator):
+        # Fold every new document into the aggregator and advance its cursor
+        stats = IngestionStats(cursor=aggregator.cursor)
+        start = time.perf_counter()
+        for page in self.stream_pages(since=aggregator.cursor, stats=stats):
+            aggregator.update(page)
+            if self.cursor_field:
+                for snapshot in page:
+                    # A full read also returns documents without the field
+                    # (or with it null); the next run's filter skips them anyway
+                    try:
+                        value = snapshot.get(self.cursor_field)
+                    except KeyError:
+                        continue
+                    if value is not None and (stats.cursor is None or cursor_key(value) > cursor_key(stats.cursor)):
+                        stats.cursor = value
+        stats.seconds = time.perf_counter() - start
+        aggregator.cursor = stats.cursor
+        if aggregator.validator is not None:
+            stats.validation = dict(aggregator.validation_counts)
+        return stats
+
+
+def refresh_snapshot(checkpoint_path=None, snapshot_path=None, cursor_field=None, page_size=500, n_shards=8,
+                     history_path=None, quarantine_path=None, validate=True):
+    # Ingest into the checkpointed sums, record the new days in the history
+    # store, set flagged documents aside and rewrite the columnar snapshot
+    from data_loader import CACHE_DIR, HISTORY_PATH, QUARANTINE_PATH, SNAPSHOT_PATH, load_labels
+    from history import HistoryStore
+    from snapshot import write_snapshot
+    from streaming import ShelfAggregator
+    from validation import QuarantineStore, Validator
+
+    checkpoint_path = checkpoint_path or os.path.join(CACHE_DIR, "ingestion_checkpoint.pkl")
+    snapshot_path = snapshot_path or SNAPSHOT_PATH
+    history = HistoryStore(history_path or HISTORY_PATH)
+    labels = load_labels()
+    validator = Validator(labels) if validate else None
+    quarantine = QuarantineStore(quarantine_path or QUARANTINE_PATH) if validate else None
+
+    # Without a cursor field every run is a full read, so start from empty sums
+    if cursor_field:
+        aggregator = ShelfAggregator.from_checkpoint(checkpoint_path, labels, history=history,
+                                                     validator=validator, quarantine=quarantine)
+    else:
+        aggregator = ShelfAggregator(labels, history=history, validator=validator, quarantine=quarantine)
+    ingestor = FirestoreIngestor(get_client(), page_size=page_size, n_shards=n_shards,
+                                 cursor_field=cursor_field)
+    stats = ingestor.ingest(aggregator)
+
+    # A full read holds every document of the days it saw: replace those days
+    aggregator.flush_history(replace=not cursor_field)
+    aggregator.flush_quarantine(replace=not cursor_field)
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    aggregator.save_checkpoint(checkpoint_path)
+    write_snapshot(aggregator.result(), snapshot_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read new detections from Firestore and rewrite the snapshot")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--snapshot", default=None)
+    parser.add_argument("--cursor-field", default=None)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--history", default=None)
+    parser.add_argument("--quarantine", default=None)
+    parser.add_argument("--no-validate", action="store_true", help="aggregate every document unchecked")
+    args = parser.parse_args()
+
+    print(refresh_snapshot(args.checkpoint, args.snapshot, args.cursor_field, args.page_size, args.shards,
+                           args.history, args.quarantine, validate=not args.no_validate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Per-stage timing and memory for the dashboard's hot paths.
+
+Off by default. Set BOTTLE_VISION_PROFILE=1 to record wall time for every
+function decorated with ``timed`` and every ``stage`` block; add
+BOTTLE_VISION_PROFILE_MEMORY=1 to also record each stage's tracemalloc peak
+(tracing makes Python code noticeably slower). When profiling is off,
+``timed`` returns the function unchanged and ``stage`` a shared no-op
+context, so the hooks cost nothing on the serving path.
+"""
+import bisect
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+ENABLED = os.environ.get("BOTTLE_VISION_PROFILE", "") == "1"
+TRACE_MEMORY = ENABLED and os.environ.get("BOTTLE_VISION_PROFILE_MEMORY", "") == "1"
+
+# Prometheus-style cumulative latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = nullcontext()
+
+
+class StageStats:
+    def __init__(self, max_samples=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.samples = deque(maxlen=max_samples)
+        self.peak_bytes = None
+
+    def add(self, seconds, peak_bytes=None):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.samples.append(seconds)
+        if peak_bytes is not None:
+            self.peak_bytes = max(self.peak_bytes or 0, peak_bytes)
+
+
+class Registry:
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._frames = threading.local()
+
+    def record(self, name, seconds, peak_bytes=None):
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = StageStats()
+            stats.add(seconds, peak_bytes)
+
+    @contextmanager
+    def stage(self, name):
+        if not TRACE_MEMORY:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.record(name, time.perf_counter() - start)
+            return
+
+        # tracemalloc keeps one global peak: reset it for this stage and hand
+        # the stage's own peak up to the enclosing one when it finishes
+        frames = self._frames.__dict__.setdefault("stack", [])
+        current, peak = tracemalloc.get_traced_memory()
+        if frames:
+            frames[-1][1] = max(frames[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, 0]
+        frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            frames.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], frame[1])
+            if frames:
+                frames[-1][1] = max(frames[-1][1], peak)
+            self.record(name, seconds, peak - frame[0])
+
+    def snapshot(self):
+        # name -> summary dict, plus the raw recent samples for histograms
+        with self._lock:
+            stages = {name: (stats.count, stats.total, stats.max, list(stats.bucket_counts),
+                             list(stats.samples), stats.peak_bytes)
+                      for name, stats in self._stages.items()}
+        report = {}
+        for name, (count, total, max_seconds, bucket_counts, samples, peak_bytes) in stages.items():
+            ordered = sorted(samples)
+            report[name] = {
+                "count": count,
+                "total_seconds": total,
+                "mean_seconds": total / count if count else 0.0,
+                "p50_seconds": ordered[len(ordered) // 2] if ordered else 0.0,
+                "p95_seconds": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] if ordered else 0.0,
+                "max_seconds": max_seconds,
+                "peak_bytes": peak_bytes,
+                "bucket_counts": bucket_counts,
+                "samples": samples,
+            }
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+REGISTRY = Registry()
+
+
+def stage(name):
+    # `with stage("name"):` around any block worth timing
+    if not ENABLED:
+        return _NOOP
+    return REGISTRY.stage(name)
+
+
+def record(name, seconds):
+    # For measurements that are not a block of code, e.g. time to first chart
+    if ENABLED:
+        REGISTRY.record(name, seconds)
+
+
+def timed(name=None):
+    # Decorator; the stage is named after the function unless given
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        stage_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.stage(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(figure_cache=None, refreshers=()):
+    """Current metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP bottle_vision_stage_seconds Wall time of instrumented dashboard stages.",
+        "# TYPE bottle_vision_stage_seconds histogram",
+    ]
+    stages = REGISTRY.snapshot()
+    for name, stats in sorted(stages.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), stats["bucket_counts"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'bottle_vision_stage_seconds_bucket{{stage="{_label(name)}",le="{le}"}} {cumulative}')
+        lines.append(f'bottle_vision_stage_seconds_sum{{stage="{_label(name)}"}} {stats["total_seconds"]!r}')
+        lines.append(f'bottle_vision_stage_seconds_count{{stage="{_label(name)}"}} {stats["count"]}')
+
+    peaks = [(name, stats["peak_bytes"]) for name, stats in sorted(stages.items()) if stats["peak_bytes"] is not None]
+    if peaks:
+        lines += ["# HELP bottle_vision_stage_peak_bytes Largest traced allocation peak of a stage.",
+                  "# TYPE bottle_vision_stage_peak_bytes gauge"]
+        lines += [f'bottle_vision_stage_peak_bytes{{stage="{_label(name)}"}} {peak}' for name, peak in peaks]
+
+    if figure_cache is not None:
+        figure_stats = sorted(figure_cache.stats().items())
+        for metric, key, kind, help_text in (
+                ("figure_cache_hits_total", "hits", "counter", "Figures served unchanged from the cache."),
+                ("figure_cache_updates_total", "updates", "counter", "Cached figures updated in place."),
+                ("figure_cache_misses_total", "misses", "counter", "Figures built from scratch."),
+                ("figure_cache_loads_total", "loads", "counter", "Figures loaded from the prebuilt store."),
+                ("figure_cache_evictions_total", "evictions", "counter", "Figures evicted from the cache."),
+                ("figure_payload_bytes", "payload_bytes", "gauge", "JSON size of the last figure built.")):
+            lines += [f"# HELP bottle_vision_{metric} {help_text}", f"# TYPE bottle_vision_{metric} {kind}"]
+            lines += [f'bottle_vision_{metric}{{helper="{_label(helper)}"}} {stats[key]}' for helper, stats in figure_stats]
+        lines += ["# HELP bottle_vision_figure_cache_bytes JSON size of every cached figure.",
+                  "# TYPE bottle_vision_figure_cache_bytes gauge",
+                  f"bottle_vision_figure_cache_bytes {figure_cache.total_bytes()}"]
+
+    if refreshers:
+        lines += ["# HELP bottle_vision_snapshot_version Version of the published data snapshot.",
+                  "# TYPE bottle_vision_snapshot_version gauge"]
+        metrics = [(region, refresher.metrics()) for region, refresher in refreshers]
+        lines += [f'bottle_vision_snapshot_version{{region="{_label(region)}"}} {m["version"]}' for region, m in metrics]
+        lines += ["# HELP bottle_vision_snapshot_refresh_failures_total Failed background rebuilds.",
+                  "# TYPE bottle_vision_snapshot_refresh_failures_total counter"]
+        lines += [f'bottle_vision_snapshot_refresh_failures_total{{region="{_label(region)}"}} {m["failures"]}'
+                  for region, m in metrics]
+
+    return "\n".join(lines) + "\n"
+
+
+if TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
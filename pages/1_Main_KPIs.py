@@ -1,13 +1,12 @@
-import pandas as pd
-import numpy as np
-import pickle
+import time
 import streamlit as st
-import geopandas as gpd
-import plotly.express as px
-from utils import *
-import json
-import streamlit as st
-import datetime
+from utils import plot_competitor_share, plot_correlation, plot_danone_share_map, plot_gauge_from_scalar
+from refresh import get_snapshot, render_data_status, select_region
+from progressive import render_sections
+import queries
+
+# Time to first chart is measured from here
+page_started = time.perf_counter()
 
 # import firebase_admin
 # from firebase_admin import credentials
@@ -16,79 +15,56 @@ import datetime
 
 st.set_page_config(page_title = 'Main KPIs', page_icon = '📊', layout = 'wide')
 
+region = select_region()
+
 # Add version info and last update time
 # st.sidebar.markdown("---")
-st.sidebar.markdown("**Version:** 1.0.0")
-st.sidebar.markdown(f"**Last Updated:** {datetime.datetime.now().strftime('%Y-%m-%d')}")
-
-brand_list = ['fontvella', 'viladrau', 'cabreiroa', 'vichy', 'lanjaron', 'bezoya', 'veri', 'aquabona', 'solan', 'evian', 'ribes', 'boix', 'aquarel', 'perrier', 'fonter', 'aquafina', 'fontagudes', 'aquadeus', 'casera', 'santaniol', 'cocacola']
-
-# Load local data for testing mode as firebase has 50K queried documents/day limit
-with open("./Data/df_docs.pkl", "rb") as file:
-    df_docs = pickle.load(file)
-
-df_docs.rename({"post_code":"COD_POSTAL"},axis=1, inplace=True)
-df_docs["danone_share"] = round(df_docs["danone_share"],2)
-
-# Competitor info load
-with open('./Data/competitor_danone_labels_dict.json', 'r') as json_file:
-    competitor_danone_labels_dict = json.load(json_file)
-
-# External Info: gross salary
-gross_salary_postcode_df = pd.read_csv("./Data/renta_barcelona.csv", sep=";", decimal=",")
-gross_salary_postcode_df['Cat_avg_Gross_Income'] = pd.qcut(gross_salary_postcode_df['Average Gross Income'], q=3, labels=['Low', 'Medium', 'High'])
-gross_salary_postcode_df['Cat_avg_Disposable_Income'] = pd.qcut(gross_salary_postcode_df['Average Disposable Income'], q=3, labels=['Low', 'Medium', 'High'])
-
-# Post codes geojson load
-gdf_post_code = gpd.read_file('./Data/BARCELONA.geojson', columns=["COD_POSTAL", "geometry"])
+render_data_status(region)
 
-gdf_post_code = gdf_post_code.merge(
-    gross_salary_postcode_df,
-    on=["COD_POSTAL"],
-    how="inner"
-)
+data = get_snapshot(region)
+df_docs = data.df_docs
+competitor_danone_labels_dict = data.competitor_danone_labels_dict
+gdf_post_code = data.gdf_post_code
+variables_list = data.variables_list
 
-# merge post codes and detections
-variables_list = list(df_docs.columns.intersection(brand_list))
+# Shares, podium and correlations are computed once per data snapshot
+shares = queries.shelf_shares(data)
+danone_shelf_share = shares["danone"]
+non_danone_shelf_share = shares["competitor"]
+reminder_share = shares["remainder"]
 
-post_code_data  = df_docs.drop(["store_type","store_name","shelf id"],axis=1).groupby("COD_POSTAL").sum().reset_index()
-
-gdf_post_code = gdf_post_code.merge(post_code_data, 
-                                    on="COD_POSTAL", 
-                                    how="left")
-
-danone_shelf_share = (df_docs["total_danone"] / df_docs["total_bottles"]).mean()
-non_danone_shelf_share = (df_docs["total_non_danone"] / df_docs["total_bottles"]).mean()
-reminder_share = 1 - (float(danone_shelf_share) + float(non_danone_shelf_share))
-
-correlations = {var: gdf_post_code ["Average Gross Income"].corr(gdf_post_code [var]) for var in variables_list}
-correlations_df = pd.DataFrame(list(correlations.items()), columns=["Variable", "Correlation"]).round(2)
-podium_df = pd.DataFrame({
-"Product": df_docs[variables_list].sum().index,
-"Share": (df_docs[variables_list].sum().values / df_docs["total_bottles"].sum() * 100).round(1),
-"Category": [competitor_danone_labels_dict[col] for col in variables_list]})
+correlations_df = queries.correlation_summary(data, "Average Gross Income")
+podium_df = queries.podium(data)
 
+# Lay out every section first; each placeholder is filled as soon as its
+# chart is ready, so the map no longer holds back the gauges and bar charts
 col1_1, col1_2, col1_3 = st.columns(3)
-    
-with col1_1:
-        st.plotly_chart(plot_gauge_from_scalar(danone_shelf_share.round(2), "Danone Shelf Share"))
-    
-with col1_2:
-        st.plotly_chart(plot_gauge_from_scalar(non_danone_shelf_share.round(2), "Competitor Shelf Share"))
-
-with col1_3:
-        st.plotly_chart(plot_gauge_from_scalar(reminder_share, "Bottles Shelf Share"))
+gauge_slots = [col.empty() for col in (col1_1, col1_2, col1_3)]
 
 # Create two columns of equal width
 col4, col5 = st.columns(2)
 
 with col4:
     st.header("Correlation of Income with Market Share",divider="grey")
-    plot_correlation(correlations_df)
+    correlation_slot = st.empty()
 
 with col5:
     st.header("Product Share by Category",divider="grey")
-    plot_competitor_share(podium_df)
+    competitor_slot = st.empty()
 
 st.header("Geographical Distribution of Danone Share",divider="grey")
-plot_danone_share_map(gdf_post_code)
+map_slot = st.empty()
+
+
+def render_gauges():
+    gauge_slots[0].plotly_chart(plot_gauge_from_scalar(round(danone_shelf_share, 2), "Danone Shelf Share"))
+    gauge_slots[1].plotly_chart(plot_gauge_from_scalar(round(non_danone_shelf_share, 2), "Competitor Shelf Share"))
+    gauge_slots[2].plotly_chart(plot_gauge_from_scalar(reminder_share, "Bottles Shelf Share"))
+
+
+render_sections([
+    render_gauges,
+    lambda: plot_correlation(correlations_df, container=correlation_slot),
+    lambda: plot_competitor_share(podium_df, container=competitor_slot),
+    lambda: plot_danone_share_map(gdf_post_code, data.geometry, container=map_slot),
+], metric="main_kpis", started=page_started)
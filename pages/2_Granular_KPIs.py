@@ -1,78 +1,80 @@
-import pandas as pd
-import numpy as np
-import pickle
 import streamlit as st
-import geopandas as gpd
-import plotly.express as px
-from utils import *
-import json
-import streamlit as st
-import datetime
-
-with open("./Data/df_docs.pkl", "rb") as file:
-    df_docs = pickle.load(file)
-
-df_docs.rename({"post_code":"COD_POSTAL"},axis=1, inplace=True)
-df_docs["danone_share"] = round(df_docs["danone_share"],2)
-codigos_postales = df_docs['COD_POSTAL'].unique()
-
-brand_list = ['fontvella', 'viladrau', 'cabreiroa', 'vichy', 'lanjaron', 'bezoya', 'veri', 'aquabona', 'solan', 'evian', 'ribes', 'boix', 'aquarel', 'perrier', 'fonter', 'aquafina', 'fontagudes', 'aquadeus', 'casera', 'santaniol', 'cocacola']
-
-# Competitor info load
-with open('./Data/competitor_danone_labels_dict.json', 'r') as json_file:
-    competitor_danone_labels_dict = json.load(json_file)
-
-# External Info: gross salary
-gross_salary_postcode_df = pd.read_csv("./Data/renta_barcelona.csv", sep=";", decimal=",")
-gross_salary_postcode_df['Cat_avg_Gross_Income'] = pd.qcut(gross_salary_postcode_df['Average Gross Income'], q=3, labels=['Low', 'Medium', 'High'])
-gross_salary_postcode_df['Cat_avg_Disposable_Income'] = pd.qcut(gross_salary_postcode_df['Average Disposable Income'], q=3, labels=['Low', 'Medium', 'High'])
-
-# Post codes geojson load
-gdf_post_code = gpd.read_file('./Data/BARCELONA.geojson', columns=["COD_POSTAL", "geometry"])
-
-gdf_post_code = gdf_post_code.merge(
-    gross_salary_postcode_df,
-    on=["COD_POSTAL"],
-    how="inner"
-)
-
-# merge post codes and detections
-variables_list = list(df_docs.columns.intersection(brand_list))
-
-post_code_data  = df_docs.drop(["store_type","store_name","shelf id"],axis=1).groupby("COD_POSTAL").sum().reset_index()
-
-gdf_post_code = gdf_post_code.merge(post_code_data, 
-                                    on="COD_POSTAL", 
-                                    how="left")
-
-df_in = pd.melt(df_docs[df_docs.columns.intersection(list(competitor_danone_labels_dict.keys()) + ["COD_POSTAL"])],
-                    id_vars=['COD_POSTAL'],
-                    var_name='brand',
-                    value_name='value')
-df_in['Category'] = df_in['brand'].map(competitor_danone_labels_dict)
-df_in.loc[df_in.Category == "competitor", "value"] = df_in.loc[df_in.Category == "competitor", "value"] * -1
+from utils import divergence_plot_from_selection, plot_interactive
+from crossfilter import CrossFilter
+from refresh import get_snapshot, render_data_status, select_region
+import queries
+
+region = select_region()
+data = get_snapshot(region)
+df_docs = data.df_docs
+competitor_danone_labels_dict = data.competitor_danone_labels_dict
+gdf_post_code = data.gdf_post_code
+variables_list = data.variables_list
+shelf_index = data.shelf_index
 
 st.set_page_config(page_title = 'Main KPIs', page_icon = '📊', layout = 'wide')
 
-post_code_select = st.sidebar.selectbox('Select Post Code:', codigos_postales)
+# Selections and cached aggregates of this session, over this snapshot's bitmaps
+cross_filter = st.session_state.get("cross_filter")
+if cross_filter is None or cross_filter.index is not shelf_index:
+    cross_filter = st.session_state.cross_filter = CrossFilter(shelf_index)
+    # Drop selections the new snapshot does not have
+    for dimension in shelf_index.values:
+        if dimension in st.session_state:
+            st.session_state[dimension] = [value for value in st.session_state[dimension]
+                                           if value in shelf_index.value_index[dimension]]
+
+def select_post_codes_from_map():
+    # Clicking a polygon filters the divergence chart to that post code
+    points = st.session_state.post_code_map.selection.points
+    clicked = [point.get("location") for point in points]
+    clicked = [post_code for post_code in clicked if post_code in shelf_index.value_index["post_code"]]
+    if clicked:
+        st.session_state.post_code = clicked
+
+if "post_code" not in st.session_state:
+    st.session_state.post_code = shelf_index.values["post_code"][:1]
+post_code_select = st.sidebar.multiselect('Post Codes:', shelf_index.values["post_code"], key="post_code",
+                                          placeholder="All post codes")
 score_column = st.sidebar.selectbox(
             'Select Score Column:',
             options=variables_list,
             index=0
         )
+store_type_select = st.sidebar.multiselect('Store Types:', shelf_index.values["store_type"], key="store_type",
+                                           placeholder="All store types")
+brand_select = st.sidebar.multiselect('Shelves carrying:', shelf_index.values["brand"], key="brand",
+                                      placeholder="Any brand")
+income_tier_select = st.sidebar.multiselect('Income Tiers:', shelf_index.values["income_tier"], key="income_tier",
+                                            placeholder="All income tiers")
+for dimension, selection in (("post_code", post_code_select), ("store_type", store_type_select),
+                             ("brand", brand_select), ("income_tier", income_tier_select)):
+    cross_filter.select(dimension, selection)
 
 # Add version info and last update time
 st.sidebar.markdown("---")
-st.sidebar.markdown("**Version:** 1.0.0")
-st.sidebar.markdown(f"**Last Updated:** {datetime.datetime.now().strftime('%Y-%m-%d')}")
+render_data_status(region)
 
 col1,col2 = st.columns(2)
 
 with col1:
- st.header(f"Brand performance\nPost Code: {post_code_select}",divider="grey")
- filtered_df = df_in[df_in['COD_POSTAL'] == post_code_select]
- divergence_plot_plotly(filtered_df, post_code_select)
+ post_code_label = ", ".join(post_code_select) if post_code_select else "All"
+ st.header(f"Brand performance\nPost Code: {post_code_label}",divider="grey")
+ selection, summary = cross_filter.divergence()
+ divergence_plot_from_selection(selection)
+ if summary.shelves:
+  st.caption(f"Danone share {summary.danone_share:.1f}% of {summary.total_bottles:.0f} bottles "
+             f"on {summary.shelves:.0f} shelves")
 
 with col2:
  st.header(f"Postcode brand presence\n{score_column}",divider = "grey")
- plot_interactive(gdf_post_code, score_column)
+ map_data = gdf_post_code
+ if cross_filter.filters_map:
+  # Same polygons, values summed over the filtered shelves only
+  map_data = gdf_post_code[["COD_POSTAL", "Average Gross Income"]].merge(
+      cross_filter.map_values(score_column), on="COD_POSTAL", how="left")
+ plot_interactive(map_data, score_column, data.geometry, key="post_code_map", on_select=select_post_codes_from_map)
+ correlation = queries.correlation(data, score_column)
+ if correlation is not None:
+  st.caption(f"Correlation with Average Gross Income: {correlation['correlation']:.2f} "
+             f"(95% CI {correlation['ci_low']:.2f} to {correlation['ci_high']:.2f}, {correlation['n']} post codes)")
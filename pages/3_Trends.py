@@ -0,0 +1,38 @@
+import streamlit as st
+from utils import plot_trend
+from data_loader import load_trends
+from history import WINDOWS
+from refresh import render_data_status, select_region
+
+st.set_page_config(page_title = 'Trends', page_icon = '📈', layout = 'wide')
+
+region = select_region()
+render_data_status(region)
+
+levels = {"Post Code": "post_code", "Store": "store", "Brand": "brand"}
+level_select = st.sidebar.radio('Group By:', list(levels))
+window_select = st.sidebar.radio('Rolling Window (days):', WINDOWS, index=1, horizontal=True)
+
+rolling_index = load_trends(levels[level_select], region)
+
+if not rolling_index.groups:
+    st.info("No history yet. Daily aggregates are recorded every time ingestion.py reads new detections.")
+    st.stop()
+
+# Default to the biggest groups over the selected window (brands share one denominator)
+latest = rolling_index.latest(window_select).sort_values("share" if level_select == "Brand" else "bottles", ascending=False)
+group_select = st.sidebar.multiselect(f'Select {level_select}:', rolling_index.groups,
+                                      default=list(latest["group"].head(5)))
+
+col1, col2 = st.columns([3, 1])
+
+with col1:
+    # Brands are shown as their share of all bottles, the other levels as Danone share
+    st.header(f"{'Share of bottles' if level_select == 'Brand' else 'Danone share'} by {level_select.lower()}",divider="grey")
+    if group_select:
+        plot_trend(rolling_index.query(window_select, group_select), window_select)
+
+with col2:
+    st.header(f"Last {window_select} days",divider="grey")
+    st.dataframe(latest.rename(columns={"group": level_select, "share": "Share (%)", "bottles": "Bottles"}).round(1),
+                 hide_index=True, use_container_width=True)
@@ -0,0 +1,69 @@
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+from figure_cache import FIGURE_CACHE
+from instrumentation import ENABLED, REGISTRY, TRACE_MEMORY, prometheus_text
+from refresh import active_refreshers
+
+st.set_page_config(page_title = 'Performance', page_icon = '⏱️', layout = 'wide')
+
+# Only useful while profiling; everyone else gets a one-line hint
+if not ENABLED:
+    st.info("Performance metrics are off. Start the dashboard with BOTTLE_VISION_PROFILE=1 to record them.")
+    st.stop()
+
+stages = REGISTRY.snapshot()
+
+st.header("Stage latency",divider="grey")
+if stages:
+    stages_df = pd.DataFrame([
+        {"Stage": name,
+         "Calls": stats["count"],
+         "Mean (ms)": stats["mean_seconds"] * 1e3,
+         "p50 (ms)": stats["p50_seconds"] * 1e3,
+         "p95 (ms)": stats["p95_seconds"] * 1e3,
+         "Max (ms)": stats["max_seconds"] * 1e3,
+         "Total (s)": stats["total_seconds"],
+         "Peak memory (MB)": stats["peak_bytes"] / 2 ** 20 if stats["peak_bytes"] is not None else None}
+        for name, stats in stages.items()]).sort_values("Total (s)", ascending=False).round(2)
+    if not TRACE_MEMORY:
+        stages_df = stages_df.drop(columns="Peak memory (MB)")
+    st.dataframe(stages_df, hide_index=True, use_container_width=True)
+
+    stage_select = st.selectbox('Select Stage:', list(stages_df["Stage"]))
+    samples_df = pd.DataFrame({"Latency (ms)": [seconds * 1e3 for seconds in stages[stage_select]["samples"]]})
+    st.plotly_chart(px.histogram(samples_df, x="Latency (ms)", nbins=40, title=f"{stage_select}, last {len(samples_df)} calls"),
+                    use_container_width=True)
+else:
+    st.write("No stage has run yet in this process.")
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.header("Figure cache",divider="grey")
+    figure_stats = FIGURE_CACHE.stats()
+    if figure_stats:
+        st.dataframe(pd.DataFrame([
+            {"Helper": helper,
+             "Hit rate": stats["hit_rate"],
+             "Hits": stats["hits"],
+             "Updates": stats["updates"],
+             "Misses": stats["misses"],
+             "Loads": stats["loads"],
+             "Evictions": stats["evictions"],
+             "Mean build (ms)": stats["mean_build_seconds"] * 1e3,
+             "Payload (KB)": stats["payload_bytes"] / 1024}
+            for helper, stats in figure_stats.items()]).round(2), hide_index=True, use_container_width=True)
+    st.caption(f"{FIGURE_CACHE.total_bytes() / 2 ** 20:.1f} MB of figures cached")
+
+with col2:
+    st.header("Data snapshots",divider="grey")
+    refreshers = active_refreshers()
+    if refreshers:
+        st.dataframe(pd.DataFrame([dict(region=region, **refresher.metrics()) for region, refresher in refreshers]),
+                     hide_index=True, use_container_width=True)
+
+metrics_text = prometheus_text(FIGURE_CACHE, refreshers)
+st.download_button("Export Prometheus metrics", metrics_text, file_name="bottle_vision_metrics.prom", mime="text/plain")
+with st.expander("Prometheus text"):
+    st.code(metrics_text, language="text")
@@ -0,0 +1,48 @@
+"""Draw independent page sections concurrently, each as soon as it is ready.
+
+The page lays out its headers and one placeholder per section up front, then
+hands ``render_sections`` a list of callables that build their figures and
+draw them into those placeholders. They run on a thread pool that carries the
+session's script context, so Streamlit calls made from a worker land in the
+right session; the slowest section (usually the map) no longer holds back the
+others. The call returns once every section is drawn and re-raises the first
+error, so the page behaves as if the sections had run one after another.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from instrumentation import record
+
+
+def render_sections(sections, metric=None, started=None):
+    """Run ``sections`` (zero-argument callables) concurrently.
+
+    With ``metric`` set, the time from ``started`` (a ``time.perf_counter()``
+    value, by default the call itself) to the first and to the last finished
+    section is recorded as ``<metric>_first_chart`` and ``<metric>_all_charts``.
+    Returns the seconds to the first section.
+    """
+    started = time.perf_counter() if started is None else started
+    ctx = get_script_run_ctx()
+
+    def run(section):
+        add_script_run_ctx(ctx=ctx)
+        section()
+
+    first = None
+    # Threads are only kept for this run: they exit with the pool, so none
+    # of them keeps a finished session's context attached
+    with ThreadPoolExecutor(max_workers=max(len(sections), 1), thread_name_prefix="section") as pool:
+        futures = [pool.submit(run, section) for section in sections]
+        for future in as_completed(futures):
+            future.result()
+            if first is None:
+                first = time.perf_counter() - started
+    last = time.perf_counter() - started
+
+    if metric is not None and sections:
+        record(f"{metric}_first_chart", first)
+        record(f"{metric}_all_charts", last)
+    return first
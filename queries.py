@@ -0,0 +1,102 @@
+"""Dashboard KPIs as plain data, for the pages and for api.py.
+
+Every query takes a published ``DashboardData`` snapshot and returns dicts,
+lists or DataFrames read from what the snapshot already holds (stats,
+rollups, the brand cube), so a query costs a lookup, not a pass over the
+shelves. Nothing here imports Streamlit. Unknown post codes, store types,
+levels or columns raise ``KeyError``; unknown variables or methods
+``ValueError``.
+"""
+import numpy as np
+import pandas as pd
+
+from cube import ALL_STORE_TYPES
+from rollups import LEVELS
+from stats import INCOME_VARIABLES, METHODS
+
+
+def shelf_shares(data):
+    # Mean Danone / competitor / remaining share over stocked shelves (fractions)
+    stats = data.stats
+    return {
+        "danone": stats.danone_shelf_share,
+        "competitor": stats.competitor_shelf_share,
+        "remainder": stats.remainder_share,
+    }
+
+
+def podium(data):
+    # Product / Share / Category, in label order
+    return data.stats.podium
+
+
+def correlations(data, variable=None, method=None):
+    # Long frame of brand x income correlations with bootstrap intervals
+    frame = data.stats.correlations
+    if variable is not None:
+        _check(variable, INCOME_VARIABLES, "variable")
+        frame = frame[frame["variable"] == variable]
+    if method is not None:
+        _check(method, METHODS, "method")
+        frame = frame[frame["method"] == method]
+    return frame.reset_index(drop=True)
+
+
+def correlation_summary(data, variable='Average Gross Income', method="pearson"):
+    # Variable / Correlation frame, as drawn by plot_correlation
+    _check(variable, INCOME_VARIABLES, "variable")
+    _check(method, METHODS, "method")
+    return data.stats.correlation_summary(variable, method)
+
+
+def correlation(data, brand, variable='Average Gross Income', method="pearson"):
+    # One brand's correlation dict, or None for a brand without detections
+    return data.stats.correlation(brand, variable, method)
+
+
+def post_codes(data):
+    return list(data.codigos_postales)
+
+
+def store_types(data):
+    return [ALL_STORE_TYPES] + list(data.cube.store_types)
+
+
+def divergence(data, post_code, store_type=ALL_STORE_TYPES):
+    # Brand totals of one post code (and store type), competitors negated
+    selection = data.cube.select(post_code, store_type)
+    return pd.DataFrame({
+        "brand": np.concatenate([selection.danone_brands, selection.competitor_brands]),
+        "Category": ["Danone"] * len(selection.danone_brands) + ["competitor"] * len(selection.competitor_brands),
+        "value": np.concatenate([selection.danone_values, selection.competitor_values]),
+    })
+
+
+def post_code_summary(data, post_code, store_type=ALL_STORE_TYPES):
+    # Sums and shares of one post code, or of one store type within it;
+    # None when that store type has no shelves there
+    if store_type == ALL_STORE_TYPES:
+        return data.rollups.lookup("post_code", post_code)
+    return data.rollups.lookup("store_type", (post_code, store_type))
+
+
+def rollup(data, level):
+    # Every group of one rollup level, with its shares
+    if level not in LEVELS:
+        raise KeyError(level)
+    return data.rollups.frame(level)
+
+
+def shelves(data, columns=None):
+    # The shelf frame itself, for bulk pulls
+    if columns is None:
+        return data.df_docs
+    missing = [col for col in columns if col not in data.df_docs.columns]
+    if missing:
+        raise KeyError(missing[0])
+    return data.df_docs[list(columns)]
+
+
+def _check(value, allowed, name):
+    if value not in allowed:
+        raise ValueError(f"unknown {name} {value!r}; expected one of {', '.join(map(repr, allowed))}")
@@ -0,0 +1,168 @@
+import dataclasses
+import datetime
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import streamlit as st
+
+from data_loader import load_dashboard_data
+from regions import DEFAULT_REGION, REGIONS
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SECONDS = float(os.environ.get("BOTTLE_VISION_REFRESH_SECONDS", 300))
+# Set to pull new detections from Firestore before rebuilds
+INGEST_ON_REFRESH = os.environ.get("BOTTLE_VISION_INGEST", "") == "1"
+INGEST_CURSOR_FIELD = os.environ.get("BOTTLE_VISION_CURSOR_FIELD") or None
+# Without a cursor field every ingestion reads the whole collection, so it
+# runs at most this often instead of on every refresh
+FULL_READ_INTERVAL_SECONDS = float(os.environ.get("BOTTLE_VISION_FULL_READ_SECONDS", 24 * 3600))
+
+
+class SnapshotRefresher:
+    """Rebuilds the dashboard data on a background thread.
+
+    Readers call ``current()`` and get the last published snapshot; a new one
+    replaces it with a single reference assignment once it is fully built, so
+    a session never waits for a rebuild or sees a partial one.
+
+    ``ingest`` runs before a rebuild, at most once per ``ingest_interval``
+    seconds when one is given; the first run is one interval after start.
+    """
+
+    def __init__(self, build, interval=REFRESH_INTERVAL_SECONDS, ingest=None, ingest_interval=None):
+        self._build = build
+        self._ingest = ingest
+        self.interval = interval
+        self.ingest_interval = ingest_interval
+        self._last_ingest = time.monotonic()
+        self._snapshot = None
+        self._source = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.durations = deque(maxlen=100)
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Only the very first caller of a fresh process waits for a build
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def refresh(self):
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                if self._ingest is not None and self._snapshot is not None and self._ingest_due():
+                    self._ingest()
+                data = self._build()
+            except Exception as error:
+                self.failures += 1
+                self.last_error = repr(error)
+                logger.exception("Snapshot refresh failed")
+                if self._snapshot is None:
+                    raise
+                return False
+
+            self.refreshes += 1
+            self.durations.append(time.perf_counter() - start)
+            if data is self._source:
+                # Sources unchanged: keep serving the published snapshot
+                return False
+
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+            self._source = data
+            self._snapshot = dataclasses.replace(data, version=version, built_at=datetime.datetime.now())
+            return True
+
+    def _ingest_due(self):
+        now = time.monotonic()
+        if self.ingest_interval is not None and now - self._last_ingest < self.ingest_interval:
+            return False
+        self._last_ingest = now
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def metrics(self):
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot is not None else 0,
+            "built_at": snapshot.built_at if snapshot is not None else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_refresh_seconds": self.durations[-1] if self.durations else None,
+            "mean_refresh_seconds": sum(self.durations) / len(self.durations) if self.durations else None,
+        }
+
+
+def _ingest():
+    from ingestion import refresh_snapshot
+
+    stats = refresh_snapshot(cursor_field=INGEST_CURSOR_FIELD)
+    logger.info("Ingested %s", stats)
+
+
+_REFRESHERS = {}
+
+
+@st.cache_resource(show_spinner=False)
+def get_refresher(region=DEFAULT_REGION):
+    # One refresher per region, started the first time a page asks for it.
+    # Detections are shared by all regions, so only one of them ingests.
+    build = functools.partial(load_dashboard_data, region)
+    ingest, ingest_interval = None, None
+    if INGEST_ON_REFRESH and region == DEFAULT_REGION:
+        ingest = _ingest
+        if not INGEST_CURSOR_FIELD:
+            ingest_interval = FULL_READ_INTERVAL_SECONDS
+            logger.warning("BOTTLE_VISION_CURSOR_FIELD is not set: every ingestion reads the whole collection, "
+                           "so it runs every %.0f s instead of every refresh", ingest_interval)
+    refresher = _REFRESHERS[region] = SnapshotRefresher(build, ingest=ingest, ingest_interval=ingest_interval).start()
+    return refresher
+
+
+def active_refreshers():
+    # (region, refresher) for every region a page has loaded in this process
+    return sorted(_REFRESHERS.items())
+
+
+def get_snapshot(region=DEFAULT_REGION):
+    return get_refresher(region).current()
+
+
+def select_region():
+    # Sidebar region picker; hidden while only one region is registered
+    if len(REGIONS) == 1:
+        return DEFAULT_REGION
+    return st.sidebar.selectbox('Select City:', list(REGIONS), format_func=lambda key: REGIONS[key].name,
+                                key="region")
+
+
+def render_data_status(region=DEFAULT_REGION):
+    # Sidebar footer shared by every page
+    snapshot = get_snapshot(region)
+    st.sidebar.markdown("**Version:** 1.0.0")
+    st.sidebar.markdown(f"**Last Updated:** {snapshot.updated_at.strftime('%Y-%m-%d %H:%M')}")
+    st.sidebar.caption(f"Data snapshot v{snapshot.version}, built {snapshot.built_at.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -0,0 +1,36 @@
+import json
+import os
+from dataclasses import dataclass
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+REGIONS_CONFIG_PATH = os.path.join(DATA_DIR, "config", "regions.json")
+DEFAULT_REGION = "barcelona"
+
+
+@dataclass(frozen=True)
+class Region:
+    key: str
+    name: str
+    geojson_path: str
+    income_path: str
+
+
+def load_regions(path=REGIONS_CONFIG_PATH):
+    # Region key -> Region; file names in the config are relative to Data/
+    with open(path, 'r') as json_file:
+        config = json.load(json_file)
+    return {
+        key: Region(key=key,
+                    name=entry.get("name", key.title()),
+                    geojson_path=os.path.join(DATA_DIR, entry["geojson"]),
+                    income_path=os.path.join(DATA_DIR, entry["income"]))
+        for key, entry in config.items()
+    }
+
+
+REGIONS = load_regions()
+
+
+def get_region(key=DEFAULT_REGION):
+    return REGIONS[key]
+
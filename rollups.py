@@ -0,0 +1,202 @@
+"""Additive rollups of the shelf frame, precomputed once per snapshot.
+
+Every level of the hierarchy
+
+    shelf -> store -> store_type -> post_code -> income_category -> city
+
+stores sums only: brand counts, the Danone / competitor / total bottle
+counts, the number of shelves and of stocked shelves, and the sum of the
+per-shelf shares. Ratios are derived from those sums when a level is read,
+so a post code's Danone share is its Danone bottles over its bottles, not a
+sum of shelf percentages. Each level is built from the one below it, and its
+rows are looked up by key through a dict; ``children`` returns the rows of
+the level below that roll up into one row.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+LEVELS = ("shelf", "store", "store_type", "post_code", "income_category", "city")
+
+# Group keys of each level; each level's keys start with its parent's,
+# except income_category, which maps post codes through the income CSV
+LEVEL_KEYS = {
+    "shelf": ["COD_POSTAL", "store_type", "store_name", "shelf id"],
+    "store": ["COD_POSTAL", "store_type", "store_name"],
+    "store_type": ["COD_POSTAL", "store_type"],
+    "post_code": ["COD_POSTAL"],
+    "income_category": ["Cat_avg_Gross_Income"],
+    "city": [],
+}
+
+TOTAL_COLUMNS = ["total_danone", "total_non_danone", "total_bottles"]
+COUNT_COLUMNS = ["shelves", "stocked_shelves", "danone_shelf_share_sum", "competitor_shelf_share_sum"]
+
+# ratio name -> (numerator, denominator, scale)
+RATIOS = {
+    # Bottle-weighted, in percent: what the map shows per post code
+    "danone_share": ("total_danone", "total_bottles", 100),
+    "competitor_share": ("total_non_danone", "total_bottles", 100),
+    # Mean over stocked shelves, as a fraction: what the gauges show
+    "danone_shelf_share": ("danone_shelf_share_sum", "stocked_shelves", 1),
+    "competitor_shelf_share": ("competitor_shelf_share_sum", "stocked_shelves", 1),
+}
+
+UNKNOWN_CATEGORY = "Unknown"
+
+
+class RollupLevel:
+    def __init__(self, name, keys, values, parent_codes=None):
+        self.name = name
+        # keys: DataFrame of the group keys, one row per group
+        self.keys = keys.reset_index(drop=True)
+        self.values = values
+        self.values.setflags(write=False)
+        if len(self.keys.columns):
+            self.index = {key: i for i, key in enumerate(self.keys.itertuples(index=False, name=None))}
+        else:
+            self.index = {(): 0}
+        # Row of the parent level every group rolls up into
+        self.parent_codes = parent_codes
+        self.child_order = None
+        self.child_offsets = None
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _reduce(values, codes, n_groups):
+    # Sum the rows of `values` per group code; also returns the row order
+    # (grouped by code) and the start of each group within it
+    order = np.argsort(codes, kind="stable")
+    offsets = np.searchsorted(codes[order], np.arange(n_groups + 1))
+    sums = np.zeros((n_groups, values.shape[1]))
+    present = offsets[:-1] < offsets[1:]
+    if present.any():
+        sums[present] = np.add.reduceat(values[order], offsets[:-1][present], axis=0)
+    return sums, order, offsets
+
+
+class Rollups:
+    """The full hierarchy for one snapshot; shared read-only by every session."""
+
+    def __init__(self, levels, measures):
+        self.levels = levels
+        self.measures = list(measures)
+        self.measure_index = {measure: i for i, measure in enumerate(self.measures)}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    @timed("build_rollups")
+    def from_docs(cls, df_docs, brand_schema, brand_counts, income_categories=None):
+        """Build every level from the shelf frame.
+
+        ``income_categories`` maps COD_POSTAL to its income category (a Series
+        or a frame with both columns); post codes without one roll up into
+        ``UNKNOWN_CATEGORY``.
+        """
+        total_bottles = df_docs["total_bottles"].to_numpy(dtype=np.float64)
+        totals = df_docs[["total_danone", "total_non_danone"]].to_numpy(dtype=np.float64)
+        stocked = total_bottles > 0
+        shelf_shares = np.zeros_like(totals)
+        np.divide(totals, total_bottles[:, None], out=shelf_shares, where=stocked[:, None])
+
+        measures = list(brand_schema.brands) + TOTAL_COLUMNS + COUNT_COLUMNS
+        values = np.column_stack([brand_counts, totals, total_bottles, np.ones(len(df_docs)), stocked,
+                                  shelf_shares]).astype(np.float64)
+
+        # Shelf groups in key order, so every prefix level is a run of rows
+        shelf_keys = LEVEL_KEYS["shelf"]
+        grouped = df_docs[shelf_keys].groupby(shelf_keys, observed=True, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        shelf_values, order, offsets = _reduce(values, codes, grouped.ngroups)
+        # Rows without a complete key (code -1) sort first and are left out
+        levels = {"shelf": RollupLevel("shelf", df_docs[shelf_keys].iloc[order[offsets[:-1]]], shelf_values)}
+
+        child = levels["shelf"]
+        for name in LEVELS[1:]:
+            if name == "income_category":
+                keys = cls._income_keys(child.keys, income_categories)
+            else:
+                keys = child.keys[LEVEL_KEYS[name]]
+            if LEVEL_KEYS[name]:
+                parent_codes, uniques = pd.MultiIndex.from_frame(keys.astype(object)).factorize(sort=True)
+                parent_keys = pd.DataFrame(list(uniques), columns=LEVEL_KEYS[name])
+            else:
+                parent_codes, parent_keys = np.zeros(len(keys), dtype=np.intp), pd.DataFrame(index=[0])
+            sums, order, offsets = _reduce(child.values, parent_codes, len(parent_keys))
+            child.parent_codes = parent_codes
+            level = RollupLevel(name, parent_keys, sums)
+            level.child_order, level.child_offsets = order, offsets
+            levels[name] = level
+            child = level
+        return cls(levels, measures)
+
+    @staticmethod
+    def _income_keys(post_code_keys, income_categories):
+        if isinstance(income_categories, pd.DataFrame):
+            # The income CSV repeats some codes (e.g. "Others"): the first row wins
+            income_categories = income_categories.drop_duplicates("COD_POSTAL").set_index("COD_POSTAL")["Cat_avg_Gross_Income"]
+        if income_categories is None:
+            income_categories = pd.Series(dtype=object)
+        categories = post_code_keys["COD_POSTAL"].astype(object).map(income_categories.astype(object))
+        return pd.DataFrame({"Cat_avg_Gross_Income": categories.fillna(UNKNOWN_CATEGORY)})
+
+    def level(self, name):
+        return self.levels[name]
+
+    def lookup(self, level, key=()):
+        """Measures and ratios of one group as a dict, e.g. ``lookup("post_code", "08001")``.
+
+        Returns None for a key the level does not have.
+        """
+        level = self.levels[level]
+        key = key if isinstance(key, tuple) else (key,)
+        i = level.index.get(key)
+        if i is None:
+            return None
+        row = level.values[i]
+        result = dict(zip(self.measures, row.tolist()))
+        for ratio, (numerator, denominator, scale) in RATIOS.items():
+            result[ratio] = result[numerator] * scale / result[denominator] if result[denominator] > 0 else 0.0
+        return result
+
+    def frame(self, level):
+        """Keys, measures and ratios of every group of a level.
+
+        Built on first use and kept; treat it as read-only.
+        """
+        with self._lock:
+            frame = self._frames.get(level)
+            if frame is None:
+                frame = self._frames[level] = self._build_frame(self.levels[level])
+        return frame
+
+    def children(self, level, key=()):
+        # Rows of the level below `level` that roll up into `key`
+        parent = self.levels[level]
+        child_name = LEVELS[LEVELS.index(level) - 1]
+        key = key if isinstance(key, tuple) else (key,)
+        i = parent.index[key]
+        rows = parent.child_order[parent.child_offsets[i]:parent.child_offsets[i + 1]]
+        return self.frame(child_name).iloc[rows]
+
+    def _ratios(self, values):
+        ratios = {}
+        for ratio, (numerator, denominator, scale) in RATIOS.items():
+            num = values[:, self.measure_index[numerator]]
+            den = values[:, self.measure_index[denominator]]
+            out = np.zeros(len(values))
+            np.divide(num * scale, den, out=out, where=den > 0)
+            ratios[ratio] = out
+        return ratios
+
+    def _build_frame(self, level):
+        frame = pd.concat([level.keys, pd.DataFrame(level.values, columns=self.measures)], axis=1)
+        for ratio, values in self._ratios(level.values).items():
+            frame[ratio] = values
+        return frame
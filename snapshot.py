@@ -0,0 +1,103 @@
+"""Columnar snapshot of the preprocessed shelf frame.
+
+The output of ``preprocess_docs`` is written as Arrow IPC (Feather v2) files,
+one hive partition per post code (``post_code=08001/part-0.arrow``). Reads go
+through a memory-mapped filesystem, so only the requested columns and
+partitions are paged in.
+
+    python snapshot.py Data/df_docs.pkl Data/snapshot
+"""
+import argparse
+import os
+import pickle
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+from atomic import replacing_directory
+from instrumentation import stage, timed
+
+PARTITION_COLUMN = "post_code"
+SNAPSHOT_FORMAT = "feather"
+
+
+def _partitioning(partition_column):
+    return ds.partitioning(pa.schema([(partition_column, pa.string())]), flavor="hive")
+
+
+def write_snapshot(df_docs, path, partition_column=PARTITION_COLUMN):
+    table = pa.Table.from_pandas(df_docs, preserve_index=False)
+
+    # Build next to the target and swap directories, so readers never see a
+    # half-written snapshot
+    with replacing_directory(path) as tmp_path:
+        ds.write_dataset(table, tmp_path, format=SNAPSHOT_FORMAT,
+                         partitioning=_partitioning(partition_column),
+                         basename_template="part-{i}.arrow")
+
+
+def open_snapshot(path, partition_column=PARTITION_COLUMN):
+    return ds.dataset(path, format=SNAPSHOT_FORMAT,
+                      partitioning=_partitioning(partition_column),
+                      filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+@timed()
+def post_code_filter(column, post_codes=None, exclude_post_codes=None):
+    # Dataset filter keeping the rows of some post codes and dropping those of
+    # others; None when neither is given
+    row_filter = None
+    if post_codes is not None:
+        row_filter = ds.field(column).isin(list(post_codes))
+    if exclude_post_codes:
+        excluded = ~ds.field(column).isin(list(exclude_post_codes))
+        row_filter = excluded if row_filter is None else row_filter & excluded
+    return row_filter
+
+
+def read_snapshot(path, columns=None, post_codes=None, exclude_post_codes=None, partition_column=PARTITION_COLUMN):
+    dataset = open_snapshot(path, partition_column)
+
+    # Restore the column order of the frame that was written; the partition
+    # column would otherwise come back last
+    pandas_metadata = dataset.schema.pandas_metadata or {}
+    order = [col["name"] for col in pandas_metadata.get("columns", [])] or dataset.schema.names
+    if columns is None:
+        columns = [col for col in order if col in dataset.schema.names]
+    else:
+        columns = [col for col in order if col in columns]
+
+    # Both filters are on the partition column, so the partitions they rule
+    # out are skipped without being opened
+    row_filter = post_code_filter(partition_column, post_codes, exclude_post_codes)
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def read_docs(path, columns=None, post_codes=None, exclude_post_codes=None):
+    # Accept both a snapshot directory and the legacy df_docs.pkl pickle
+    if os.path.isdir(path):
+        return read_snapshot(path, columns=columns, post_codes=post_codes, exclude_post_codes=exclude_post_codes)
+
+    with stage("read_pickle"), open(path, "rb") as file:
+        df_docs = pickle.load(file)
+    if post_codes is not None:
+        df_docs = df_docs[df_docs[PARTITION_COLUMN].isin(list(post_codes))].reset_index(drop=True)
+    if exclude_post_codes:
+        df_docs = df_docs[~df_docs[PARTITION_COLUMN].isin(list(exclude_post_codes))].reset_index(drop=True)
+    if columns is not None:
+        df_docs = df_docs[[col for col in df_docs.columns if col in columns]]
+    return df_docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a preprocessed pickle into a columnar snapshot")
+    parser.add_argument("source", help="legacy df_docs.pkl")
+    parser.add_argument("target", help="snapshot directory to write")
+    args = parser.parse_args()
+
+    write_snapshot(read_docs(args.source), args.target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Shelf shares, podium and brand x income correlations for a snapshot.
+
+Correlations are computed for every (brand, income variable) pair at once:
+pairs are grouped by their pattern of missing post codes, and each group is
+reduced to weighted moment sums with matrix products (Spearman is the same
+on average ranks). A bootstrap resample is just a row weighting, so the
+confidence intervals come from the same products over a (batch, rows)
+weight matrix, without copying the data per resample.
+"""
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+INCOME_VARIABLES = ['Average Gross Income', 'Average Disposable Income']
+METHODS = ("pearson", "spearman")
+
+
+# Bootstrap batches are sized to stay around this many bytes of working arrays
+BATCH_BYTES = 64 * 1024 * 1024
+
+
+class _Ranker:
+    """Average ranks of every column under any row weighting.
+
+    Each column is sorted once; the ranks of a resample (rows weighted by how
+    often they were drawn) are then a cumulative sum over its tie groups.
+    """
+
+    def __init__(self, values):
+        self.columns = []
+        for column in values.T:
+            order = np.argsort(column, kind="stable")
+            ordered = column[order]
+            starts = np.ones(len(ordered), dtype=bool)
+            starts[1:] = ordered[1:] != ordered[:-1]
+            # Tie group of every row, in the original row order
+            row_groups = np.empty(len(order), dtype=np.intp)
+            row_groups[order] = np.cumsum(starts) - 1
+            self.columns.append((order, np.flatnonzero(starts), row_groups))
+
+    def ranks(self, weights):
+        # (batch, n) weights -> (columns, batch, n)
+        ranks = np.empty((len(self.columns),) + weights.shape)
+        for i, (order, starts, row_groups) in enumerate(self.columns):
+            sizes = np.add.reduceat(weights[:, order], starts, axis=1)
+            mean_ranks = np.cumsum(sizes, axis=1) - (sizes - 1) / 2
+            ranks[i] = mean_ranks[:, row_groups]
+        return ranks
+
+
+def _from_moments(n, sx, sy, sxx, syy, sxy):
+    # Weighted sums over n drawn rows -> (batch, k, m) correlations
+    mx, my = sx / n, sy / n
+    var_x = sxx / n - mx * mx
+    var_y = syy / n - my * my
+    cov = sxy / n - mx[:, :, None] * my[:, None, :]
+    # Columns that are constant in a resample have no correlation; the
+    # relative threshold absorbs rounding in var = E[x^2] - E[x]^2
+    var_x[var_x <= 1e-12 * sxx / n] = np.nan
+    var_y[var_y <= 1e-12 * syy / n] = np.nan
+    with np.errstate(invalid="ignore"):
+        r = cov / np.sqrt(var_x[:, :, None] * var_y[:, None, :])
+    return np.clip(r, -1.0, 1.0)
+
+
+class _PairGroup:
+    # Complete rows of one block of (value, target) columns, prepared once
+    # for the point estimate and every bootstrap batch
+
+    def __init__(self, x, y, methods):
+        self.n = len(x)
+        self.methods = methods
+        # Centred first: moments of small numbers keep their precision
+        self.x = x - x.mean(axis=0)
+        self.y = y - y.mean(axis=0)
+        self.products = (self.x[:, :, None] * self.y[:, None, :]).reshape(self.n, -1)
+        if "spearman" in methods:
+            self.rankers = (_Ranker(x), _Ranker(y))
+
+    def correlate(self, weights):
+        # (batch, n) resample counts -> {method: (batch, k, m)}
+        n, (k, m) = self.n, (self.x.shape[1], self.y.shape[1])
+        results = {}
+        if "pearson" in self.methods:
+            results["pearson"] = _from_moments(
+                n, weights @ self.x, weights @ self.y, weights @ (self.x * self.x), weights @ (self.y * self.y),
+                (weights @ self.products).reshape(-1, k, m))
+        if "spearman" in self.methods:
+            # Ranks of any resample average (n + 1) / 2
+            rx = self.rankers[0].ranks(weights) - (n + 1) / 2
+            ry = self.rankers[1].ranks(weights) - (n + 1) / 2
+            wx = weights * rx
+            wy = weights * ry
+            results["spearman"] = _from_moments(
+                n, wx.sum(axis=2).T, wy.sum(axis=2).T, (wx * rx).sum(axis=2).T, (wy * ry).sum(axis=2).T,
+                wx.transpose(1, 0, 2) @ ry.transpose(1, 2, 0))
+        return results
+
+
+def _mask_patterns(valid):
+    # Columns sharing the same rows of valid data: (row mask, column indices)
+    patterns = {}
+    for i, column in enumerate(np.packbits(valid, axis=0).T):
+        patterns.setdefault(column.tobytes(), []).append(i)
+    return [(valid[:, cols[0]], np.asarray(cols)) for cols in patterns.values()]
+
+
+def _resample_weights(rng, batch, n):
+    # How often each row is drawn in `batch` resamples of n rows with replacement
+    draws = rng.integers(0, n, size=(batch, n)) + np.arange(batch)[:, None] * n
+    return np.bincount(draws.ravel(), minlength=batch * n).reshape(batch, n).astype(np.float64)
+
+
+@dataclass(frozen=True)
+class CorrelationResult:
+    # (values, targets) arrays; low/high are NaN without a bootstrap
+    r: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    n: np.ndarray
+
+
+def correlation_matrix(values, targets, methods=METHODS, n_boot=1000, confidence=0.95, min_periods=2,
+                       batch_size=250, seed=0):
+    """Correlation of every column of ``values`` with every column of ``targets``.
+
+    Missing values are dropped pairwise, as ``Series.corr`` does. Returns
+    ``{method: CorrelationResult}`` with percentile bootstrap intervals from
+    ``n_boot`` resamples of the rows (0 skips the bootstrap).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    shape = (values.shape[1], targets.shape[1])
+    results = {method: CorrelationResult(np.full(shape, np.nan), np.full(shape, np.nan),
+                                         np.full(shape, np.nan), np.zeros(shape, dtype=np.int64))
+               for method in methods}
+    rng = np.random.default_rng(seed)
+    alpha = (1 - confidence) / 2 * 100
+
+    for value_rows, value_cols in _mask_patterns(~np.isnan(values)):
+        for target_rows, target_cols in _mask_patterns(~np.isnan(targets)):
+            rows = np.flatnonzero(value_rows & target_rows)
+            cells = np.ix_(value_cols, target_cols)
+            for result in results.values():
+                result.n[cells] = len(rows)
+            if len(rows) < min_periods:
+                continue
+
+            group = _PairGroup(values[np.ix_(rows, value_cols)], targets[np.ix_(rows, target_cols)], methods)
+            for method, r in group.correlate(np.ones((1, len(rows)))).items():
+                results[method].r[cells] = r[0]
+
+            if not n_boot:
+                continue
+            row_bytes = len(rows) * (len(value_cols) + len(target_cols)) * 8 * 3
+            batch = int(max(1, min(batch_size, BATCH_BYTES // row_bytes)))
+            samples = {method: [] for method in methods}
+            for start in range(0, n_boot, batch):
+                weights = _resample_weights(rng, min(batch, n_boot - start), len(rows))
+                for method, r in group.correlate(weights).items():
+                    samples[method].append(r)
+            for method, result in results.items():
+                boot = np.concatenate(samples[method])
+                with warnings.catch_warnings():
+                    # Pairs whose every resample was constant stay NaN
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    result.low[cells], result.high[cells] = np.nanpercentile(boot, [alpha, 100 - alpha], axis=0)
+    return results
+
+
+@timed()
+def correlation_frame(df, columns, variables=INCOME_VARIABLES, **kwargs):
+    # Long frame: one row per (brand, variable, method)
+    results = correlation_matrix(df[columns].to_numpy(dtype=np.float64),
+                                 df[variables].to_numpy(dtype=np.float64), **kwargs)
+    frames = []
+    for method, result in results.items():
+        frames.append(pd.DataFrame({
+            "brand": np.repeat(columns, len(variables)),
+            "variable": np.tile(variables, len(columns)),
+            "method": method,
+            "correlation": result.r.ravel(),
+            "ci_low": result.low.ravel(),
+            "ci_high": result.high.ravel(),
+            "n": result.n.ravel(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def correlation_summary(correlations, variable='Average Gross Income', method="pearson"):
+    # Variable / Correlation frame drawn by plot_correlation
+    selected = correlations[(correlations["variable"] == variable) & (correlations["method"] == method)]
+    return pd.DataFrame({"Variable": selected["brand"].to_numpy(),
+                         "Correlation": selected["correlation"].to_numpy()}).round(2)
+
+
+@dataclass(frozen=True)
+class DashboardStats:
+    danone_shelf_share: float
+    competitor_shelf_share: float
+    remainder_share: float
+    podium: pd.DataFrame
+    correlations: pd.DataFrame
+
+    @classmethod
+    def from_data(cls, rollups, brand_schema, gdf_post_code, variables_list, **kwargs):
+        # Shares and brand sums are the city row of the rollups
+        city = rollups.lookup("city")
+        danone_share, competitor_share = city["danone_shelf_share"], city["competitor_shelf_share"]
+        remainder_share = 1 - (danone_share + competitor_share) if city["stocked_shelves"] else 0.0
+        brand_sums = np.array([city[brand] for brand in brand_schema.brands])
+        return cls(
+            danone_shelf_share=float(danone_share),
+            competitor_shelf_share=float(competitor_share),
+            remainder_share=float(remainder_share),
+            podium=brand_schema.podium_from_sums(brand_sums, city["total_bottles"]),
+            correlations=correlation_frame(gdf_post_code, list(variables_list), **kwargs),
+        )
+
+    def correlation_summary(self, variable='Average Gross Income', method="pearson"):
+        return correlation_summary(self.correlations, variable, method)
+
+    def correlation(self, brand, variable='Average Gross Income', method="pearson"):
+        # One row of the long frame as a dict, or None for an unknown brand
+        selected = self.correlations[(self.correlations["brand"] == brand) & (self.correlations["variable"] == variable)
+                                     & (self.correlations["method"] == method)]
+        return selected.iloc[0].to_dict() if len(selected) else None
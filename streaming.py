@@ -0,0 +1,145 @@
+import os
+import pickle
+from itertools import islice
+
+import pandas as pd
+
+from atomic import replacing_file
+from history import DATE_COLUMN, daily_shelf_sums, document_dates
+from utils import SHELF_KEYS, prepare_frame
+from validation import QUARANTINE_COLUMNS, quarantine_frame
+
+
+def iter_chunks(docs, chunk_size):
+    # Split any iterable of documents into lists of at most chunk_size items
+    docs = iter(docs)
+    while True:
+        chunk = list(islice(docs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ShelfAggregator:
+    """Running per-shelf sums equivalent to ``preprocess_docs``.
+
+    Documents are folded in chunk by chunk, so memory is bounded by the number
+    of shelves rather than the number of documents. ``cursor`` holds the
+    ingestion cursor (the largest value of the ingestor's ``cursor_field``
+    read so far); the ingestor advances it, and ``save_checkpoint`` persists
+    it with the sums.
+
+    With a ``validation.Validator``, every chunk is checked before it is
+    aggregated: quarantined documents are left out of the sums, and flagged
+    ones wait in ``pending_quarantine`` until ``flush_quarantine()`` writes
+    them to the ``quarantine`` store. ``validation_counts`` holds the
+    documents per rule seen by this aggregator.
+    """
+
+    def __init__(self, competitor_danone_labels_dict, history=None, validator=None, quarantine=None):
+        self.competitor_danone_labels_dict = competitor_danone_labels_dict
+        self.sums = None
+        self.columns = []
+        self.cursor = None
+        self.docs_seen = 0
+        # Optional HistoryStore; day-level sums wait in `pending_history`
+        # until flush_history() writes them
+        self.history = history
+        self.pending_history = []
+        self.validator = validator
+        self.quarantine = quarantine
+        self.pending_quarantine = []
+        self.validation_counts = {}
+
+    def update(self, docs):
+        docs = list(docs)
+        records = [elem.to_dict() if hasattr(elem, "to_dict") else elem for elem in docs]
+        self.docs_seen += len(records)
+        if not records:
+            return
+
+        df_raw = pd.json_normalize(records, sep='_')
+        if self.validator is not None:
+            df_raw = self._validate(df_raw, docs, records)
+        df_chunk = prepare_frame(df_raw, self.competitor_danone_labels_dict)
+        if df_chunk.empty:
+            return
+
+        if self.history is not None:
+            self.pending_history.append(daily_shelf_sums(df_chunk, document_dates(docs, records), SHELF_KEYS))
+
+        # numeric_only: timestamp fields (e.g. the ingestion cursor) are not summed
+        partial = df_chunk.drop(["photo_type"], axis=1).groupby(SHELF_KEYS).sum(numeric_only=True)
+
+        # Keep the first-seen column order so the result lines up with preprocess_docs
+        self.columns += [col for col in partial.columns if col not in self.columns]
+        if self.sums is None:
+            self.sums = partial
+        else:
+            self.sums = self.sums.add(partial, fill_value=0)
+
+    def _validate(self, df_raw, docs, records):
+        report = self.validator.validate(df_raw)
+        counts = report.counts()
+        quarantined = report.quarantined
+        counts["quarantined"] = int(quarantined.sum())
+        for rule, n in counts.items():
+            self.validation_counts[rule] = self.validation_counts.get(rule, 0) + n
+        if self.quarantine is not None and report.flagged.any():
+            self.pending_quarantine.append(quarantine_frame(report, records, [getattr(elem, "id", None) for elem in docs]))
+        # The index keeps each row's position in `records`, for the history dates
+        return df_raw[~quarantined].copy() if quarantined.any() else df_raw
+
+    def consume(self, docs, chunk_size=500):
+        for chunk in iter_chunks(docs, chunk_size):
+            self.update(chunk)
+        return self
+
+    def flush_history(self, replace=False):
+        # Write the buffered day-level sums as one file per day
+        if not self.pending_history:
+            return
+        daily = pd.concat(self.pending_history, ignore_index=True)
+        daily = daily.groupby([DATE_COLUMN] + SHELF_KEYS).sum().reset_index()
+        self.history.append(daily, replace=replace)
+        self.pending_history = []
+
+    def flush_quarantine(self, replace=False):
+        # Write the flagged documents buffered since the last flush
+        if self.quarantine is None:
+            return
+        # A full read that found nothing still clears the previous table
+        frames = self.pending_quarantine
+        if frames or replace:
+            flagged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=QUARANTINE_COLUMNS)
+            self.quarantine.append(flagged, replace=replace)
+        self.pending_quarantine = []
+
+    def result(self):
+        if self.sums is None:
+            return pd.DataFrame(columns=SHELF_KEYS)
+        return self.sums[self.columns].fillna(0).sort_index().reset_index()
+
+    def save_checkpoint(self, path):
+        state = {
+            "sums": self.sums,
+            "columns": self.columns,
+            "cursor": self.cursor,
+            "docs_seen": self.docs_seen,
+        }
+        # Write to a temporary file first so a crash never leaves a torn checkpoint
+        with replacing_file(path) as tmp_path, open(tmp_path, "wb") as file:
+            pickle.dump(state, file)
+
+    @classmethod
+    def from_checkpoint(cls, path, competitor_danone_labels_dict, history=None, validator=None, quarantine=None):
+        aggregator = cls(competitor_danone_labels_dict, history=history, validator=validator, quarantine=quarantine)
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+            aggregator.sums = state["sums"]
+            aggregator.columns = state["columns"]
+            aggregator.cursor = state["cursor"]
+            aggregator.docs_seen = state["docs_seen"]
+        return aggregator
+
@@ -0,0 +1,185 @@
+"""Data-quality checks on detection documents, before they are aggregated.
+
+``prepare_docs`` fills every gap with 0 and clamps ``total_bottles`` to the
+predicted total, so bad documents vanish into the shelf sums. ``Validator``
+runs a fixed set of rules over the normalized chunk, one column operation per
+rule, and returns a ``ValidationReport`` with one boolean column per rule.
+Documents failing a quarantine rule are left out of the aggregation; every
+flagged document (quarantined or not) can be kept in a ``QuarantineStore``
+side table with the rules it broke.
+
+Rules:
+
+- ``negative_count``: a brand count or ``Num_bottles`` below zero
+- ``implausible_count``: a count that is not a whole number, or above
+  ``max_count`` for one photo
+- ``missing_store_key``: an empty post code, store type, store name or shelf id
+- ``unknown_brand``: a ``predictions_*`` brand missing from the label dict
+- ``predicted_over_reported``: more Danone and competitor bottles predicted
+  than ``Num_bottles`` reports (``preprocess_docs`` clamps these)
+"""
+import json
+import os
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from atomic import replacing_directory, replacing_file
+from brand_schema import BrandSchema
+from instrumentation import timed
+
+PREDICTION_PREFIX = "predictions_"
+STORE_KEYS = ["post_code", "store_type", "store_name", "shelf id"]
+
+RULES = ("negative_count", "implausible_count", "missing_store_key", "unknown_brand", "predicted_over_reported")
+# Documents breaking these are not aggregated; the others are only flagged
+QUARANTINE_RULES = ("negative_count", "implausible_count", "missing_store_key")
+
+QUARANTINE_COLUMNS = ["ingested_at", "doc_id", "rules", "quarantined", "document"]
+
+# Bottles of one brand, or in total, on a single shelf photo
+MAX_COUNT = 500
+
+
+@dataclass(frozen=True)
+class ValidationReport:
+    # flags: one bool column per rule, aligned with the validated frame
+    flags: pd.DataFrame
+    quarantine_rules: tuple
+
+    @property
+    def flagged(self):
+        return self.flags.any(axis=1).to_numpy()
+
+    @property
+    def quarantined(self):
+        return self.flags[list(self.quarantine_rules)].any(axis=1).to_numpy()
+
+    def counts(self):
+        # Documents breaking each rule
+        return {rule: int(n) for rule, n in self.flags.sum().items()}
+
+    def rule_names(self):
+        # Comma-separated rules broken by each document, "" when clean
+        names = np.asarray([rule + "," for rule in self.flags.columns], dtype=object)
+        joined = (self.flags.to_numpy().astype(object) * names).sum(axis=1)
+        return pd.Series(joined, index=self.flags.index, dtype=object).str.rstrip(",")
+
+
+class Validator:
+    def __init__(self, competitor_danone_labels_dict, max_count=MAX_COUNT, quarantine_rules=QUARANTINE_RULES):
+        self.brand_schema = BrandSchema.from_labels(competitor_danone_labels_dict)
+        self.max_count = max_count
+        self.quarantine_rules = tuple(quarantine_rules)
+
+    @timed("validate_docs")
+    def validate(self, df_raw):
+        """Check a ``pd.json_normalize`` frame of documents (before ``fillna``).
+
+        Only 'Prod' photos are checked; ``prepare_docs`` drops the rest anyway.
+        """
+        n = len(df_raw)
+        prod = self._column(df_raw, "photo_type").eq("Prod").to_numpy()
+
+        prediction_cols = [col for col in df_raw.columns if col.startswith(PREDICTION_PREFIX)]
+        brands = [col[len(PREDICTION_PREFIX):] for col in prediction_cols]
+        # Non-numeric values become NaN here and are told apart from absent ones below
+        counts = df_raw[prediction_cols]
+        if all(dtype.kind in "biuf" for dtype in counts.dtypes):
+            counts = counts.to_numpy(dtype=np.float64)
+        else:
+            counts = counts.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+        present = df_raw[prediction_cols].notna().to_numpy() if prediction_cols else np.zeros((n, 0), dtype=bool)
+        reported = pd.to_numeric(self._column(df_raw, "Num_bottles"), errors="coerce").to_numpy(dtype=np.float64)
+        reported_present = self._column(df_raw, "Num_bottles").notna().to_numpy()
+
+        with np.errstate(invalid="ignore"):
+            negative = (counts < 0).any(axis=1) | (reported < 0)
+            not_numeric = (present & np.isnan(counts)).any(axis=1) | (reported_present & np.isnan(reported))
+            fractional = (~np.isnan(counts) & (counts != np.floor(counts))).any(axis=1)
+            fractional |= ~np.isnan(reported) & (reported != np.floor(reported))
+            too_many = (counts > self.max_count).any(axis=1) | (reported > self.max_count)
+
+        missing_key = np.zeros(n, dtype=bool)
+        for key in STORE_KEYS:
+            values = self._column(df_raw, key)
+            missing_key |= np.char.strip(values.fillna("").to_numpy(dtype=str)) == ""
+
+        known = np.asarray([brand in self.brand_schema.index for brand in brands], dtype=bool)
+        unknown = present[:, ~known].any(axis=1)
+
+        # Same totals as prepare_docs: Danone and competitor brands, absent
+        # counts and a missing Num_bottles taken as 0
+        in_totals = self.brand_schema.weights.sum(axis=1)
+        weights = np.asarray([in_totals[self.brand_schema.index[brand]] if found else 0.0
+                              for brand, found in zip(brands, known)])
+        predicted = np.nan_to_num(counts) @ weights if brands else np.zeros(n)
+        over_reported = predicted > np.nan_to_num(reported)
+
+        flags = pd.DataFrame({
+            "negative_count": negative,
+            "implausible_count": not_numeric | fractional | too_many,
+            "missing_store_key": missing_key,
+            "unknown_brand": unknown,
+            "predicted_over_reported": over_reported,
+        }, index=df_raw.index)
+        flags[~prod] = False
+        return ValidationReport(flags, self.quarantine_rules)
+
+    @staticmethod
+    def _column(df, name):
+        return df[name] if name in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def quarantine_frame(report, records, doc_ids=None):
+    # Side-table rows for the flagged documents of one validated chunk; the
+    # index of report.flags is the position in `records`
+    flagged = np.flatnonzero(report.flagged)
+    positions = report.flags.index.to_numpy()[flagged]
+    quarantined = report.quarantined[flagged]
+    return pd.DataFrame({
+        "ingested_at": pd.Timestamp.now(tz="UTC"),
+        "doc_id": [doc_ids[i] if doc_ids is not None else None for i in positions],
+        "rules": report.rule_names().to_numpy()[flagged],
+        "quarantined": quarantined,
+        "document": [json.dumps(records[i], default=str, sort_keys=True) for i in positions],
+    })
+
+
+class QuarantineStore:
+    """Flagged documents as Parquet files, one per ingestion run."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, frame, replace=False):
+        # With replace the new file supersedes the whole table (full re-reads)
+        if frame.empty and not replace:
+            return
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if replace:
+            with replacing_directory(self.path) as tmp_path:
+                if not frame.empty:
+                    pq.write_table(table, os.path.join(tmp_path, name))
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            with replacing_file(os.path.join(self.path, name)) as tmp_file:
+                pq.write_table(table, tmp_file)
+
+    def read(self):
+        files = sorted(entry.path for entry in os.scandir(self.path)
+                       if entry.name.endswith(".parquet") and not entry.name.startswith(".")) \
+            if os.path.isdir(self.path) else []
+        if not files:
+            return pd.DataFrame(columns=QUARANTINE_COLUMNS)
+        return pd.concat([pq.read_table(file).to_pandas() for file in files], ignore_index=True)
+
+    def rule_counts(self):
+        # Stored documents per rule
+        rules = self.read()["rules"].str.split(",").explode()
+        return {rule: int(n) for rule, n in rules[rules.ne("")].value_counts().items()}
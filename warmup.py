@@ -0,0 +1,95 @@
+"""Prebuild what a new dashboard process would otherwise build on its first request.
+
+Run it when building the image (or before restarting the server):
+
+    python warmup.py
+
+1. byte-compiles the app, so the first import does not compile;
+2. writes the columnar snapshot from the legacy pickle if there is none, or
+   if it is older than the pickle;
+3. loads every registered region, which caches the simplified post-code
+   GeoJSON in ``Data/cache``, and the Trends rollups if there is history;
+4. renders each page once, headlessly, and stores every figure it builds in
+   ``figure_cache.FIGURE_STORE_PATH``; the server loads those instead of
+   building them.
+"""
+import argparse
+import compileall
+import os
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["Home.py", "pages/1_Main_KPIs.py", "pages/2_Granular_KPIs.py", "pages/3_Trends.py"]
+
+
+def _step(name, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{name:<10} {time.perf_counter() - start:>7.2f}s")
+    return result
+
+
+def compile_app():
+    compileall.compile_dir(APP_DIR, maxlevels=0, quiet=1)
+    compileall.compile_dir(os.path.join(APP_DIR, "pages"), maxlevels=0, quiet=1)
+
+
+def build_snapshot():
+    from data_loader import DOCS_PATH, SNAPSHOT_PATH
+    from snapshot import read_docs, write_snapshot
+
+    if not os.path.exists(DOCS_PATH):
+        return
+    if os.path.isdir(SNAPSHOT_PATH) and os.path.getmtime(SNAPSHOT_PATH) >= os.path.getmtime(DOCS_PATH):
+        return
+    write_snapshot(read_docs(DOCS_PATH), SNAPSHOT_PATH)
+
+
+def load_data(regions):
+    from data_loader import HISTORY_PATH, load_dashboard_data, load_trends
+    from history import LEVELS
+
+    for region in regions:
+        load_dashboard_data(region)
+        if os.path.isdir(HISTORY_PATH):
+            for level in LEVELS:
+                load_trends(level, region)
+
+
+def render_pages(pages, timeout=300):
+    from streamlit.testing.v1 import AppTest
+
+    from figure_cache import FIGURE_CACHE, FIGURE_STORE_PATH, FigureStore
+
+    if not FIGURE_STORE_PATH:
+        return 0
+    # Figures of older data or chart code would only take up space
+    store = FigureStore(FIGURE_STORE_PATH, writable=True)
+    store.clear()
+    FIGURE_CACHE.store = store
+    FIGURE_CACHE.clear()
+    for page in pages:
+        app = AppTest.from_file(os.path.join(APP_DIR, page), default_timeout=timeout).run()
+        if app.exception:
+            raise RuntimeError(f"{page} failed: {app.exception[0].message}")
+    return sum(1 for entry in os.scandir(store.directory) if entry.name.endswith(".json"))
+
+
+def main():
+    from regions import REGIONS
+
+    parser = argparse.ArgumentParser(description="Prebuild the snapshot, geometry cache and default figures")
+    parser.add_argument("--regions", nargs="+", default=list(REGIONS))
+    parser.add_argument("--no-figures", action="store_true", help="skip rendering the pages")
+    args = parser.parse_args()
+
+    _step("compile", compile_app)
+    _step("snapshot", build_snapshot)
+    _step("data", load_data, args.regions)
+    if not args.no_figures:
+        figures = _step("figures", render_pages, PAGES)
+        print(f"{figures} figures stored")
+
+
+if __name__ == "__main__":
+    main()